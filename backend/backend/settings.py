@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 
 from pathlib import Path
 import os
+from celery.schedules import crontab
 from dotenv import load_dotenv
 import dj_database_url
 
@@ -144,7 +145,187 @@ CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_BACKEND = "redis://redis:6379/0"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers:DatabaseScheduler"
 
-EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
+# Beat interval of each periodic task, used to warn when a run gets close to
+# overlapping the next one
+TASK_SCHEDULE_SECONDS = {
+    "aggregate_metrics_task": 60,
+    "archive_raw_metrics_task": 3600,
+    "compact_aggregated_metrics_task": 3600,
+    "cleanup_raw_metrics_task": 86400,
+    "record_pipeline_health_task": 60,
+    "dispatch_alert_notifications_task": 60,
+}
+TASK_RUNTIME_WARNING_RATIO = 0.8
+
+# Runtime budget of tasks queued on demand rather than by beat
+TASK_ON_DEMAND_SECONDS = {
+    "evaluate_aggregated_metrics_task": 60,
+    "deliver_notifications_task": 120,
+    "send_alert_email_task": 60,
+    "reaggregate_metrics_task": 600,
+}
+
+# Time limits relative to each task's interval or budget: at the soft limit
+# the task gets SoftTimeLimitExceeded, at the hard limit its process is
+# killed. Both leave headroom for slow runs (a minute's aggregation can take
+# ~70s): aggregate_metrics_task gets 120s/150s, and AGGREGATION_LEASE_SECONDS
+# must outlive the hard limit.
+TASK_SOFT_TIME_LIMIT_RATIO = 2.0
+TASK_TIME_LIMIT_RATIO = 2.5
+CELERY_TASK_ANNOTATIONS = {
+    f"core.tasks.{name}": {
+        "soft_time_limit": seconds * TASK_SOFT_TIME_LIMIT_RATIO,
+        "time_limit": seconds * TASK_TIME_LIMIT_RATIO,
+    }
+    for name, seconds in {**TASK_SCHEDULE_SECONDS, **TASK_ON_DEMAND_SECONDS}.items()
+}
+
+# Queues, each consumed by its own worker pool (see docker-compose.yml):
+# - aggregation: minute-critical aggregation and policy evaluation
+# - notifications: alert fan-out and delivery to email/webhooks
+# - maintenance: hourly/daily archive, compaction and cleanup, and
+#   re-aggregation after bulk imports
+# Priorities order tasks within a queue; on Redis 0 is the highest and
+# priorities are grouped into the priority_steps below.
+CELERY_TASK_DEFAULT_QUEUE = "maintenance"
+CELERY_TASK_ROUTES = {
+    "core.tasks.aggregate_metrics_task": {"queue": "aggregation", "priority": 0},
+    "core.tasks.evaluate_aggregated_metrics_task": {"queue": "aggregation", "priority": 3},
+    "core.tasks.record_pipeline_health_task": {"queue": "aggregation", "priority": 6},
+    "core.tasks.dispatch_alert_notifications_task": {"queue": "notifications", "priority": 0},
+    "core.tasks.send_alert_email_task": {"queue": "notifications", "priority": 3},
+    "core.tasks.deliver_notifications_task": {"queue": "notifications", "priority": 3},
+    "core.tasks.archive_raw_metrics_task": {"queue": "maintenance", "priority": 3},
+    "core.tasks.compact_aggregated_metrics_task": {"queue": "maintenance", "priority": 6},
+    "core.tasks.reaggregate_metrics_task": {"queue": "maintenance", "priority": 6},
+    "core.tasks.cleanup_raw_metrics_task": {"queue": "maintenance", "priority": 9},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": [0, 3, 6, 9],
+    "sep": ":",
+    # A worker consuming several queues drains them in the order given to -Q
+    "queue_order_strategy": "priority",
+}
+# Reserve one task per process at a time so a long task can't hold back
+# prefetched higher-priority ones; workers may raise it per queue
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Synced into the database scheduler on beat startup
+CELERY_BEAT_SCHEDULE = {
+    "archive-raw-metrics": {
+        "task": "core.tasks.archive_raw_metrics_task",
+        "schedule": crontab(minute=15),
+    },
+    "compact-aggregated-metrics": {
+        "task": "core.tasks.compact_aggregated_metrics_task",
+        "schedule": crontab(minute=20),
+    },
+    "record-pipeline-health": {
+        "task": "core.tasks.record_pipeline_health_task",
+        "schedule": 60.0,
+    },
+    "dispatch-alert-notifications": {
+        "task": "core.tasks.dispatch_alert_notifications_task",
+        "schedule": 60.0,
+    },
+}
+
+# Aggregation
+# Distinct endpoints kept per project per hour (the most requested first);
+# the rest are folded into the "__other__" series.
+AGGREGATION_MAX_ENDPOINTS_PER_PROJECT = int(
+    os.getenv("AGGREGATION_MAX_ENDPOINTS_PER_PROJECT", "500")
+)
+
+# Each minute's window is split into this many project shards, aggregated by
+# separate tasks. Keep it fixed while workers run: a window's shards are
+# recorded in the AggregationWindow ledger by index.
+AGGREGATION_SHARDS = int(os.getenv("AGGREGATION_SHARDS", "1"))
+# Lifetime of the per-(window, shard) lease (core/leases.py); longer than
+# aggregate_metrics_task's hard time limit
+AGGREGATION_LEASE_SECONDS = 180
+# A window that hits the soft time limit is handed to one catch-up run with
+# this soft limit (its hard limit and lease add a minute each)
+AGGREGATION_CATCHUP_TIME_LIMIT = 600
+
+# "python", or "numpy" for the vectorized engine (core/vectorized.py), which
+# is faster on windows with millions of rows and produces identical buckets
+AGGREGATION_ENGINE = os.getenv("AGGREGATION_ENGINE", "python")
+
+# Days each aggregated resolution is kept (None keeps it forever). A
+# resolution is never pruned past the newest bucket it is compacted into
+# (1m/5m -> 1h -> 1d -> 1w, core/compaction.py).
+AGGREGATED_RETENTION_DAYS = {
+    "1m": 7,
+    "5m": 30,
+    "1h": 180,
+    "1d": 1825,
+    "1w": None,
+}
+# Completed 1d/1w buckets recomputed on every compaction run, so late 1h
+# rows still land in their day
+COMPACTION_LOOKBACK_BUCKETS = 2
+# Buckets recomputed per query when compacting a longer range (after an import)
+COMPACTION_CHUNK_BUCKETS = 7
+
+# Minutes a series stays expected after its last traffic; silent expected
+# series are evaluated as zero-valued buckets (core/series.py)
+SERIES_EXPECTED_MINUTES = 30
+
+# Requests kept per bucket as exemplars: the slowest N and a sample of N 5xx
+EXEMPLARS_SLOWEST = 5
+EXEMPLARS_ERRORS = 5
+
+# Shared Redis for rate limiting and other request-path state
+REDIS_URL = os.getenv("REDIS_URL", CELERY_BROKER_URL)
+
+# Ingest quotas (per API key, overridable per project). A rate of 0 disables
+# rate limiting.
+INGEST_DEFAULT_RATE_PER_SECOND = float(os.getenv("INGEST_DEFAULT_RATE_PER_SECOND", "100"))
+INGEST_DEFAULT_BURST = int(os.getenv("INGEST_DEFAULT_BURST", "500"))
+
+# Global load shedding: reject ingest with 503 while aggregation is more than
+# INGEST_LOAD_SHED_BACKLOG_SECONDS behind (the age of the oldest raw data not
+# yet aggregated; 0 disables), or unconditionally when INGEST_LOAD_SHED is set.
+INGEST_LOAD_SHED = os.getenv("INGEST_LOAD_SHED", "") == "1"
+INGEST_LOAD_SHED_BACKLOG_SECONDS = int(os.getenv("INGEST_LOAD_SHED_BACKLOG_SECONDS", "600"))
+INGEST_LOAD_SHED_CHECK_SECONDS = 5
+# API keys each worker remembers as denied, to reject them without Redis
+INGEST_DENIED_CACHE_SIZE = 10000
+
+# Raw ingest batches: metrics per request, and the size a gzip-encoded body
+# may expand to
+INGEST_MAX_BATCH_SIZE = 1000
+INGEST_MAX_DECOMPRESSED_BYTES = 10 * 1024 * 1024
+
+# Ingest dedup by event_id (core/dedup.py): retries within the window are
+# dropped. Memory is bounded by (PARTITIONS + 1) Bloom filters sized for
+# CAPACITY ids each (~1.8 MB per filter at the defaults).
+INGEST_DEDUP_WINDOW_SECONDS = int(os.getenv("INGEST_DEDUP_WINDOW_SECONDS", "3600"))
+INGEST_DEDUP_PARTITIONS = 4
+INGEST_DEDUP_CAPACITY = int(os.getenv("INGEST_DEDUP_CAPACITY", "1000000"))
+INGEST_DEDUP_ERROR_RATE = 0.001
+
+# Columnar archive of raw metrics (Arrow IPC, one file per project-hour)
+RAW_ARCHIVE_DIR = Path(os.getenv("RAW_ARCHIVE_DIR", BASE_DIR / "archive"))
+RAW_ARCHIVE_RETENTION_DAYS = int(os.getenv("RAW_ARCHIVE_RETENTION_DAYS", "90"))
+RAW_ARCHIVE_GRACE_MINUTES = 10
+RAW_ARCHIVE_CATCHUP_HOURS = 24
+
+# Pipeline self-monitoring. Health is also recorded as metrics of a built-in
+# project so regular AlertPolicies can alert on it.
+SYSTEM_PROJECT_NAME = "__pipeline__"
+HEALTH_CELERY_QUEUES = ["aggregation", "notifications", "maintenance"]
+HEALTH_INGEST_SAMPLE_SECONDS = 30
+# Newest raw timestamp: taken over this many most recently inserted rows
+HEALTH_RECENT_RAW_ROWS = 10000
+# Newest 1m bucket: only buckets starting within this window are considered
+HEALTH_BUCKET_LOOKBACK_SECONDS = 6 * 3600
+HEALTH_MAX_AGGREGATION_LAG_SECONDS = 180
+
+# e.g. django.core.mail.backends.locmem.EmailBackend or .console.EmailBackend
+# to keep alert digests local
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
 
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_PORT = 587
@@ -155,6 +336,37 @@ EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD")   # <-- app password, no
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Alert notifications are coalesced into one digest per project/recipient per
+# window, sent over a single connection and rate limited per recipient.
+NOTIFICATION_BATCH_WINDOW_SECONDS = int(os.getenv("NOTIFICATION_BATCH_WINDOW_SECONDS", 60))
+NOTIFICATION_RATE_PER_MINUTE = int(os.getenv("NOTIFICATION_RATE_PER_MINUTE", 2))
+NOTIFICATION_BURST = 5
+NOTIFICATION_MAX_ALERTS_PER_DISPATCH = 1000
+# How long a dispatch's claim on the alerts it is mailing holds; must outlive
+# dispatch_alert_notifications_task's hard time limit
+NOTIFICATION_CLAIM_SECONDS = 300
+
+# Longest window (minutes) a windowed or burn-rate policy may use. Ring
+# buffers live in Redis when REDIS_URL is set, otherwise in worker memory.
+ALERT_WINDOW_MAX_MINUTES = 1440
+
+# Per-process cache lifetime of each project's policy index (core/policy_index.py)
+POLICY_INDEX_TTL_SECONDS = 30
+
+# Streaming baselines for anomaly policies (core/baselines.py)
+BASELINE_EWMA_ALPHA = 0.05
+BASELINE_SEASONAL = True
+BASELINE_SEASONAL_ALPHA = 0.02
+BASELINE_MIN_SAMPLES = 30
+BASELINE_MIN_STDDEV_RATIO = 0.05
+
+# Webhook / Slack delivery pool (core/delivery.py)
+NOTIFICATION_HTTP_TIMEOUT_SECONDS = 5
+NOTIFICATION_HTTP_POOL_SIZE = 50
+NOTIFICATION_MAX_ATTEMPTS = 4
+NOTIFICATION_RETRY_BACKOFF_SECONDS = 1.0
+NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS = 30.0
+
 
 
 DATABASES = {
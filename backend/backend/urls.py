@@ -18,21 +18,31 @@ from django.contrib import admin
 from django.urls import path
 from core.views import (
     IngestMetricView,
+    IngestAggregatedMetricView,
     list_projects,
     create_project,
     list_raw_metrics,
+    query_archived_metrics,
     list_aggregated_metrics,
     get_alerts,
     get_policies,
+    prometheus_metrics,
+    system_health,
+    notification_channels,
 )
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", prometheus_metrics),
     path("api/ingest/", IngestMetricView.as_view()),
+    path("api/ingest/aggregated/", IngestAggregatedMetricView.as_view()),
     path("api/projects/", list_projects),
     path("api/projects/create/", create_project),
     path("api/projects/<uuid:project_id>/metrics/", list_raw_metrics),
+    path("api/projects/<uuid:project_id>/metrics/archive/", query_archived_metrics),
     path("api/projects/<uuid:project_id>/metrics/aggregated/",list_aggregated_metrics),
     path("api/projects/<uuid:project_id>/policies/", get_policies),
+    path("api/projects/<uuid:project_id>/channels/", notification_channels),
     path("api/projects/<uuid:project_id>/alerts/", get_alerts),
+    path("api/system/health/", system_health),
 ]
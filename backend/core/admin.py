@@ -6,6 +6,9 @@ from .models import (
     AggregatedMetric,
     AlertPolicy,
     AlertEvent,
+    AlertState,
+    NotificationChannel,
+    NotificationDeadLetter,
 )
 
 
@@ -25,6 +28,30 @@ admin.site.register(RequestMetric)
 admin.site.register(AggregatedMetric)
 admin.site.register(AlertPolicy)
 admin.site.register(AlertEvent)
-
-
-
+admin.site.register(AlertState)
+admin.site.register(NotificationChannel)
+
+
+@admin.register(NotificationDeadLetter)
+class NotificationDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "target", "attempts", "created_at")
+    readonly_fields = ("created_at",)
+    actions = ["redeliver"]
+
+    @admin.action(description="Redeliver selected notifications")
+    def redeliver(self, request, queryset):
+        from .tasks import deliver_notifications_task
+
+        deliveries = [
+            {
+                "channel_id": letter.channel_id,
+                "kind": letter.kind,
+                "url": letter.target,
+                "payload": letter.payload,
+                "alert_ids": letter.alert_ids,
+            }
+            for letter in queryset
+        ]
+        deliver_notifications_task.delay(deliveries)
+        count = queryset.delete()[0]
+        self.message_user(request, f"Queued {count} notifications for redelivery.")
@@ -1,9 +1,23 @@
-from collections import defaultdict
-from datetime import timedelta
-from django.db import transaction
+import heapq
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
 from django.db.models import F
 from django.utils import timezone
-from .models import RequestMetric, AggregatedMetric
+from .baselines import update_baselines
+from .cardinality import EndpointCardinalityLimiter, OVERFLOW_ENDPOINT
+from .exemplars import exemplar_limits, make_exemplar, merge_exemplars, sample_priority, select_exemplars
+from .instrumentation import incr, phase
+from .leases import acquire_lease, release_lease
+from .models import AggregationWindow, ImportWindow, Project, RequestMetric, AggregatedMetric
+from .sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
 
 BUCKET_DEFINITIONS = {
     "1m": timedelta(minutes=1),
@@ -11,6 +25,34 @@ BUCKET_DEFINITIONS = {
     "1h": timedelta(hours=1),
 }
 
+# Endpoint admissions stick for the longest bucket, so no bucket of an
+# endpoint is split between its own series and the overflow series
+ADMISSION_HORIZON = max(BUCKET_DEFINITIONS.values())
+
+# Long-term sizes, never built from raw rows: core/compaction.py merges them
+# from finer buckets (1h -> 1d -> 1w). Weeks start on Monday.
+COMPACTED_BUCKET_DEFINITIONS = {
+    "1d": timedelta(days=1),
+    "1w": timedelta(weeks=1),
+}
+
+# Raw bucket sizes whose rows store a LatencySketch. Pre-aggregated
+# submissions merge into every size and compaction reads 1h, so p95 is
+# always merged from real distributions.
+SKETCHED_BUCKET_SIZES = set(BUCKET_DEFINITIONS)
+
+# AggregatedMetric counter per status class, with its [low, high) code range.
+# 5xx (and above) is error_count.
+STATUS_CLASS_FIELDS = {
+    "status_2xx_count": (200, 300),
+    "status_3xx_count": (300, 400),
+    "status_4xx_count": (400, 500),
+}
+
+# Endpoint name of the per-project rollup series: every request of the
+# project in the bucket, whatever its endpoint
+ROLLUP_ENDPOINT = "*"
+
 def compute_p95(latencies):
     if not latencies:
         return 0
@@ -20,91 +62,695 @@ def compute_p95(latencies):
     index = max(index, 0)
     return latencies[index]
 
+def compute_weighted_p95(samples):
+    """
+    Weighted p95 over (latency_ms, weight) pairs.
+
+    With every weight equal to 1 this returns the same element as
+    compute_p95: the first latency whose cumulative weight reaches
+    int(total_weight * 0.95).
+    """
+    if not samples:
+        return 0
+
+    samples.sort(key=lambda sample: sample[0])
+    target = int(sum(weight for _, weight in samples) * 0.95)
+
+    cumulative = 0.0
+    for latency, weight in samples:
+        cumulative += weight
+        if cumulative >= target:
+            return latency
+
+    return samples[-1][0]
+
+def sample_weight(sample_rate):
+    """Number of real requests a sampled row stands for."""
+    return 1.0 / sample_rate
+
 def get_bucket_start(timestamp, bucket_delta):
     """
     Calculate the start time of the bucket that contains the given timestamp.
     Buckets are aligned to epoch (e.g., 1m buckets start at :00, :01, :02...).
+
+    Uses exact timedelta arithmetic: float seconds since year 1 can't hold
+    microseconds, which put timestamps just before a boundary in the next
+    bucket.
     """
     epoch = timezone.make_aware(timezone.datetime.min)
-    offset = (timestamp - epoch).total_seconds()
-    bucket_seconds = bucket_delta.total_seconds()
-    bucket_index = int(offset // bucket_seconds)
-    bucket_start = epoch + timedelta(seconds=bucket_index * bucket_seconds)
-    return bucket_start
+    bucket_index = (timestamp - epoch) // bucket_delta
+    return epoch + bucket_index * bucket_delta
 
-def aggregate_metrics(start_time, end_time):
-    """
-    Aggregate raw RequestMetric into AggregatedMetric
-    for all bucket sizes (1m, 5m, 1h).
 
-    This function is:
-    - pure (no Celery)
-    - idempotent per time window
-    - safe to run multiple times
+@dataclass
+class BucketGroup:
+    """Aggregated figures of one (project, endpoint, bucket) in a window."""
 
-    Returns:
-        list[AggregatedMetric]: List of created or updated AggregatedMetric objects
+    project_id: object
+    endpoint: str
+    bucket_start: datetime
+    request_count: int
+    error_count: int
+    p95_latency_ms: int
+    # Weighted request count per STATUS_CLASS_FIELDS field
+    status_counts: dict
+    # method -> {"request_count", "error_count", "p95_latency_ms"}
+    method_breakdown: dict
+    # Slowest and sampled 5xx requests (see exemplars.py)
+    exemplars: Optional[dict]
+    # Returns the group's (latency_ms, weight) samples in row order; only
+    # called for sketch-backed rows (SKETCHED_BUCKET_SIZES or merges)
+    samples: Callable[[], list]
+
+
+def _raw_bucket_samples(project_id, endpoint, bucket_start, bucket_delta):
     """
-    created_metrics = []
+    (latency_ms, sample_rate, method) of the raw rows in one bucket, for
+    rows whose distribution has to be rebuilt (no sketch).
+    """
+    qs = RequestMetric.objects.filter(
+        project_id=project_id,
+        timestamp__gte=bucket_start,
+        timestamp__lt=bucket_start + bucket_delta,
+    )
+    if endpoint != ROLLUP_ENDPOINT:
+        qs = qs.filter(endpoint=endpoint)
+    return list(qs.values_list("latency_ms", "sample_rate", "method"))
 
-    # 1. Fetch raw metrics in window
-    raw_metrics = RequestMetric.objects.filter(
+
+def window_metrics(start_time, end_time, project_ids=None, import_id=None):
+    """
+    RequestMetric rows of a window, optionally limited to some projects and
+    to the rows of one bulk import.
+    """
+    qs = RequestMetric.objects.filter(
         timestamp__gte=start_time,
         timestamp__lt=end_time,
     )
+    if project_ids is not None:
+        qs = qs.filter(project_id__in=project_ids)
+    if import_id is not None:
+        qs = qs.filter(import_id=import_id)
+    return qs
 
-    if not raw_metrics.exists():
-        return created_metrics  # nothing to do
 
-    # 2. For each bucket size, aggregate metrics by which bucket they belong to
+def _group_python(start_time, end_time, limiter, project_ids=None, import_id=None):
+    """
+    Pure-Python engine: one RequestMetric object per row.
+
+    Returns:
+        tuple: (rows processed, {bucket_size: list[BucketGroup]})
+    """
+    # 1. Fetch raw metrics in window
+    with phase("fetch"):
+        raw_metrics = list(window_metrics(start_time, end_time, project_ids, import_id))
+
+    if not raw_metrics:
+        return 0, {}
+
+    # 2. Resolve endpoint names once per row, folding over-limit endpoints
+    #    (the most requested endpoints of the window are admitted first,
+    #    counting each row by its sample weight)
+    with phase("group"):
+        horizon_start = get_bucket_start(start_time, ADMISSION_HORIZON)
+        endpoint_requests = Counter()
+        for metric in raw_metrics:
+            endpoint_requests[(metric.project_id, metric.endpoint)] += sample_weight(metric.sample_rate)
+        limiter.admit_window(
+            endpoint_requests,
+            horizon_start,
+            int(ADMISSION_HORIZON.total_seconds()),
+        )
+        resolved_metrics = [
+            (metric, limiter.admit(metric.project_id, metric.endpoint, horizon_start=horizon_start))
+            for metric in raw_metrics
+        ]
+
+    # 3. For each bucket size, aggregate metrics by which bucket they belong to
+    groups_by_size = {}
     for bucket_size, bucket_delta in BUCKET_DEFINITIONS.items():
         # Group metrics by (project, endpoint, bucket_start)
         bucket_groups = defaultdict(list)
 
-        for metric in raw_metrics:
-            bucket_start = get_bucket_start(metric.timestamp, bucket_delta)
-            key = (metric.project_id, metric.endpoint, bucket_start)
-            bucket_groups[key].append(metric)
+        with phase("group"):
+            for metric, endpoint in resolved_metrics:
+                bucket_start = get_bucket_start(metric.timestamp, bucket_delta)
+                key = (metric.project_id, endpoint, bucket_start)
+                bucket_groups[key].append(metric)
+                bucket_groups[(metric.project_id, ROLLUP_ENDPOINT, bucket_start)].append(metric)
 
-        # 3. Process each bucket group
-        with transaction.atomic():
+        groups = []
+        with phase("percentile"):
             for (project_id, endpoint, bucket_start), metrics in bucket_groups.items():
-                latencies = [m.latency_ms for m in metrics]
-                error_count = sum(1 for m in metrics if m.status_code >= 500)
-                request_count = len(metrics)
-                p95_latency = compute_p95(latencies)
-
-                # Check if bucket already exists
-                agg_metric, created = AggregatedMetric.objects.get_or_create(
+                samples = [(m.latency_ms, sample_weight(m.sample_rate)) for m in metrics]
+                error_count = round(sum(
+                    weight for m, (_, weight) in zip(metrics, samples)
+                    if m.status_code >= 500
+                ))
+                request_count = round(sum(weight for _, weight in samples))
+                p95_latency = compute_weighted_p95(list(samples))
+                status_counts = {
+                    field: round(sum(
+                        weight for m, (_, weight) in zip(metrics, samples)
+                        if low <= m.status_code < high
+                    ))
+                    for field, (low, high) in STATUS_CLASS_FIELDS.items()
+                }
+                groups.append(BucketGroup(
                     project_id=project_id,
                     endpoint=endpoint,
                     bucket_start=bucket_start,
-                    bucket_size=bucket_size,
-                    defaults={
-                        "request_count": request_count,
-                        "error_count": error_count,
-                        "p95_latency_ms": p95_latency,
-                    },
-                )
+                    request_count=request_count,
+                    error_count=error_count,
+                    p95_latency_ms=p95_latency,
+                    status_counts=status_counts,
+                    method_breakdown=_method_breakdown(metrics, samples),
+                    exemplars=_select_metric_exemplars(metrics),
+                    samples=lambda samples=samples: samples,
+                ))
+        groups_by_size[bucket_size] = groups
+
+    return len(raw_metrics), groups_by_size
+
+
+def _method_breakdown(metrics, samples):
+    """Counts and p95 per HTTP method of a group of RequestMetric rows."""
+    by_method = defaultdict(list)
+    for m, sample in zip(metrics, samples):
+        by_method[m.method].append((m, sample))
+
+    breakdown = {}
+    for method in sorted(by_method):
+        rows = by_method[method]
+        breakdown[method] = {
+            "request_count": round(sum(weight for _, (_, weight) in rows)),
+            "error_count": round(sum(
+                weight for m, (_, weight) in rows if m.status_code >= 500
+            )),
+            "p95_latency_ms": compute_weighted_p95([sample for _, sample in rows]),
+        }
+    return breakdown
+
+
+def merge_method_breakdown(existing, new, p95_by_method=None):
+    """
+    Add new per-method counts to existing ones.
+
+    Args:
+        existing: Breakdown stored on the row (may be None)
+        new: Breakdown of the rows being merged in
+        p95_by_method: Exact per-method p95 when it could be recomputed;
+            otherwise the larger of the two p95s is kept as an upper bound
+    """
+    merged = {method: dict(values) for method, values in (existing or {}).items()}
+    for method, values in new.items():
+        current = merged.get(method)
+        if current is None:
+            merged[method] = dict(values)
+            continue
+        current["request_count"] += values["request_count"]
+        current["error_count"] += values["error_count"]
+        current["p95_latency_ms"] = max(current["p95_latency_ms"], values["p95_latency_ms"])
+
+    for method, p95 in (p95_by_method or {}).items():
+        if method in merged:
+            merged[method]["p95_latency_ms"] = p95
+    return dict(sorted(merged.items()))
+
 
-                # If bucket already exists, accumulate the counts
-                if not created:
-                    agg_metric.request_count += request_count
-                    agg_metric.error_count += error_count
-                    # Recalculate p95 across all latencies (fetch existing metrics)
-                    existing_latencies = RequestMetric.objects.filter(
+def _select_metric_exemplars(metrics):
+    """Exemplars of a group of RequestMetric rows."""
+    slowest_k, errors_k = exemplar_limits()
+    slowest = heapq.nlargest(slowest_k, metrics, key=lambda m: (m.latency_ms, -m.id))
+    errors = heapq.nsmallest(
+        errors_k,
+        (m for m in metrics if m.status_code >= 500),
+        key=lambda m: sample_priority(m.id),
+    )
+    return select_exemplars(
+        make_exemplar(m.id, m.timestamp, m.method, m.status_code, m.latency_ms)
+        for m in slowest + errors
+    )
+
+
+AGGREGATION_ENGINES = {"python", "numpy"}
+
+
+def aggregate_metrics(start_time, end_time, limiter=None, engine=None, project_ids=None, import_id=None):
+    """
+    Aggregate raw RequestMetric into AggregatedMetric
+    for all bucket sizes (1m, 5m, 1h).
+
+    This function is pure (no Celery) but not idempotent: existing buckets
+    accumulate, so running a window twice counts it twice. Periodic runs go
+    through aggregate_window, which commits each window at most once.
+
+    Rows are weighted by 1 / sample_rate, so request_count, error_count and
+    p95 stay correct for clients that only report a sample of traffic.
+
+    Distinct endpoints per project are capped by
+    AGGREGATION_MAX_ENDPOINTS_PER_PROJECT; requests for endpoints beyond the
+    cap are folded into the OVERFLOW_ENDPOINT series.
+
+    Every (project, bucket) also gets a ROLLUP_ENDPOINT row over all of the
+    project's requests, computed in the same pass, so project-wide reads
+    and policies don't have to combine per-endpoint rows.
+
+    Grouping runs on the AGGREGATION_ENGINE: "python" (default) or "numpy",
+    the vectorized engine in vectorized.py for windows with millions of
+    rows. Both produce identical rows.
+
+    Args:
+        start_time: Inclusive window start
+        end_time: Exclusive window end
+        limiter: Optional EndpointCardinalityLimiter; pass one in to inspect
+            overflow_stats() after the call
+        engine: Overrides AGGREGATION_ENGINE
+        project_ids: Only aggregate these projects (one shard of the window)
+        import_id: Only aggregate the rows of this bulk import; adds them to
+            existing buckets
+
+    Returns:
+        list[AggregatedMetric]: List of created or updated AggregatedMetric objects
+    """
+    created_metrics = []
+
+    if limiter is None:
+        limiter = EndpointCardinalityLimiter(
+            getattr(settings, "AGGREGATION_MAX_ENDPOINTS_PER_PROJECT", None)
+        )
+
+    engine = engine or getattr(settings, "AGGREGATION_ENGINE", "python")
+    if engine not in AGGREGATION_ENGINES:
+        raise ImproperlyConfigured(
+            f"AGGREGATION_ENGINE must be one of {sorted(AGGREGATION_ENGINES)}, got {engine!r}"
+        )
+
+    # 1-3. Fetch the window and compute every group's counts and p95
+    if engine == "numpy":
+        from .vectorized import group_window
+
+        rows_processed, groups_by_size = group_window(start_time, end_time, limiter, project_ids, import_id)
+    else:
+        rows_processed, groups_by_size = _group_python(start_time, end_time, limiter, project_ids, import_id)
+
+    if not rows_processed:
+        return created_metrics  # nothing to do
+
+    incr("rows_processed", rows_processed)
+
+    for project_id, overflow in limiter.overflow_stats().items():
+        incr("requests_folded", overflow["folded_requests"])
+        incr("endpoints_folded", overflow["folded_endpoints"])
+        logger.warning(
+            f"Project {project_id} exceeded {limiter.max_endpoints} endpoints "
+            f"in window [{start_time}, {end_time}): folded "
+            f"{overflow['folded_requests']} requests from "
+            f"~{overflow['folded_endpoints']} endpoints into {OVERFLOW_ENDPOINT}",
+            extra={"project_id": project_id, **overflow},
+        )
+
+    # 4. Write each bucket size's groups
+    for bucket_size, groups in groups_by_size.items():
+        bucket_delta = BUCKET_DEFINITIONS[bucket_size]
+
+        with transaction.atomic():
+            for group in groups:
+                project_id = group.project_id
+                endpoint = group.endpoint
+                bucket_start = group.bucket_start
+
+                with phase("write"):
+                    defaults = {
+                        "request_count": group.request_count,
+                        "error_count": group.error_count,
+                        "p95_latency_ms": group.p95_latency_ms,
+                        "method_breakdown": group.method_breakdown,
+                        "exemplars": group.exemplars,
+                        **group.status_counts,
+                    }
+                    if bucket_size in SKETCHED_BUCKET_SIZES:
+                        defaults["latency_sketch"] = LatencySketch.from_values(group.samples()).to_dict()
+
+                    # Check if bucket already exists
+                    agg_metric, created = AggregatedMetric.objects.get_or_create(
                         project_id=project_id,
                         endpoint=endpoint,
-                        timestamp__gte=bucket_start,
-                        timestamp__lt=bucket_start + bucket_delta,
-                    ).values_list("latency_ms", flat=True)
-                    all_latencies = list(existing_latencies)
-                    agg_metric.p95_latency_ms = compute_p95(all_latencies)
-                    agg_metric.save()
+                        bucket_start=bucket_start,
+                        bucket_size=bucket_size,
+                        defaults=defaults,
+                    )
+
+                    # If bucket already exists, accumulate the counts
+                    if not created:
+                        agg_metric.request_count += group.request_count
+                        agg_metric.error_count += group.error_count
+                        for field, count in group.status_counts.items():
+                            setattr(agg_metric, field, getattr(agg_metric, field) + count)
+                        p95_by_method = None
+                        agg_metric.exemplars = merge_exemplars(agg_metric.exemplars, group.exemplars)
+                        if agg_metric.latency_sketch is not None:
+                            # Bucket also holds pre-aggregated data that isn't in
+                            # the raw table; merge into its sketch instead
+                            sketch = LatencySketch.from_dict(agg_metric.latency_sketch)
+                            sketch.merge(LatencySketch.from_values(group.samples()))
+                            agg_metric.latency_sketch = sketch.to_dict()
+                            agg_metric.p95_latency_ms = sketch.p95()
+                        elif endpoint == OVERFLOW_ENDPOINT:
+                            # Folded endpoints can't be re-selected from the raw
+                            # table, so keep the larger p95 as an upper bound
+                            agg_metric.p95_latency_ms = max(
+                                agg_metric.p95_latency_ms, group.p95_latency_ms
+                            )
+                        else:
+                            # Recalculate p95 across all latencies (fetch existing metrics)
+                            existing_samples = _raw_bucket_samples(
+                                project_id, endpoint, bucket_start, bucket_delta
+                            )
+                            all_samples = [
+                                (latency, sample_weight(rate))
+                                for latency, rate, _ in existing_samples
+                            ]
+                            agg_metric.p95_latency_ms = compute_weighted_p95(all_samples)
+
+                            samples_by_method = defaultdict(list)
+                            for latency, rate, method in existing_samples:
+                                samples_by_method[method].append((latency, sample_weight(rate)))
+                            p95_by_method = {
+                                method: compute_weighted_p95(method_samples)
+                                for method, method_samples in samples_by_method.items()
+                            }
+                        agg_metric.method_breakdown = merge_method_breakdown(
+                            agg_metric.method_breakdown, group.method_breakdown, p95_by_method
+                        )
+                        agg_metric.save()
 
                 # Track created/updated metric for policy evaluation
                 created_metrics.append(agg_metric)
 
+    incr("groups", len(created_metrics))
+
+    # 5. Fold the new 1m buckets into the endpoints' anomaly baselines
+    with phase("baseline"):
+        update_baselines(created_metrics)
+
     return created_metrics
 
 
+def aggregation_shards() -> int:
+    return max(1, int(getattr(settings, "AGGREGATION_SHARDS", 1)))
+
+
+def shard_project_ids(shard, shards):
+    """
+    Ids of the projects in one shard of a window, or None for all projects
+    when the window isn't sharded.
+    """
+    if shards <= 1:
+        return None
+    return [
+        project_id
+        for project_id in Project.objects.values_list("id", flat=True)
+        if project_id.int % shards == shard
+    ]
+
+
+def aggregate_window(start_time, end_time, shard=0, shards=None, lease_seconds=None):
+    """
+    Aggregate one shard of a window exactly once across workers and retries.
+
+    1. A lease per (window, shard) keeps concurrent runs (duplicated beat,
+       retries, a slow previous run) from doing the same work at once
+    2. The AggregationWindow ledger turns a repeat of a finished window into
+       a single indexed lookup
+    3. The ledger row is inserted in the same transaction as the window's
+       AggregatedMetric writes, so if the lease ran out and two runs got
+       this far, the unique (window_start, shard) constraint rolls the
+       second one back. Other integrity errors propagate, so the task
+       retries the window.
+
+    Args:
+        start_time: Inclusive window start
+        end_time: Exclusive window end
+        shard: Shard to aggregate, in [0, shards)
+        shards: Defaults to AGGREGATION_SHARDS
+        lease_seconds: Defaults to AGGREGATION_LEASE_SECONDS
+
+    Returns:
+        list[AggregatedMetric] | None: Rows written, or None when another
+        run holds or already committed the window
+    """
+    shards = shards or aggregation_shards()
+    lease_name = f"aggregate:{start_time.isoformat()}:{shard}"
+
+    # 1. Lease
+    token = acquire_lease(
+        lease_name, lease_seconds or getattr(settings, "AGGREGATION_LEASE_SECONDS", 180)
+    )
+    if token is None:
+        logger.info(f"Window [{start_time}, {end_time}) shard {shard} is leased by another run")
+        incr("windows_contended")
+        return None
+
+    try:
+        # 2. Ledger
+        if AggregationWindow.objects.filter(window_start=start_time, shard=shard).exists():
+            logger.info(f"Window [{start_time}, {end_time}) shard {shard} already aggregated")
+            incr("windows_skipped")
+            return None
+
+        # 3. Write and record the window together
+        try:
+            with transaction.atomic():
+                aggregated_metrics = aggregate_metrics(
+                    start_time, end_time, project_ids=shard_project_ids(shard, shards)
+                )
+                AggregationWindow.objects.create(
+                    window_start=start_time,
+                    window_end=end_time,
+                    shard=shard,
+                    shards=shards,
+                    fencing_token=token,
+                    metric_count=len(aggregated_metrics),
+                )
+        except IntegrityError:
+            # Only a ledger row committed by another run means the window is
+            # done; any other constraint violation is a real failure
+            if not AggregationWindow.objects.filter(window_start=start_time, shard=shard).exists():
+                raise
+            logger.warning(
+                f"Window [{start_time}, {end_time}) shard {shard} was committed by "
+                f"another run; rolled back run with token {token}"
+            )
+            incr("windows_skipped")
+            return None
+
+        return aggregated_metrics
+    finally:
+        release_lease(lease_name, token)
+
+
+def reaggregate_import_window(start_time, end_time, import_id):
+    """
+    Add the raw rows of one bulk import in [start_time, end_time) to their
+    aggregated buckets, exactly once across retries.
+
+    The ImportWindow ledger row is inserted first, in the same transaction
+    as the AggregatedMetric writes: a repeat of a finished window hits the
+    unique (import_id, window_start) constraint and is skipped, and a run
+    racing it waits on that row until the first one commits or rolls back.
+
+    Args:
+        start_time: Inclusive window start
+        end_time: Exclusive window end
+        import_id: RequestMetric.import_id of the import
+
+    Returns:
+        list[AggregatedMetric] | None: Rows written, or None when the window
+        was already re-aggregated
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                ImportWindow.objects.create(
+                    import_id=import_id, window_start=start_time, window_end=end_time
+                )
+        except IntegrityError:
+            logger.info(f"Import {import_id} window [{start_time}, {end_time}) already re-aggregated")
+            incr("windows_skipped")
+            return None
+
+        return aggregate_metrics(start_time, end_time, import_id=import_id)
+
+
+def _submission_status_counts(submission):
+    """Status class counts of a submission; without them non-errors count as 2xx."""
+    status_counts = submission.get("status_counts")
+    if status_counts is None:
+        return {"status_2xx_count": submission["request_count"] - submission["error_count"]}
+    return status_counts
+
+
+def merge_preaggregated(project_id, submissions, limiter=None, replace=False):
+    """
+    Merge pre-aggregated per-minute submissions into AggregatedMetric.
+
+    Agents that aggregate locally send one submission per (endpoint, minute)
+    instead of one RequestMetric per request. Each submission is rolled up
+    into every bucket size and merged into the matching rows, bypassing
+    the raw table entirely. Latency distributions are merged through
+    LatencySketch so p95 stays accurate across submissions.
+
+    Submissions are combined in memory first. Each bucket size then needs
+    one SELECT ... FOR UPDATE for all touched rows, plus one bulk insert and
+    one bulk update. The project's ROLLUP_ENDPOINT rows are merged the same way.
+    The merged 1m rows are folded into the anomaly baselines, as in
+    aggregate_metrics.
+
+    With replace, the submissions overwrite the matching rows instead of
+    adding to them. Gauges that are sampled rather than counted (queue
+    depth, lag) use this, so sampling twice in a bucket keeps the latest
+    value instead of doubling it.
+
+    Args:
+        project_id: Project the submissions belong to
+        submissions: Iterable of dicts with endpoint, bucket_start (aware,
+            1m aligned), request_count, error_count, sketch (LatencySketch)
+            and optionally status_counts (STATUS_CLASS_FIELDS field -> count)
+        limiter: Optional EndpointCardinalityLimiter
+        replace: Overwrite existing rows with the submissions
+
+    Returns:
+        list[AggregatedMetric]: Created or updated rows, for policy evaluation
+    """
+    if limiter is None:
+        limiter = EndpointCardinalityLimiter(
+            getattr(settings, "AGGREGATION_MAX_ENDPOINTS_PER_PROJECT", None)
+        )
+
+    # Admit per horizon, most requested endpoints first
+    submissions = list(submissions)
+    requests_by_horizon = defaultdict(Counter)
+    for submission in submissions:
+        horizon_start = get_bucket_start(submission["bucket_start"], ADMISSION_HORIZON)
+        requests_by_horizon[horizon_start][(project_id, submission["endpoint"])] += submission["request_count"]
+    for horizon_start, endpoint_requests in requests_by_horizon.items():
+        limiter.admit_window(endpoint_requests, horizon_start, int(ADMISSION_HORIZON.total_seconds()))
+
+    submissions = [
+        {
+            **submission,
+            "endpoint": limiter.admit(
+                project_id,
+                submission["endpoint"],
+                requests=submission["request_count"],
+                horizon_start=get_bucket_start(submission["bucket_start"], ADMISSION_HORIZON),
+            ),
+        }
+        for submission in submissions
+    ]
+    for overflow in limiter.overflow_stats().values():
+        incr("requests_folded", overflow["folded_requests"])
+        incr("endpoints_folded", overflow["folded_endpoints"])
+
+    touched = []
+
+    with transaction.atomic():
+        for bucket_size, bucket_delta in BUCKET_DEFINITIONS.items():
+            # Combine submissions that land in the same bucket
+            partials = {}
+            for submission in submissions:
+                bucket_start = get_bucket_start(submission["bucket_start"], bucket_delta)
+                for endpoint in (submission["endpoint"], ROLLUP_ENDPOINT):
+                    partial = partials.get((endpoint, bucket_start))
+                    if partial is None:
+                        partial = partials[(endpoint, bucket_start)] = {
+                            "request_count": 0,
+                            "error_count": 0,
+                            "status_counts": dict.fromkeys(STATUS_CLASS_FIELDS, 0),
+                            "sketch": LatencySketch(),
+                        }
+                    partial["request_count"] += submission["request_count"]
+                    partial["error_count"] += submission["error_count"]
+                    for field, count in _submission_status_counts(submission).items():
+                        partial["status_counts"][field] += count
+                    partial["sketch"].merge(submission["sketch"])
+
+            existing = {
+                (m.endpoint, m.bucket_start): m
+                for m in AggregatedMetric.objects.select_for_update().filter(
+                    project_id=project_id,
+                    bucket_size=bucket_size,
+                    endpoint__in={endpoint for endpoint, _ in partials},
+                    bucket_start__in={bucket_start for _, bucket_start in partials},
+                )
+            }
+
+            to_create = []
+            to_update = []
+            for (endpoint, bucket_start), partial in partials.items():
+                sketch = partial["sketch"]
+                agg_metric = existing.get((endpoint, bucket_start))
+
+                if agg_metric is None:
+                    to_create.append(AggregatedMetric(
+                        project_id=project_id,
+                        endpoint=endpoint,
+                        bucket_start=bucket_start,
+                        bucket_size=bucket_size,
+                        request_count=partial["request_count"],
+                        error_count=partial["error_count"],
+                        p95_latency_ms=sketch.p95(),
+                        latency_sketch=sketch.to_dict(),
+                        **partial["status_counts"],
+                    ))
+                    continue
+
+                if replace:
+                    agg_metric.request_count = partial["request_count"]
+                    agg_metric.error_count = partial["error_count"]
+                    for field, count in partial["status_counts"].items():
+                        setattr(agg_metric, field, count)
+                    agg_metric.latency_sketch = sketch.to_dict()
+                    agg_metric.p95_latency_ms = sketch.p95()
+                    to_update.append(agg_metric)
+                    continue
+
+                if agg_metric.latency_sketch is not None:
+                    merged = LatencySketch.from_dict(agg_metric.latency_sketch)
+                elif endpoint != OVERFLOW_ENDPOINT:
+                    # Row was built from raw metrics before raw rows stored
+                    # sketches; rebuild its distribution from the raw table
+                    merged = LatencySketch.from_values(
+                        (latency, sample_weight(rate))
+                        for latency, rate, _ in _raw_bucket_samples(
+                            project_id, endpoint, bucket_start, bucket_delta
+                        )
+                    )
+                else:
+                    merged = None
+                agg_metric.request_count += partial["request_count"]
+                agg_metric.error_count += partial["error_count"]
+                for field, count in partial["status_counts"].items():
+                    setattr(agg_metric, field, getattr(agg_metric, field) + count)
+                if merged is not None:
+                    merged.merge(sketch)
+                    agg_metric.latency_sketch = merged.to_dict()
+                    agg_metric.p95_latency_ms = merged.p95()
+                elif sketch.count:
+                    # Folded endpoints can't be re-selected from the raw
+                    # table, so keep the larger p95 as an upper bound
+                    agg_metric.p95_latency_ms = max(agg_metric.p95_latency_ms, sketch.p95())
+                to_update.append(agg_metric)
+
+            AggregatedMetric.objects.bulk_create(to_create)
+            AggregatedMetric.objects.bulk_update(
+                to_update,
+                ["request_count", "error_count", "p95_latency_ms", "latency_sketch", *STATUS_CLASS_FIELDS],
+            )
+            touched.extend(to_create)
+            touched.extend(to_update)
+
+        update_baselines(touched)
+
+    return touched
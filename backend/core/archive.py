@@ -0,0 +1,327 @@
+"""
+Columnar archive for raw request metrics.
+
+RequestMetric rows only live in Postgres for a week. Before that, every
+closed hour is compacted into an Arrow IPC file per project on local disk:
+
+    RAW_ARCHIVE_DIR/<project_id>/<YYYY-MM-DD>/<HH>.arrow
+
+Files are written uncompressed so they can be memory-mapped and scanned
+without copying. Queries filter and compute percentiles with vectorized
+Arrow/NumPy kernels, which makes ad-hoc investigations over months of raw
+data possible without keeping those rows in Postgres.
+
+Key properties:
+- Idempotent: an hour is written once and marked done in a ledger directory
+- Atomic: files are written to a temp name and renamed into place
+- Bounded: whole day directories are removed after RAW_ARCHIVE_RETENTION_DAYS
+
+pyarrow and numpy are only imported when the archive is used.
+"""
+
+import logging
+import os
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from .models import RequestMetric
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DIR = "_ledger"
+
+ARCHIVE_FIELDS = ["timestamp", "endpoint", "method", "status_code", "latency_ms", "sample_rate"]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            "The raw metric archive requires pyarrow (pip install pyarrow)"
+        ) from e
+    return pyarrow
+
+
+def get_archive_root() -> Path:
+    return Path(getattr(settings, "RAW_ARCHIVE_DIR", settings.BASE_DIR / "archive"))
+
+
+def get_hour_path(project_id, hour_start) -> Path:
+    return (
+        get_archive_root()
+        / str(project_id)
+        / hour_start.strftime("%Y-%m-%d")
+        / f"{hour_start:%H}.arrow"
+    )
+
+
+def _ledger_path(hour_start) -> Path:
+    return get_archive_root() / LEDGER_DIR / f"{hour_start:%Y-%m-%dT%H}.done"
+
+
+def _archive_schema(pa):
+    return pa.schema([
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+        ("endpoint", pa.dictionary(pa.int32(), pa.string())),
+        ("method", pa.dictionary(pa.int8(), pa.string())),
+        ("status_code", pa.int16()),
+        ("latency_ms", pa.int32()),
+        ("sample_rate", pa.float32()),
+    ])
+
+
+def _write_hour_file(pa, path: Path, columns: dict) -> None:
+    schema = _archive_schema(pa)
+    table = pa.table(
+        {
+            "timestamp": pa.array(columns["timestamp"], type=schema.field("timestamp").type),
+            "endpoint": pa.array(columns["endpoint"], type=pa.string()).dictionary_encode(),
+            "method": pa.array(columns["method"], type=pa.string()).dictionary_encode().cast(
+                schema.field("method").type
+            ),
+            "status_code": pa.array(columns["status_code"], type=pa.int16()),
+            "latency_ms": pa.array(columns["latency_ms"], type=pa.int32()),
+            "sample_rate": pa.array(columns["sample_rate"], type=pa.float32()),
+        },
+        schema=schema,
+    )
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".arrow.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def archive_hour(hour_start, overwrite: bool = False) -> int:
+    """
+    Write one closed hour of raw metrics to per-project Arrow files.
+
+    Rows are streamed ordered by project, so only one project's hour is held
+    in memory at a time.
+
+    Args:
+        hour_start: Aware datetime aligned to the hour
+        overwrite: Rewrite files even if the hour is already in the ledger
+
+    Returns:
+        int: Number of rows archived (0 if the hour was already archived)
+    """
+    pa = _require_pyarrow()
+
+    ledger = _ledger_path(hour_start)
+    if ledger.exists() and not overwrite:
+        return 0
+
+    rows = (
+        RequestMetric.objects
+        .filter(timestamp__gte=hour_start, timestamp__lt=hour_start + timedelta(hours=1))
+        .order_by("project_id", "timestamp")
+        .values_list("project_id", *ARCHIVE_FIELDS)
+        .iterator(chunk_size=10000)
+    )
+
+    archived = 0
+    current_project = None
+    columns = None
+
+    for project_id, *values in rows:
+        if project_id != current_project:
+            if current_project is not None:
+                _write_hour_file(pa, get_hour_path(current_project, hour_start), columns)
+            current_project = project_id
+            columns = {field: [] for field in ARCHIVE_FIELDS}
+
+        for field, value in zip(ARCHIVE_FIELDS, values):
+            columns[field].append(value)
+        archived += 1
+
+    if current_project is not None:
+        _write_hour_file(pa, get_hour_path(current_project, hour_start), columns)
+
+    ledger.parent.mkdir(parents=True, exist_ok=True)
+    ledger.touch()
+
+    return archived
+
+
+def archive_closed_hours(now=None) -> int:
+    """
+    Archive every closed hour in the catch-up window that isn't archived yet.
+
+    An hour counts as closed once RAW_ARCHIVE_GRACE_MINUTES have passed after
+    its end, leaving room for late ingest.
+
+    Returns:
+        int: Total rows archived
+    """
+    now = now or timezone.now()
+    grace = timedelta(minutes=getattr(settings, "RAW_ARCHIVE_GRACE_MINUTES", 10))
+    catchup_hours = getattr(settings, "RAW_ARCHIVE_CATCHUP_HOURS", 24)
+
+    last_closed = (now - grace).replace(minute=0, second=0, microsecond=0) - timedelta(hours=1)
+
+    archived = 0
+    for offset in range(catchup_hours - 1, -1, -1):
+        hour_start = last_closed - timedelta(hours=offset)
+        archived += archive_hour(hour_start)
+
+    return archived
+
+
+def prune_archive(now=None) -> int:
+    """
+    Delete archived days older than RAW_ARCHIVE_RETENTION_DAYS.
+
+    Returns:
+        int: Number of day directories removed
+    """
+    now = now or timezone.now()
+    retention_days = getattr(settings, "RAW_ARCHIVE_RETENTION_DAYS", 90)
+    cutoff = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+
+    root = get_archive_root()
+    if not root.exists():
+        return 0
+
+    removed = 0
+    for project_dir in root.iterdir():
+        if not project_dir.is_dir():
+            continue
+
+        if project_dir.name == LEDGER_DIR:
+            for marker in project_dir.iterdir():
+                if marker.name[:10] < cutoff:
+                    marker.unlink()
+            continue
+
+        for day_dir in project_dir.iterdir():
+            if day_dir.is_dir() and day_dir.name < cutoff:
+                shutil.rmtree(day_dir)
+                removed += 1
+
+    return removed
+
+
+def _iter_hour_paths(project_id, start, end):
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        path = get_hour_path(project_id, hour)
+        if path.exists():
+            yield path
+        hour += timedelta(hours=1)
+
+
+def _weighted_quantile(np, latencies, weights, q):
+    """Weighted quantile using the same rank rule as compute_weighted_p95."""
+    order = np.argsort(latencies, kind="stable")
+    cumulative = np.cumsum(weights[order])
+    target = int(cumulative[-1] * q)
+    index = int(np.searchsorted(cumulative, target, side="left"))
+    return int(latencies[order][min(index, len(order) - 1)])
+
+
+def query_archive(
+    project_id,
+    start,
+    end,
+    endpoint=None,
+    method=None,
+    status_min=None,
+    status_max=None,
+    min_latency_ms=None,
+    quantiles=(0.5, 0.95, 0.99),
+    limit=0,
+):
+    """
+    Scan archived raw metrics for a project with optional filters.
+
+    Each hour file is memory-mapped and filtered with Arrow compute kernels.
+    Only the matching columns are materialised.
+
+    Args:
+        project_id: Project to query
+        start, end: Aware datetimes, [start, end)
+        endpoint, method: Exact matches
+        status_min, status_max: Inclusive status code range
+        min_latency_ms: Only requests at least this slow
+        quantiles: Latency quantiles to compute (weighted by sample rate)
+        limit: Return up to this many matching rows (slowest first)
+
+    Returns:
+        dict: rows_scanned, rows_matched, request_count, error_count,
+        latency_ms (quantile -> value) and rows
+    """
+    pa = _require_pyarrow()
+    pc = pa.compute
+    import numpy as np
+
+    start_scalar = pa.scalar(start, type=pa.timestamp("us", tz="UTC"))
+    end_scalar = pa.scalar(end, type=pa.timestamp("us", tz="UTC"))
+
+    matched = []
+    rows_scanned = 0
+
+    for path in _iter_hour_paths(project_id, start, end):
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+
+        rows_scanned += table.num_rows
+
+        mask = pc.and_(
+            pc.greater_equal(table["timestamp"], start_scalar),
+            pc.less(table["timestamp"], end_scalar),
+        )
+        if endpoint is not None:
+            mask = pc.and_(mask, pc.equal(table["endpoint"].cast(pa.string()), endpoint))
+        if method is not None:
+            mask = pc.and_(mask, pc.equal(table["method"].cast(pa.string()), method))
+        if status_min is not None:
+            mask = pc.and_(mask, pc.greater_equal(table["status_code"], status_min))
+        if status_max is not None:
+            mask = pc.and_(mask, pc.less_equal(table["status_code"], status_max))
+        if min_latency_ms is not None:
+            mask = pc.and_(mask, pc.greater_equal(table["latency_ms"], min_latency_ms))
+
+        filtered = table.filter(mask)
+        if filtered.num_rows:
+            matched.append(filtered)
+
+    result = {
+        "rows_scanned": rows_scanned,
+        "rows_matched": 0,
+        "request_count": 0,
+        "error_count": 0,
+        "latency_ms": {str(q): 0 for q in quantiles},
+        "rows": [],
+    }
+
+    if not matched:
+        return result
+
+    table = pa.concat_tables(matched)
+    latencies = table["latency_ms"].to_numpy()
+    weights = 1.0 / table["sample_rate"].to_numpy().astype(np.float64)
+    errors = table["status_code"].to_numpy() >= 500
+
+    result["rows_matched"] = table.num_rows
+    result["request_count"] = int(round(weights.sum()))
+    result["error_count"] = int(round(weights[errors].sum()))
+    result["latency_ms"] = {
+        str(q): _weighted_quantile(np, latencies, weights, q) for q in quantiles
+    }
+
+    if limit:
+        slowest = np.argsort(-latencies, kind="stable")[:limit]
+        result["rows"] = table.take(pa.array(slowest)).to_pylist()
+
+    return result
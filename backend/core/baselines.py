@@ -0,0 +1,220 @@
+"""
+Streaming baselines for anomaly-detection policies.
+
+Every 1m bucket written by aggregate_metrics updates one MetricBaseline row
+per (project, endpoint), holding for each metric:
+
+- an EWMA mean and variance (recent behaviour)
+- optionally, an EWMA mean and variance per hour-of-week slot (0..167), so
+  endpoints with daily or weekly traffic patterns are compared with the same
+  hour of previous days and weeks
+
+The deviation of the bucket from the baseline, in standard deviations, is
+computed *before* the bucket is folded in and stored next to the
+statistics. Anomaly policies only read that score.
+
+Key properties:
+- O(1) per bucket: a constant number of float updates, no history scans
+- Compact: a few floats per metric, plus one small list per visited
+  hour-of-week slot when seasonality is enabled
+- Idempotent: the statistics before the last bucket are kept, so when that
+  bucket is written again (a re-run window, or a later pre-aggregated
+  partial of the minute) its new totals replace its earlier contribution
+  instead of being folded in twice. Older buckets are skipped as late data.
+"""
+
+import math
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MetricBaseline
+
+def _metric_values(aggregated_metric) -> dict:
+    request_count = aggregated_metric.request_count
+    return {
+        "latency_p95": float(aggregated_metric.p95_latency_ms),
+        "error_rate": aggregated_metric.error_count / request_count if request_count else 0.0,
+        "client_error_rate": aggregated_metric.status_4xx_count / request_count if request_count else 0.0,
+        "success_rate": (
+            (aggregated_metric.status_2xx_count + aggregated_metric.status_3xx_count) / request_count
+            if request_count else 1.0
+        ),
+        "throughput": float(request_count),
+    }
+
+
+def hour_of_week(bucket_start) -> int:
+    return bucket_start.weekday() * 24 + bucket_start.hour
+
+
+def _zscore(n, mean, variance, value):
+    """Deviation of value in standard deviations, or None while warming up."""
+    if n < getattr(settings, "BASELINE_MIN_SAMPLES", 30):
+        return None
+
+    # Floor the deviation so near-constant series don't turn noise into
+    # huge scores
+    min_ratio = getattr(settings, "BASELINE_MIN_STDDEV_RATIO", 0.05)
+    stddev = max(math.sqrt(max(variance, 0.0)), abs(mean) * min_ratio, 1e-9)
+    return (value - mean) / stddev
+
+
+def _ewma_update(n, mean, variance, value, alpha):
+    """Fold value into an exponentially weighted mean/variance."""
+    if n == 0:
+        return 1, value, 0.0
+    diff = value - mean
+    increment = alpha * diff
+    return n + 1, mean + increment, (1 - alpha) * (variance + diff * increment)
+
+
+def update_metric_stats(stats, value, slot, alpha, seasonal_alpha, seasonal, refold=False) -> dict:
+    """
+    Score value against the stats, then fold it in.
+
+    Args:
+        stats: Compact stats of one metric, {"n", "m", "v", "s"}, or None
+        value: New bucket value
+        slot: Hour-of-week slot of the bucket
+        alpha: EWMA weight of the new value
+        seasonal_alpha: EWMA weight within a seasonal slot
+        seasonal: Maintain the hour-of-week baseline
+        refold: value replaces the last folded bucket; it is folded into the
+            stats as they were before that bucket
+
+    Returns:
+        dict: Updated stats with "z" (EWMA score) and "sz" (seasonal score)
+        of this value, and "p"/"ps" (the stats before it)
+    """
+    stats = dict(stats or {"n": 0, "m": 0.0, "v": 0.0})
+
+    if refold and "p" in stats:
+        stats["n"], stats["m"], stats["v"] = stats["p"]
+    n, mean, variance = stats["n"], stats["m"], stats["v"]
+    stats["p"] = [n, mean, variance]
+    stats["z"] = _zscore(n, mean, variance, value)
+    stats["n"], stats["m"], stats["v"] = _ewma_update(n, mean, variance, value, alpha)
+
+    stats["sz"] = None
+    if seasonal:
+        slots = dict(stats.get("s") or {})
+        if refold and "ps" in stats:
+            if stats["ps"] is None:
+                slots.pop(str(slot), None)
+            else:
+                slots[str(slot)] = stats["ps"]
+        previous = slots.get(str(slot))
+        stats["ps"] = previous
+        slot_n, slot_mean, slot_variance = previous or (0, 0.0, 0.0)
+        stats["sz"] = _zscore(slot_n, slot_mean, slot_variance, value)
+        slots[str(slot)] = list(
+            _ewma_update(slot_n, slot_mean, slot_variance, value, seasonal_alpha)
+        )
+        stats["s"] = slots
+
+    return stats
+
+
+def update_baselines(aggregated_metrics) -> int:
+    """
+    Fold newly aggregated or updated 1m buckets into their endpoints'
+    baselines.
+
+    One query loads the affected baselines; new and changed rows are then
+    written with one bulk_create and one bulk_update.
+
+    Args:
+        aggregated_metrics: AggregatedMetric rows; only 1m buckets are used
+
+    Returns:
+        int: Number of buckets folded in (or re-folded)
+    """
+    buckets = sorted(
+        (m for m in aggregated_metrics if m.bucket_size == "1m"),
+        key=lambda m: m.bucket_start,
+    )
+    if not buckets:
+        return 0
+
+    alpha = getattr(settings, "BASELINE_EWMA_ALPHA", 0.05)
+    seasonal_alpha = getattr(settings, "BASELINE_SEASONAL_ALPHA", 0.02)
+    seasonal = getattr(settings, "BASELINE_SEASONAL", True)
+
+    keys = {(m.project_id, m.endpoint) for m in buckets}
+    existing = {
+        (b.project_id, b.endpoint): b
+        for b in MetricBaseline.objects.filter(
+            project_id__in={project_id for project_id, _ in keys},
+            endpoint__in={endpoint for _, endpoint in keys},
+        )
+        if (b.project_id, b.endpoint) in keys
+    }
+
+    to_create = {}
+    to_update = {}
+    folded = 0
+    now = timezone.now()
+
+    for metric in buckets:
+        key = (metric.project_id, metric.endpoint)
+        baseline = existing.get(key)
+        if baseline is None:
+            baseline = MetricBaseline(project_id=metric.project_id, endpoint=metric.endpoint, stats={})
+            existing[key] = baseline
+            to_create[key] = baseline
+        elif baseline.last_bucket_start and metric.bucket_start < baseline.last_bucket_start:
+            # Late data
+            continue
+
+        # The last bucket again (re-run window, later partial of the
+        # minute): its current totals replace what was folded in before
+        refold = metric.bucket_start == baseline.last_bucket_start
+        slot = hour_of_week(metric.bucket_start)
+        stats = dict(baseline.stats)
+        for name, value in _metric_values(metric).items():
+            stats[name] = update_metric_stats(
+                stats.get(name), value, slot, alpha, seasonal_alpha, seasonal, refold=refold
+            )
+
+        baseline.stats = stats
+        baseline.last_bucket_start = metric.bucket_start
+        baseline.updated_at = now
+        if key not in to_create:
+            to_update[key] = baseline
+        folded += 1
+
+    # A concurrent worker may have created the same baseline; its first
+    # bucket wins and this one is dropped rather than failing aggregation
+    MetricBaseline.objects.bulk_create(to_create.values(), ignore_conflicts=True)
+    MetricBaseline.objects.bulk_update(to_update.values(), ["stats", "last_bucket_start", "updated_at"])
+
+    return folded
+
+
+def get_anomaly_score(baseline, policy, aggregated_metric):
+    """
+    Score of the metric's bucket for an anomaly policy.
+
+    Args:
+        baseline: MetricBaseline of the metric's endpoint, or None
+        policy: AlertPolicy with comparison "anomaly"
+        aggregated_metric: Metric being evaluated
+
+    Returns:
+        float | None: Deviation in standard deviations, or None if the
+        baseline hasn't scored this bucket (warming up, not a 1m bucket, or
+        the bucket was never folded in)
+    """
+    if baseline is None or aggregated_metric.bucket_size != "1m":
+        return None
+    if baseline.last_bucket_start != aggregated_metric.bucket_start:
+        return None
+
+    stats = baseline.stats.get(policy.metric)
+    if not stats:
+        return None
+
+    if policy.seasonal:
+        return stats.get("sz")
+    return stats.get("z")
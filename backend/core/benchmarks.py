@@ -0,0 +1,319 @@
+"""
+Benchmarks for the ingest, aggregation, policy evaluation and cleanup paths.
+
+Used by the `benchmark` management command. Every benchmark runs against
+synthetic data produced by SyntheticWorkload and reports wall time, query
+counts and throughput as plain dicts so results can be dumped to JSON and
+compared across commits.
+
+All functions expect to run inside a disposable database (the command
+creates a test database) since they create and delete rows freely.
+"""
+
+import io
+import json
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .aggregation import ROLLUP_ENDPOINT, aggregate_metrics
+from .models import (
+    AggregatedMetric,
+    AlertEvent,
+    AlertPolicy,
+    APIKey,
+    Project,
+    RequestMetric,
+)
+from .policies import evaluate_policies
+from .policy_index import invalidate_policy_index
+
+LATENCY_DISTRIBUTIONS = ["lognormal", "normal", "exponential", "uniform"]
+
+
+@dataclass
+class SyntheticWorkload:
+    """
+    Generator for synthetic projects and request metrics.
+
+    Args:
+        projects: Number of projects
+        endpoints: Distinct endpoints per project
+        requests_per_minute: Requests per project per minute
+        latency_distribution: One of LATENCY_DISTRIBUTIONS
+        latency_median_ms: Median (or mean, for normal/exponential) latency
+        error_rate: Fraction of requests answered with a 5xx
+        seed: Random seed, so runs are reproducible
+    """
+
+    projects: int = 5
+    endpoints: int = 20
+    requests_per_minute: int = 600
+    latency_distribution: str = "lognormal"
+    latency_median_ms: float = 120.0
+    error_rate: float = 0.02
+    seed: int = 42
+    _random: random.Random = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(
+                f"Unknown latency distribution: {self.latency_distribution}"
+            )
+        self._random = random.Random(self.seed)
+
+    def latency(self) -> int:
+        median = self.latency_median_ms
+        rnd = self._random
+
+        if self.latency_distribution == "lognormal":
+            value = rnd.lognormvariate(math.log(median), 0.6)
+        elif self.latency_distribution == "normal":
+            value = rnd.gauss(median, median * 0.25)
+        elif self.latency_distribution == "exponential":
+            value = rnd.expovariate(1 / median)
+        else:
+            value = rnd.uniform(0, 2 * median)
+
+        return max(0, int(value))
+
+    def status_code(self) -> int:
+        if self._random.random() < self.error_rate:
+            return self._random.choice([500, 502, 503])
+        return self._random.choice([200, 200, 200, 201, 204, 404])
+
+    def endpoint(self) -> str:
+        return f"/api/v1/resource-{self._random.randrange(self.endpoints)}"
+
+    def create_projects(self):
+        """Create the workload's projects (each gets an API key via signal)."""
+        return [
+            Project.objects.create(name=f"bench-{i}", email="bench@example.com")
+            for i in range(self.projects)
+        ]
+
+    def metric_payload(self, timestamp) -> dict:
+        """Build one ingest request body."""
+        return {
+            "endpoint": self.endpoint(),
+            "method": self._random.choice(["GET", "GET", "POST", "PUT"]),
+            "status_code": self.status_code(),
+            "latency_ms": self.latency(),
+            "timestamp": timestamp.isoformat(),
+        }
+
+    def generate_metrics(self, projects, start, minutes, batch_size=5000) -> int:
+        """
+        Bulk insert requests_per_minute rows per project per minute,
+        starting at start and spread uniformly within each minute.
+
+        Returns:
+            int: Number of rows inserted
+        """
+        batch = []
+        inserted = 0
+
+        for minute in range(minutes):
+            minute_start = start + timedelta(minutes=minute)
+            for project in projects:
+                for _ in range(self.requests_per_minute):
+                    batch.append(RequestMetric(
+                        project=project,
+                        endpoint=self.endpoint(),
+                        method="GET",
+                        status_code=self.status_code(),
+                        latency_ms=self.latency(),
+                        timestamp=minute_start + timedelta(
+                            microseconds=self._random.randrange(60_000_000)
+                        ),
+                    ))
+
+                    if len(batch) >= batch_size:
+                        RequestMetric.objects.bulk_create(batch)
+                        inserted += len(batch)
+                        batch = []
+
+        if batch:
+            RequestMetric.objects.bulk_create(batch)
+            inserted += len(batch)
+
+        return inserted
+
+
+def _timed(fn):
+    """Run fn, returning (result, seconds, queries, query_seconds)."""
+    with CaptureQueriesContext(connection) as ctx:
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+
+    query_seconds = sum(float(q["time"]) for q in ctx.captured_queries)
+    return result, elapsed, len(ctx.captured_queries), query_seconds
+
+
+def bench_ingest(workload: SyntheticWorkload, requests: int = 2000) -> dict:
+    """Measure IngestMetricView throughput, including auth and quota checks."""
+    from .views import IngestMetricView
+
+    project = workload.create_projects()[0]
+    api_key = APIKey.objects.get(project=project)
+    view = IngestMetricView.as_view()
+    factory = RequestFactory()
+    now = timezone.now()
+
+    payloads = [json.dumps(workload.metric_payload(now)) for _ in range(requests)]
+
+    def run():
+        statuses = {}
+        for body in payloads:
+            request = factory.post(
+                "/api/ingest/",
+                body,
+                content_type="application/json",
+                HTTP_AUTHORIZATION=f"Bearer {api_key.key}",
+            )
+            response = view(request)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        return statuses
+
+    statuses, elapsed, queries, query_seconds = _timed(run)
+
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 4),
+        "requests_per_second": round(requests / elapsed, 1),
+        "queries_per_request": round(queries / requests, 2),
+        "query_seconds": round(query_seconds, 4),
+        "status_codes": {str(code): count for code, count in statuses.items()},
+    }
+
+
+def bench_aggregation(workload: SyntheticWorkload, window_minutes=(1, 5, 60)) -> list:
+    """
+    Measure aggregate_metrics wall time and query count per window size.
+
+    Each window size runs on freshly generated data with an empty
+    AggregatedMetric table, so runs are comparable.
+    """
+    results = []
+
+    for minutes in window_minutes:
+        RequestMetric.objects.all().delete()
+        AggregatedMetric.objects.all().delete()
+        Project.objects.all().delete()
+
+        projects = workload.create_projects()
+        start = timezone.now().replace(second=0, microsecond=0) - timedelta(days=1)
+        start = start.replace(minute=0)
+        rows = workload.generate_metrics(projects, start, minutes)
+
+        metrics, elapsed, queries, query_seconds = _timed(
+            lambda: aggregate_metrics(start, start + timedelta(minutes=minutes))
+        )
+
+        results.append({
+            "window_minutes": minutes,
+            "rows": rows,
+            "groups": len(metrics),
+            "seconds": round(elapsed, 4),
+            "rows_per_second": round(rows / elapsed, 1),
+            "queries": queries,
+            "query_seconds": round(query_seconds, 4),
+        })
+
+    return results
+
+
+def bench_policy_evaluation(workload: SyntheticWorkload, policy_counts=(1, 10, 100)) -> list:
+    """Measure evaluate_policies cost as the number of policies per project grows."""
+    RequestMetric.objects.all().delete()
+    AggregatedMetric.objects.all().delete()
+    Project.objects.all().delete()
+
+    projects = workload.create_projects()[:1]
+    start = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=2)
+    workload.generate_metrics(projects, start, 1)
+    # Only the rows the policies below match: scoped policies skip the
+    # rollup, and bucket_size defaults to 1m
+    metrics = [
+        m for m in aggregate_metrics(start, start + timedelta(minutes=1))
+        if m.endpoint != ROLLUP_ENDPOINT and m.bucket_size == "1m"
+    ]
+
+    results = []
+    for count in policy_counts:
+        AlertPolicy.objects.all().delete()
+        AlertPolicy.objects.bulk_create([
+            AlertPolicy(
+                project=projects[0],
+                name=f"bench-{i}",
+                metric=["latency_p95", "error_rate", "throughput"][i % 3],
+                threshold=[1e9, 1.1, 1e9][i % 3],  # never violated: measures pure evaluation
+                comparison=">",
+                severity="info",
+                # Match every series, not just the project rollup, so each
+                # metric is evaluated against every policy
+                endpoint_pattern="*",
+                endpoint_match="glob",
+            )
+            for i in range(count)
+        ])
+        # bulk_create doesn't send post_save, so drop the cached index by hand
+        invalidate_policy_index()
+
+        alerts, elapsed, queries, query_seconds = _timed(
+            lambda: sum(evaluate_policies(m) for m in metrics)
+        )
+
+        results.append({
+            "policies": count,
+            "metrics_evaluated": len(metrics),
+            "alerts_created": alerts,
+            "seconds": round(elapsed, 4),
+            "microseconds_per_evaluation": round(
+                elapsed * 1e6 / max(len(metrics) * count, 1), 1
+            ),
+            "queries": queries,
+            "query_seconds": round(query_seconds, 4),
+        })
+
+    AlertEvent.objects.all().delete()
+    return results
+
+
+def bench_cleanup(workload: SyntheticWorkload, minutes: int = 10) -> dict:
+    """Measure the cleanup_raw_metrics delete rate on rows past retention."""
+    RequestMetric.objects.all().delete()
+    Project.objects.all().delete()
+
+    projects = workload.create_projects()
+    start = timezone.now() - timedelta(days=8)
+    rows = workload.generate_metrics(projects, start, minutes)
+
+    _, elapsed, queries, query_seconds = _timed(
+        lambda: call_command("cleanup_raw_metrics", stdout=io.StringIO())
+    )
+
+    return {
+        "rows": rows,
+        "seconds": round(elapsed, 4),
+        "rows_deleted_per_second": round(rows / elapsed, 1),
+        "queries": queries,
+        "query_seconds": round(query_seconds, 4),
+    }
+
+
+BENCHMARKS = {
+    "ingest": bench_ingest,
+    "aggregation": bench_aggregation,
+    "policies": bench_policy_evaluation,
+    "cleanup": bench_cleanup,
+}
@@ -0,0 +1,287 @@
+"""
+Endpoint cardinality limiting for aggregation.
+
+A single client sending unique URLs (ids in paths, cache busters, ...) would
+otherwise create one AggregatedMetric series per URL. The limiter admits a
+bounded number of distinct endpoints per project and folds everything else
+into a shared overflow series.
+
+Key properties:
+- Bounded memory: at most max_endpoints admitted names per project, plus a
+  fixed-size HyperLogLog sketch for the overflow estimate
+- Deterministic: a window's endpoints are admitted by request count, then
+  name, so both aggregation engines and repeated runs fold the same ones
+- Sticky: admissions hold for the whole horizon (the longest bucket), shared
+  through Redis, so an endpoint's 5m and 1h buckets are never split between
+  its own series and the overflow series; without Redis each worker keeps
+  its own admissions
+- Observable: folded request counts and distinct-endpoint estimates are kept
+  per project for logging and task counters
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+
+import redis
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Endpoint name used for the series that absorbs over-limit endpoints
+OVERFLOW_ENDPOINT = "__other__"
+
+ADMITTED_KEY_PREFIX = "cardinality:"
+
+
+class HyperLogLog:
+    """
+    Minimal HyperLogLog cardinality estimator.
+
+    Uses 2**precision single-byte registers (1 KiB at the default precision),
+    giving a standard error of roughly 1.04 / sqrt(2**precision) (~3%).
+    """
+
+    def __init__(self, precision: int = 10):
+        self.precision = precision
+        self.num_registers = 1 << precision
+        self.registers = bytearray(self.num_registers)
+
+    def add(self, value: str) -> None:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+        hashed = int.from_bytes(digest, "big")
+
+        register = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining bits (1-based)
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def count(self) -> int:
+        m = self.num_registers
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # Small-range correction (linear counting)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+@dataclass
+class ProjectOverflow:
+    """Overflow counters for a single project within one window."""
+
+    folded_requests: int = 0
+    folded_endpoints: HyperLogLog = field(default_factory=HyperLogLog)
+
+
+class LocalAdmissionStore:
+    """Per-process admitted endpoint sets, dropped once their horizon expires."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sets = {}
+
+    def admit(self, key: str, max_endpoints: int, ttl: int, candidates) -> list:
+        now = time.monotonic()
+        with self._lock:
+            for stale in [k for k, (_, expires) in self._sets.items() if expires <= now]:
+                del self._sets[stale]
+
+            admitted, _ = self._sets.get(key, (set(), None))
+            flags = []
+            for endpoint in candidates:
+                if endpoint in admitted:
+                    flags.append(True)
+                elif len(admitted) < max_endpoints:
+                    admitted.add(endpoint)
+                    flags.append(True)
+                else:
+                    flags.append(False)
+            self._sets[key] = (admitted, now + ttl)
+            return flags
+
+
+# KEYS[1] = admitted endpoint set of one project and horizon
+# ARGV[1] = max endpoints, ARGV[2] = ttl, ARGV[3..] = candidates, best first
+# Returns 1 (admitted) or 0 (folded) per candidate
+ADMIT_SCRIPT = """
+local size = redis.call('SCARD', KEYS[1])
+local limit = tonumber(ARGV[1])
+local result = {}
+for i = 3, #ARGV do
+    if redis.call('SISMEMBER', KEYS[1], ARGV[i]) == 1 then
+        result[#result + 1] = 1
+    elseif size < limit then
+        redis.call('SADD', KEYS[1], ARGV[i])
+        size = size + 1
+        result[#result + 1] = 1
+    else
+        result[#result + 1] = 0
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return result
+"""
+
+_admit_script = None
+_local_admissions = LocalAdmissionStore()
+
+
+def admit_shared(key: str, max_endpoints: int, ttl: int, candidates) -> list:
+    """
+    Admit candidates into a shared endpoint set, keeping earlier admissions.
+
+    Args:
+        key: Set identifier (project and horizon)
+        max_endpoints: Size limit of the set
+        ttl: Seconds the set is kept after its last use
+        candidates: Endpoints in priority order
+
+    Returns:
+        list[bool]: Whether each candidate is admitted
+    """
+    global _admit_script
+
+    client = get_redis()
+    if client is not None:
+        try:
+            if _admit_script is None:
+                _admit_script = client.register_script(ADMIT_SCRIPT)
+            flags = _admit_script(
+                keys=[ADMITTED_KEY_PREFIX + key],
+                args=[max_endpoints, ttl, *candidates],
+                client=client,
+            )
+            return [bool(flag) for flag in flags]
+        except redis.RedisError as e:
+            logger.warning(f"Endpoint admission falling back to memory: {e}")
+
+    return _local_admissions.admit(key, max_endpoints, ttl, candidates)
+
+
+class EndpointCardinalityLimiter:
+    """
+    Admit at most max_endpoints distinct endpoints per project and horizon.
+
+    Endpoints beyond the limit are mapped to OVERFLOW_ENDPOINT. The overflow
+    series itself does not count against the limit.
+
+    Aggregation calls admit_window() with the window's request counts first,
+    which decides every endpoint of the window; admit() then only resolves
+    names. Without admit_window(), admit() admits in first-seen order.
+
+    Args:
+        max_endpoints: Maximum distinct endpoints per project, or None
+            to disable limiting
+    """
+
+    def __init__(self, max_endpoints=None):
+        self.max_endpoints = max_endpoints
+        # (project_id, horizon_start) -> admitted endpoint names
+        self._admitted = {}
+        # (project_id, horizon_start) decided by admit_window
+        self._ranked = set()
+        self._overflow = {}
+
+    def admit_window(self, endpoint_requests: dict, horizon_start=None, horizon_seconds: int = 3600) -> None:
+        """
+        Decide admission for a window's endpoints, most requested first
+        (ties by name), on top of what the horizon already admitted.
+
+        Args:
+            endpoint_requests: (project_id, endpoint) -> requests in the window,
+                weighted by sample rate
+            horizon_start: Aware start of the horizon admissions stick for
+                (e.g. the hour holding the window); None keeps them to this
+                limiter
+            horizon_seconds: Length of the horizon
+        """
+        if self.max_endpoints is None:
+            return
+
+        by_project = {}
+        for (project_id, endpoint), requests in endpoint_requests.items():
+            by_project.setdefault(project_id, []).append((-requests, endpoint))
+
+        for project_id, ranked in by_project.items():
+            scope = (project_id, horizon_start)
+            admitted = self._admitted.setdefault(scope, set())
+            candidates = [endpoint for _, endpoint in sorted(ranked) if endpoint not in admitted]
+
+            if horizon_start is None:
+                for endpoint in candidates:
+                    if len(admitted) < self.max_endpoints:
+                        admitted.add(endpoint)
+            elif candidates:
+                flags = admit_shared(
+                    f"{project_id}:{int(horizon_start.timestamp())}",
+                    self.max_endpoints,
+                    # Outlive the horizon so late windows of it still see it
+                    2 * horizon_seconds,
+                    candidates,
+                )
+                admitted.update(endpoint for endpoint, flag in zip(candidates, flags) if flag)
+
+            self._ranked.add(scope)
+
+    def admit(self, project_id, endpoint: str, requests: int = 1, horizon_start=None) -> str:
+        """
+        Return the endpoint name the request should be aggregated under.
+
+        Args:
+            project_id: Project the request belongs to
+            endpoint: Endpoint reported by the client
+            requests: Number of requests this call stands for (lets callers
+                admit each distinct endpoint once)
+            horizon_start: Horizon passed to admit_window, if any
+
+        Returns:
+            str: endpoint itself if admitted, otherwise OVERFLOW_ENDPOINT
+        """
+        if self.max_endpoints is None:
+            return endpoint
+
+        scope = (project_id, horizon_start)
+        admitted = self._admitted.setdefault(scope, set())
+
+        if endpoint in admitted:
+            return endpoint
+
+        if scope not in self._ranked and len(admitted) < self.max_endpoints:
+            admitted.add(endpoint)
+            return endpoint
+
+        overflow = self._overflow.get(project_id)
+        if overflow is None:
+            overflow = self._overflow[project_id] = ProjectOverflow()
+
+        overflow.folded_requests += requests
+        overflow.folded_endpoints.add(endpoint)
+        return OVERFLOW_ENDPOINT
+
+    def overflow_stats(self) -> dict:
+        """
+        Summarise folding per project.
+
+        Returns:
+            dict: project_id -> {"folded_requests", "folded_endpoints"},
+            only for projects that exceeded the limit. folded_endpoints is
+            a HyperLogLog estimate.
+        """
+        return {
+            project_id: {
+                "folded_requests": overflow.folded_requests,
+                "folded_endpoints": overflow.folded_endpoints.count(),
+            }
+            for project_id, overflow in self._overflow.items()
+        }
@@ -0,0 +1,247 @@
+"""
+Long-term rollups and retention for AggregatedMetric.
+
+aggregate_metrics writes 1m, 5m and 1h buckets from raw metrics. Coarser
+buckets are never built from raw rows: compact_buckets merges completed
+finer buckets into them (1h -> 1d, 1d -> 1w), and prune_aggregated_metrics
+then deletes fine rows past their retention once a coarser bucket covers
+them.
+
+Counts and status classes are summed exactly. p95 is merged through
+LatencySketch: 1h rows carry a sketch (SKETCHED_BUCKET_SIZES), rows written
+before that are approximated by their p95. Compacted rows keep
+their merged sketch, so 1w buckets merge 1d sketches without further loss.
+
+Key properties:
+- Idempotent: each run recomputes the last COMPACTION_LOOKBACK_BUCKETS
+  completed buckets from their sources and overwrites them
+- Bounded: one query per target size for the sources and one for the
+  existing targets, plus one bulk insert and one bulk update
+- Safe retention: a resolution is only pruned up to the end of the newest
+  bucket of the resolution it is compacted into
+"""
+
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .aggregation import (
+    BUCKET_DEFINITIONS,
+    COMPACTED_BUCKET_DEFINITIONS,
+    STATUS_CLASS_FIELDS,
+    get_bucket_start,
+    merge_method_breakdown,
+)
+from .exemplars import merge_exemplars
+from .instrumentation import incr, phase
+from .models import AggregatedMetric
+from .sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+# Target bucket size -> the finer size it is built from
+COMPACTION_SOURCES = {
+    "1d": "1h",
+    "1w": "1d",
+}
+
+# Bucket size -> coarser size whose rows must cover it before it is pruned
+RETENTION_COMPACTED_INTO = {
+    "1m": "1h",
+    "5m": "1h",
+    "1h": "1d",
+    "1d": "1w",
+}
+
+DEFAULT_RETENTION_DAYS = {
+    "1m": 7,
+    "5m": 30,
+    "1h": 180,
+    "1d": 1825,
+    "1w": None,
+}
+
+
+def bucket_delta(bucket_size: str) -> timedelta:
+    return BUCKET_DEFINITIONS.get(bucket_size) or COMPACTED_BUCKET_DEFINITIONS[bucket_size]
+
+
+def _compact_group(rows) -> dict:
+    """Merged field values of one target bucket's source rows."""
+    sketch = LatencySketch()
+    values = {
+        "request_count": 0,
+        "error_count": 0,
+        **dict.fromkeys(STATUS_CLASS_FIELDS, 0),
+        "method_breakdown": None,
+        "exemplars": None,
+    }
+
+    for row in rows:
+        values["request_count"] += row.request_count
+        values["error_count"] += row.error_count
+        for field in STATUS_CLASS_FIELDS:
+            values[field] += getattr(row, field)
+
+        if row.latency_sketch is not None:
+            sketch.merge(LatencySketch.from_dict(row.latency_sketch))
+        elif row.request_count:
+            sketch.add(row.p95_latency_ms, row.request_count)
+
+        if row.method_breakdown:
+            values["method_breakdown"] = merge_method_breakdown(
+                values["method_breakdown"], row.method_breakdown
+            )
+        values["exemplars"] = merge_exemplars(values["exemplars"], row.exemplars)
+
+    values["p95_latency_ms"] = sketch.p95()
+    values["latency_sketch"] = sketch.to_dict()
+    return values
+
+
+def compact_buckets(target_size: str, now=None, since=None) -> int:
+    """
+    Build or refresh the recent completed target_size buckets from their
+    source buckets.
+
+    Args:
+        target_size: "1d" or "1w"
+        now: Current time, for tests
+        since: Recompute from the bucket containing this time instead of
+            the last COMPACTION_LOOKBACK_BUCKETS (e.g. after a bulk import);
+            processed COMPACTION_CHUNK_BUCKETS buckets at a time
+
+    Returns:
+        int: Number of target rows written
+    """
+    now = now or timezone.now()
+    target_delta = COMPACTED_BUCKET_DEFINITIONS[target_size]
+
+    # Only closed buckets; hours aggregated late land on the next run, since
+    # the lookback recomputes them
+    end = get_bucket_start(now, target_delta)
+    if since is None:
+        lookback = int(getattr(settings, "COMPACTION_LOOKBACK_BUCKETS", 2))
+        return _compact_range(target_size, end - lookback * target_delta, end)
+
+    chunk = int(getattr(settings, "COMPACTION_CHUNK_BUCKETS", 7)) * target_delta
+    written = 0
+    chunk_start = get_bucket_start(since, target_delta)
+    while chunk_start < end:
+        written += _compact_range(target_size, chunk_start, min(chunk_start + chunk, end))
+        chunk_start += chunk
+    return written
+
+
+def _compact_range(target_size: str, start, end) -> int:
+    """Recompute the target_size buckets in [start, end), both aligned."""
+    source_size = COMPACTION_SOURCES[target_size]
+    target_delta = COMPACTED_BUCKET_DEFINITIONS[target_size]
+
+    # 1. Load source rows and group them per target bucket
+    with phase("fetch"):
+        sources = AggregatedMetric.objects.filter(
+            bucket_size=source_size,
+            bucket_start__gte=start,
+            bucket_start__lt=end,
+        ).order_by("bucket_start")
+
+        groups = defaultdict(list)
+        for row in sources:
+            groups[(row.project_id, row.endpoint, get_bucket_start(row.bucket_start, target_delta))].append(row)
+
+    if not groups:
+        return 0
+
+    with phase("merge"):
+        merged = {key: _compact_group(rows) for key, rows in groups.items()}
+
+    # 2. Overwrite existing targets, create the rest
+    fields = list(next(iter(merged.values())))
+    with phase("write"), transaction.atomic():
+        existing = {
+            (m.project_id, m.endpoint, m.bucket_start): m
+            for m in AggregatedMetric.objects.select_for_update().filter(
+                bucket_size=target_size,
+                bucket_start__gte=start,
+                bucket_start__lt=end,
+            )
+        }
+
+        to_create = []
+        to_update = []
+        for (project_id, endpoint, target_start), values in merged.items():
+            row = existing.get((project_id, endpoint, target_start))
+            if row is None:
+                to_create.append(AggregatedMetric(
+                    project_id=project_id,
+                    endpoint=endpoint,
+                    bucket_start=target_start,
+                    bucket_size=target_size,
+                    **values,
+                ))
+                continue
+            for field, value in values.items():
+                setattr(row, field, value)
+            to_update.append(row)
+
+        AggregatedMetric.objects.bulk_create(to_create)
+        AggregatedMetric.objects.bulk_update(to_update, fields)
+
+    written = len(to_create) + len(to_update)
+    incr("rows_compacted", written)
+    return written
+
+
+def prune_aggregated_metrics(now=None) -> dict:
+    """
+    Delete aggregated rows past their resolution's retention, but never
+    beyond what the next coarser resolution already covers.
+
+    Returns:
+        dict: bucket_size -> rows deleted
+    """
+    now = now or timezone.now()
+    retention = {**DEFAULT_RETENTION_DAYS, **getattr(settings, "AGGREGATED_RETENTION_DAYS", {})}
+    batch_size = int(getattr(settings, "AGGREGATED_RETENTION_BATCH_SIZE", 10000))
+
+    deleted = {}
+    for bucket_size, days in retention.items():
+        if days is None:
+            continue
+
+        cutoff = now - timedelta(days=days)
+
+        coarser = RETENTION_COMPACTED_INTO.get(bucket_size)
+        if coarser is not None:
+            newest = AggregatedMetric.objects.filter(bucket_size=coarser).aggregate(
+                newest=Max("bucket_start")
+            )["newest"]
+            if newest is None:
+                # Nothing compacted yet; keep everything
+                continue
+            cutoff = min(cutoff, newest + bucket_delta(coarser))
+
+        # Delete in batches so one run never holds a huge delete
+        total = 0
+        with phase("delete"):
+            while True:
+                ids = list(
+                    AggregatedMetric.objects
+                    .filter(bucket_size=bucket_size, bucket_start__lt=cutoff)
+                    .values_list("id", flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                count, _ = AggregatedMetric.objects.filter(id__in=ids).delete()
+                total += count
+
+        deleted[bucket_size] = total
+        incr("rows_deleted", total)
+
+    return deleted
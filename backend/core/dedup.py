@@ -0,0 +1,197 @@
+"""
+Ingest deduplication by client event id.
+
+SDKs retry ingest on timeouts, and without dedup every retry is stored as
+another RequestMetric. Clients may send an event_id with each metric; a
+repeat of an (project, event_id) pair within INGEST_DEDUP_WINDOW_SECONDS is
+accepted but not stored.
+
+Event ids are tracked in a rotating, time-partitioned Bloom filter: the
+window is split into INGEST_DEDUP_PARTITIONS partitions, new ids go into
+the current one, and lookups check all partitions still inside the window.
+Expired partitions are dropped whole, so no per-id cleanup is needed.
+
+A Bloom filter can report false positives but never false negatives, so
+"probably seen" answers are confirmed with one exact query on RequestMetric
+per batch (see views.py). That query uses the (project, timestamp) index,
+because a retry carries the original timestamp; no unique index on the raw
+table is needed.
+
+Key properties:
+- One round-trip per batch: the lookups and inserts of all of a batch's ids
+  run in one EVALSHA on Redis
+- Bounded memory: each partition is a fixed bitmap sized for
+  INGEST_DEDUP_CAPACITY ids at INGEST_DEDUP_ERROR_RATE, and at most
+  INGEST_DEDUP_PARTITIONS + 1 partitions exist at a time
+- Fail-open: without Redis, or if it fails, each worker keeps its own
+  in-memory filter
+"""
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DEDUP_KEY_PREFIX = "ingest:dedup:"
+
+
+# KEYS = partition bitmaps, current partition first
+# ARGV[1] = ttl of the current partition (seconds), ARGV[2] = offsets per id,
+# ARGV[3..] = bit offsets of each id in turn
+# Returns one character per id: "1" if every bit of the id was already set in
+# one of the partitions (probably seen), else "0" after setting its bits in
+# the current partition
+BLOOM_CHECK_AND_ADD_SCRIPT = """
+local hashes = tonumber(ARGV[2])
+local result = {}
+for first = 3, #ARGV, hashes do
+    local last = first + hashes - 1
+    local seen = 0
+    for _, key in ipairs(KEYS) do
+        seen = 1
+        for i = first, last do
+            if redis.call('GETBIT', key, ARGV[i]) == 0 then
+                seen = 0
+                break
+            end
+        end
+        if seen == 1 then
+            break
+        end
+    end
+    if seen == 0 then
+        for i = first, last do
+            redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+        end
+    end
+    result[#result + 1] = tostring(seen)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return table.concat(result)
+"""
+
+_bloom_script = None
+
+
+def bloom_parameters(capacity: int, error_rate: float) -> tuple:
+    """
+    Optimal Bloom filter size for a capacity and false-positive rate.
+
+    Returns:
+        tuple[int, int]: (number of bits, number of hash functions)
+    """
+    bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def bit_offsets(item: str, bits: int, hashes: int) -> list:
+    """Bit positions of item, by double hashing one 128-bit digest."""
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class LocalBloomFilter:
+    """Per-process time-partitioned Bloom filter, used when Redis is unavailable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._partitions = OrderedDict()
+
+    def check_and_add(self, partitions: list, bits: int, offsets_by_id: list) -> list:
+        with self._lock:
+            # Drop partitions that fell out of the window
+            for index in list(self._partitions):
+                if index not in partitions:
+                    del self._partitions[index]
+
+            current = partitions[0]
+            bitmap = self._partitions.get(current)
+            if bitmap is None or len(bitmap) * 8 < bits:
+                self._partitions[current] = bytearray((bits + 7) // 8)
+            bitmaps = [
+                bitmap
+                for bitmap in (self._partitions.get(index) for index in partitions)
+                if bitmap is not None and len(bitmap) * 8 >= bits
+            ]
+
+            seen = []
+            for offsets in offsets_by_id:
+                hit = any(
+                    all(bitmap[offset >> 3] & (1 << (offset & 7)) for offset in offsets)
+                    for bitmap in bitmaps
+                )
+                if not hit:
+                    for offset in offsets:
+                        bitmaps[0][offset >> 3] |= 1 << (offset & 7)
+                seen.append(hit)
+            return seen
+
+
+_local_filter = LocalBloomFilter()
+
+
+def _window_partitions(now: float) -> tuple:
+    """Current partition index first, then the older ones still in the window."""
+    window = getattr(settings, "INGEST_DEDUP_WINDOW_SECONDS", 3600)
+    count = max(int(getattr(settings, "INGEST_DEDUP_PARTITIONS", 4)), 1)
+    length = max(window / count, 1)
+
+    current = int(now // length)
+    return [current - i for i in range(count + 1)], math.ceil(length * (count + 1))
+
+
+def probably_seen(project_id, event_ids: list, now=None) -> list:
+    """
+    Record a batch of event ids and report which were probably seen before.
+
+    Args:
+        project_id: Project the events belong to
+        event_ids: Client-generated ids, identical across retries, without
+            duplicates
+        now: Unix time, for tests
+
+    Returns:
+        list[bool]: Per id, True if it is probably a repeat within the dedup
+        window. False positives are possible at INGEST_DEDUP_ERROR_RATE, so
+        confirm before discarding data.
+    """
+    if not event_ids:
+        return []
+
+    bits, hashes = bloom_parameters(
+        int(getattr(settings, "INGEST_DEDUP_CAPACITY", 1_000_000)),
+        float(getattr(settings, "INGEST_DEDUP_ERROR_RATE", 0.001)),
+    )
+    offsets_by_id = [bit_offsets(f"{project_id}:{event_id}", bits, hashes) for event_id in event_ids]
+    partitions, ttl = _window_partitions(time.time() if now is None else now)
+
+    client = get_redis()
+    if client is not None:
+        global _bloom_script
+        try:
+            if _bloom_script is None:
+                _bloom_script = client.register_script(BLOOM_CHECK_AND_ADD_SCRIPT)
+            seen = _bloom_script(
+                keys=[f"{DEDUP_KEY_PREFIX}{bits}:{index}" for index in partitions],
+                args=[ttl, hashes, *(offset for offsets in offsets_by_id for offset in offsets)],
+                client=client,
+            )
+            if isinstance(seen, bytes):
+                seen = seen.decode()
+            return [flag == "1" for flag in seen]
+        except redis.RedisError as e:
+            logger.warning(f"Ingest dedup falling back to memory: {e}")
+
+    return _local_filter.check_and_add(partitions, bits, offsets_by_id)
@@ -0,0 +1,145 @@
+"""
+Asynchronous HTTP delivery for webhook and Slack notification channels.
+
+deliver() sends a batch of notifications concurrently on one asyncio event
+loop and one httpx.AsyncClient, so connections to the same receiver are
+kept alive across deliveries and retries.
+
+Key properties:
+- Isolated: each channel has its own semaphore (max_concurrency), and every
+  request has a hard timeout. A slow or dead receiver only delays its own
+  deliveries, not the rest of the batch.
+- Retried: connection errors, timeouts, 429 and 5xx responses are retried
+  with exponential backoff and full jitter. Other 4xx responses are final.
+- Never raises for a failed receiver: the outcome of every delivery is
+  returned, and the caller dead-letters the failures.
+
+Pass an httpx transport (e.g. httpx.MockTransport) to deliver() to run
+against a local stub instead of the network.
+"""
+
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Optional
+
+import httpx
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {408, 425, 429}
+
+
+@dataclass
+class Delivery:
+    """One notification to POST to a webhook."""
+
+    channel_id: Optional[int]
+    kind: str
+    url: str
+    payload: dict
+    alert_ids: list = field(default_factory=list)
+    max_concurrency: int = 4
+
+    def as_dict(self) -> dict:
+        return {
+            "channel_id": self.channel_id,
+            "kind": self.kind,
+            "url": self.url,
+            "payload": self.payload,
+            "alert_ids": self.alert_ids,
+            "max_concurrency": self.max_concurrency,
+        }
+
+
+@dataclass
+class DeliveryResult:
+    delivery: Delivery
+    ok: bool
+    attempts: int
+    status_code: Optional[int] = None
+    error: str = ""
+
+
+def _is_retryable(status_code: int) -> bool:
+    return status_code >= 500 or status_code in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+async def _deliver_one(client, semaphore, delivery, max_attempts, base, cap) -> DeliveryResult:
+    status_code = None
+    error = ""
+
+    for attempt in range(1, max_attempts + 1):
+        async with semaphore:
+            try:
+                response = await client.post(delivery.url, json=delivery.payload)
+                status_code = response.status_code
+                if status_code < 400:
+                    return DeliveryResult(delivery, True, attempt, status_code)
+                error = f"HTTP {status_code}: {response.text[:200]}"
+                if not _is_retryable(status_code):
+                    return DeliveryResult(delivery, False, attempt, status_code, error)
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+
+        # Sleep outside the semaphore so other deliveries to the channel proceed
+        if attempt < max_attempts:
+            await asyncio.sleep(backoff_delay(attempt, base, cap))
+
+    return DeliveryResult(delivery, False, max_attempts, status_code, error)
+
+
+async def deliver_async(deliveries, transport=None) -> list:
+    """Deliver all notifications concurrently; see deliver()."""
+    timeout = getattr(settings, "NOTIFICATION_HTTP_TIMEOUT_SECONDS", 5)
+    max_attempts = getattr(settings, "NOTIFICATION_MAX_ATTEMPTS", 4)
+    base = getattr(settings, "NOTIFICATION_RETRY_BACKOFF_SECONDS", 1.0)
+    cap = getattr(settings, "NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS", 30.0)
+    pool_size = getattr(settings, "NOTIFICATION_HTTP_POOL_SIZE", 50)
+
+    # One semaphore per receiver (channel, or URL for unsaved channels)
+    semaphores = {}
+    for delivery in deliveries:
+        key = delivery.channel_id or delivery.url
+        if key not in semaphores:
+            semaphores[key] = asyncio.Semaphore(max(delivery.max_concurrency, 1))
+
+    async with httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout),
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        transport=transport,
+    ) as client:
+        return await asyncio.gather(*(
+            _deliver_one(
+                client,
+                semaphores[delivery.channel_id or delivery.url],
+                delivery,
+                max_attempts,
+                base,
+                cap,
+            )
+            for delivery in deliveries
+        ))
+
+
+def deliver(deliveries, transport=None) -> list:
+    """
+    POST every delivery, with per-channel concurrency limits and retries.
+
+    Args:
+        deliveries: list of Delivery
+        transport: Optional httpx async transport, for tests
+
+    Returns:
+        list[DeliveryResult]: One per delivery, in order
+    """
+    if not deliveries:
+        return []
+    return asyncio.run(deliver_async(deliveries, transport=transport))
@@ -0,0 +1,95 @@
+"""
+Exemplar requests kept with each aggregated bucket.
+
+While grouping a window, aggregate_metrics keeps, per (project, endpoint,
+bucket):
+
+- the EXEMPLARS_SLOWEST slowest requests (a bounded top-K)
+- a uniform sample of EXEMPLARS_ERRORS 5xx requests (bottom-k by a hash of
+  the row id)
+
+They are stored compactly on AggregatedMetric.exemplars and copied onto the
+AlertEvents fired for the bucket, so the requests behind an alert can be
+looked at directly, also after cleanup_raw_metrics removed the raw rows.
+
+Key properties:
+- Bounded: at most EXEMPLARS_SLOWEST + EXEMPLARS_ERRORS entries per bucket
+- Mergeable: both selections can be recomputed from two exemplar sets, so
+  re-aggregated windows fold into an existing bucket's exemplars
+- Deterministic: ties and the error sample depend only on row ids, so the
+  Python and NumPy engines pick the same rows
+"""
+
+import heapq
+
+from django.conf import settings
+
+MASK_64 = (1 << 64) - 1
+
+# Fibonacci hashing multiplier; spreads sequential ids over 64 bits
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+def sample_priority(row_id: int) -> int:
+    """Pseudo-random rank of a row for the error sample (lowest kept)."""
+    return (row_id * HASH_MULTIPLIER) & MASK_64
+
+
+def exemplar_limits() -> tuple:
+    return (
+        int(getattr(settings, "EXEMPLARS_SLOWEST", 5)),
+        int(getattr(settings, "EXEMPLARS_ERRORS", 5)),
+    )
+
+
+def make_exemplar(row_id, timestamp, method, status_code, latency_ms) -> dict:
+    return {
+        "id": row_id,
+        "timestamp": timestamp.isoformat(),
+        "method": method,
+        "status_code": status_code,
+        "latency_ms": latency_ms,
+    }
+
+
+def _slowest_key(exemplar):
+    # Slowest first; among equal latencies the oldest row
+    return (exemplar["latency_ms"], -exemplar["id"])
+
+
+def select_exemplars(candidates) -> dict:
+    """
+    Pick the slowest requests and the error sample from exemplar dicts.
+
+    Args:
+        candidates: Iterable of exemplar dicts (see make_exemplar)
+
+    Returns:
+        dict: {"slowest": [...], "errors": [...]}, or None if empty
+    """
+    slowest_k, errors_k = exemplar_limits()
+
+    unique = {}
+    for exemplar in candidates:
+        unique[exemplar["id"]] = exemplar
+    if not unique:
+        return None
+
+    slowest = heapq.nlargest(slowest_k, unique.values(), key=_slowest_key)
+    errors = heapq.nsmallest(
+        errors_k,
+        (e for e in unique.values() if e["status_code"] >= 500),
+        key=lambda e: sample_priority(e["id"]),
+    )
+    return {"slowest": slowest, "errors": errors}
+
+
+def merge_exemplars(existing, new):
+    """Combine two exemplar sets as if their rows were selected together."""
+    if not existing:
+        return new
+    if not new:
+        return existing
+    return select_exemplars(
+        existing["slowest"] + existing["errors"] + new["slowest"] + new["errors"]
+    )
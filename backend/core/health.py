@@ -0,0 +1,290 @@
+"""
+Self-monitoring for the ingest -> aggregate -> evaluate pipeline.
+
+collect_pipeline_health() reports the pipeline's own state using only cheap
+lookups (bounded index ranges, Redis LLEN, instrumentation counters). It
+never scans the metric tables. record_pipeline_health() additionally writes those
+numbers as AggregatedMetric rows of a built-in project, so ordinary
+AlertPolicies can alert on the pipeline itself, e.g. latency_p95 > 120000 on
+the "pipeline/aggregation_lag" endpoint.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .aggregation import BUCKET_DEFINITIONS, get_bucket_start, merge_preaggregated
+from .instrumentation import get_task_metrics
+from .models import AggregatedMetric, Project, RequestMetric
+from .redis_client import broker_queue_keys, get_redis
+from .sketch import LatencySketch
+
+logger = logging.getLogger(__name__)
+
+INGEST_SAMPLE_KEY = "health:ingest_sample"
+EVALUATION_SAMPLE_KEY = "health:evaluation_sample"
+
+# Fallback when Redis isn't configured: key -> sample
+_local_samples = {}
+
+
+def _load_sample(key):
+    client = get_redis()
+    if client is not None:
+        try:
+            raw = client.get(key)
+            return json.loads(raw) if raw else None
+        except redis.RedisError as e:
+            logger.warning(f"Could not read health sample {key}: {e}")
+    return _local_samples.get(key)
+
+
+def _store_sample(key, sample):
+    client = get_redis()
+    if client is not None:
+        try:
+            client.set(key, json.dumps(sample), ex=3600)
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Could not store health sample {key}: {e}")
+    _local_samples[key] = sample
+
+
+def get_ingest_rate(max_id):
+    """
+    Rows ingested per second, from the growth of RequestMetric's primary key
+    since the previous sample. Samples are refreshed at most every
+    HEALTH_INGEST_SAMPLE_SECONDS so the rate covers a useful interval.
+    """
+    now = time.time()
+    previous = _load_sample(INGEST_SAMPLE_KEY)
+    interval = getattr(settings, "HEALTH_INGEST_SAMPLE_SECONDS", 30)
+
+    rate = None
+    if previous and now > previous["at"]:
+        rate = max(0, max_id - previous["max_id"]) / (now - previous["at"])
+
+    if not previous or now - previous["at"] >= interval:
+        _store_sample(INGEST_SAMPLE_KEY, {"max_id": max_id, "at": now})
+
+    return rate
+
+
+def get_evaluation_latency(runs, seconds):
+    """
+    Average policy evaluation time per aggregation run since the previous
+    sample, from the aggregation task's cumulative run count and
+    phase:evaluate seconds. Unlike the lifetime average, a recent slowdown
+    shows up within one sample interval.
+
+    Returns:
+        float | None: Seconds per run, or None if no run finished since the
+        previous sample
+    """
+    now = time.time()
+    previous = _load_sample(EVALUATION_SAMPLE_KEY)
+    interval = getattr(settings, "HEALTH_INGEST_SAMPLE_SECONDS", 30)
+
+    if previous is None or runs < previous["runs"]:
+        # First sample, or the counters were reset
+        _store_sample(EVALUATION_SAMPLE_KEY, {"runs": runs, "seconds": seconds, "at": now})
+        return None
+
+    new_runs = runs - previous["runs"]
+    if not new_runs:
+        # Keep the old sample so the next run is measured against it
+        return None
+
+    latency = max(0.0, seconds - previous["seconds"]) / new_runs
+    if now - previous["at"] >= interval:
+        _store_sample(EVALUATION_SAMPLE_KEY, {"runs": runs, "seconds": seconds, "at": now})
+    return latency
+
+
+def get_queue_depths():
+    """
+    Pending task count per Celery queue on the Redis broker.
+
+    Returns:
+        dict: queue name -> length (None if Redis can't be reached)
+    """
+    queues = getattr(settings, "HEALTH_CELERY_QUEUES", ["celery"])
+    client = get_redis()
+    if client is None:
+        return {queue: None for queue in queues}
+
+    try:
+        pipe = client.pipeline(transaction=False)
+        for queue in queues:
+            for key in broker_queue_keys(queue):
+                pipe.llen(key)
+        lengths = iter(pipe.execute())
+        return {
+            queue: sum(next(lengths) for _ in broker_queue_keys(queue))
+            for queue in queues
+        }
+    except redis.RedisError as e:
+        logger.warning(f"Could not read Celery queue depths: {e}")
+        return {queue: None for queue in queues}
+
+
+def collect_pipeline_health():
+    """
+    Snapshot of the pipeline's own state.
+
+    Returns:
+        dict: ingest, aggregation, queues, tasks and alert evaluation figures
+    """
+    now = timezone.now()
+
+    # Newest raw timestamp among the most recently inserted rows (a primary
+    # key range). A single newest row could be a late or imported one with
+    # an old timestamp; future-dated rows from skewed clocks are ignored.
+    max_id = RequestMetric.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+    recent_rows = getattr(settings, "HEALTH_RECENT_RAW_ROWS", 10000)
+    newest_raw = RequestMetric.objects.filter(
+        id__gt=max_id - recent_rows,
+        timestamp__lte=now,
+    ).aggregate(newest=Max("timestamp"))["newest"]
+
+    # Newest 1m bucket by start time over a bounded recent range of the
+    # (bucket_size, bucket_start) index; rows created late for old buckets
+    # (imports, catch-up runs) don't count as progress
+    lookback = getattr(settings, "HEALTH_BUCKET_LOOKBACK_SECONDS", 6 * 3600)
+    newest_bucket = (
+        AggregatedMetric.objects
+        .filter(
+            bucket_size="1m",
+            bucket_start__gte=now - timedelta(seconds=lookback),
+            bucket_start__lte=now,
+        )
+        .exclude(project__name=getattr(settings, "SYSTEM_PROJECT_NAME", "__pipeline__"))
+        .aggregate(newest=Max("bucket_start"))["newest"]
+    )
+
+    # Lag between the newest raw data and the end of the newest 1m bucket
+    aggregation_lag = None
+    if newest_raw and newest_bucket:
+        bucket_end = newest_bucket + BUCKET_DEFINITIONS["1m"]
+        aggregation_lag = max(0.0, (newest_raw - bucket_end).total_seconds())
+
+    task_metrics = get_task_metrics()
+    tasks = {}
+    for task, values in task_metrics.items():
+        last_success = values.get("last_success_timestamp")
+        tasks[task] = {
+            "runs": int(values.get("runs_total", 0)),
+            "failures": int(values.get("failures_total", 0)),
+            "last_duration_seconds": values.get("last_duration_seconds"),
+            "last_success_at": (
+                datetime.fromtimestamp(last_success, tz=dt_timezone.utc)
+                if last_success else None
+            ),
+            "seconds_since_last_success": (
+                round(time.time() - last_success, 1) if last_success else None
+            ),
+        }
+
+    # Average time spent evaluating policies per recent aggregation run
+    aggregation = task_metrics.get("aggregate_metrics_task", {})
+    evaluation_latency = get_evaluation_latency(
+        int(aggregation.get("runs_total", 0)),
+        float(aggregation.get("phase:evaluate", 0.0)),
+    )
+
+    return {
+        "generated_at": now,
+        "ingest": {
+            "rate_per_second": get_ingest_rate(max_id),
+            "newest_raw_timestamp": newest_raw,
+        },
+        "aggregation": {
+            "newest_bucket_start": newest_bucket,
+            "lag_seconds": aggregation_lag,
+        },
+        "queues": get_queue_depths(),
+        "tasks": tasks,
+        "alert_evaluation": {
+            "avg_seconds_per_run": evaluation_latency,
+        },
+    }
+
+
+def get_system_project():
+    """Return the built-in project that pipeline health is recorded under."""
+    name = getattr(settings, "SYSTEM_PROJECT_NAME", "__pipeline__")
+    project = Project.objects.filter(name=name, owner=None).order_by("created_at").first()
+    if project is None:
+        project = Project.objects.create(name=name, owner=None)
+    return project
+
+
+def _health_submissions(health, bucket_start):
+    """
+    Map a health snapshot onto pre-aggregated submissions.
+
+    Gauges in seconds are stored as latency (p95_latency_ms); counts are
+    stored as request_count, so throughput and latency_p95 policies apply.
+    Every value is a sample, so the rows are overwritten rather than added
+    to (see record_pipeline_health).
+    """
+    def submission(endpoint, request_count=1, latency_ms=None):
+        sketch = LatencySketch()
+        if latency_ms is not None:
+            sketch.add(latency_ms, request_count or 1)
+        return {
+            "endpoint": endpoint,
+            "bucket_start": bucket_start,
+            "request_count": request_count,
+            "error_count": 0,
+            "sketch": sketch,
+        }
+
+    submissions = []
+
+    lag = health["aggregation"]["lag_seconds"]
+    if lag is not None:
+        submissions.append(submission("pipeline/aggregation_lag", latency_ms=lag * 1000))
+
+    rate = health["ingest"]["rate_per_second"]
+    if rate is not None:
+        submissions.append(submission("pipeline/ingest", request_count=int(rate * 60)))
+
+    for queue, depth in health["queues"].items():
+        if depth is not None:
+            submissions.append(submission(f"pipeline/queue/{queue}", request_count=depth))
+
+    evaluation = health["alert_evaluation"]["avg_seconds_per_run"]
+    if evaluation is not None:
+        submissions.append(
+            submission("pipeline/alert_evaluation", latency_ms=evaluation * 1000)
+        )
+
+    return submissions
+
+
+def record_pipeline_health():
+    """
+    Collect pipeline health and store it as metrics of the system project.
+
+    The snapshot replaces the current bucket's values: each bucket holds the
+    latest sample taken in it, however often the task runs.
+
+    Returns:
+        list[AggregatedMetric]: Rows written, for policy evaluation
+    """
+    health = collect_pipeline_health()
+    bucket_start = get_bucket_start(timezone.now(), BUCKET_DEFINITIONS["1m"])
+
+    submissions = _health_submissions(health, bucket_start)
+    if not submissions:
+        return []
+
+    project = get_system_project()
+    return merge_preaggregated(project.id, submissions, replace=True)
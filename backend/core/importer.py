@@ -0,0 +1,334 @@
+"""
+Bulk import of historical raw metrics (see the import_metrics command).
+
+Files are CSV (with a header row) or NDJSON, optionally gzip-compressed,
+with the ingest fields per row: endpoint, status_code, latency_ms,
+timestamp (ISO 8601 or Unix seconds), optional method, sample_rate,
+event_id, and project_id or api_key unless a default project is given.
+
+Key properties:
+- Constant memory: files are streamed and written chunk_rows rows at a
+  time, each chunk in its own transaction
+- Postgres loads chunks with COPY FROM STDIN; other databases use
+  bulk_create
+- Each API key / project id is resolved with one query, however many rows
+  use it
+- Every row is tagged with the import's import_id and re-aggregation
+  selects by that tag, so buckets that already hold other traffic (also
+  rows ingested while the import runs) are extended rather than double
+  counted
+"""
+
+import csv
+import gzip
+import io
+import json
+import logging
+import sys
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from celery import chord, group
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .aggregation import ROLLUP_ENDPOINT, get_bucket_start
+from .cardinality import OVERFLOW_ENDPOINT
+from .models import AggregationWindow, APIKey, Project, RequestMetric
+
+logger = logging.getLogger(__name__)
+
+# RequestMetric columns written by an import, in row order
+IMPORT_FIELDS = (
+    "project_id",
+    "endpoint",
+    "method",
+    "status_code",
+    "latency_ms",
+    "timestamp",
+    "sample_rate",
+    "event_id",
+    "import_id",
+)
+
+FORMAT_EXTENSIONS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+
+MAX_REPORTED_ERRORS = 10
+
+
+class MetricImportError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    rows_imported: int = 0
+    rows_skipped: int = 0
+    # First MAX_REPORTED_ERRORS "<file>:<line>: <error>" messages
+    errors: list = field(default_factory=list)
+    # Tag stored on every imported row (RequestMetric.import_id)
+    import_id: uuid.UUID = field(default_factory=uuid.uuid4)
+    # Starts of the re-aggregation windows holding imported rows
+    windows: set = field(default_factory=set)
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    for extension, file_format in FORMAT_EXTENSIONS.items():
+        if name.endswith(extension):
+            return file_format
+    raise MetricImportError(f"Can't tell the format of {path}; pass --format")
+
+
+def read_records(path, file_format):
+    """
+    Stream the records of a file ("-" for stdin), gunzipping it when it
+    starts with the gzip magic bytes.
+
+    Yields:
+        tuple: (line number, record dict or None, error message or None)
+    """
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        stream = gzip.GzipFile(fileobj=raw) if raw.peek(2)[:2] == b"\x1f\x8b" else raw
+        text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+        if file_format == "csv":
+            reader = csv.DictReader(text)
+            for record in reader:
+                yield reader.line_num, record, None
+            return
+
+        for line_number, line in enumerate(text, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Expected an object"
+                continue
+            yield line_number, record, None
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
+
+
+class ProjectResolver:
+    """Maps a row's project_id / api_key to a project id, one query per value."""
+
+    def __init__(self, default_project_id=None):
+        self.default_project_id = default_project_id
+        self._project_ids = {}
+        self._api_keys = {}
+
+    def resolve(self, record):
+        """Returns (project id, None) or (None, error message)."""
+        api_key = record.get("api_key")
+        if api_key:
+            if api_key not in self._api_keys:
+                self._api_keys[api_key] = (
+                    APIKey.objects.filter(key=api_key, is_active=True)
+                    .values_list("project_id", flat=True)
+                    .first()
+                )
+            project_id = self._api_keys[api_key]
+            return (project_id, None) if project_id else (None, "Unknown or inactive api_key")
+
+        raw_project_id = record.get("project_id")
+        if not raw_project_id:
+            if self.default_project_id is None:
+                return None, "Missing project_id or api_key"
+            return self.default_project_id, None
+
+        if raw_project_id not in self._project_ids:
+            try:
+                project_id = uuid.UUID(str(raw_project_id))
+            except ValueError:
+                project_id = None
+            if project_id is not None and not Project.objects.filter(id=project_id).exists():
+                project_id = None
+            self._project_ids[raw_project_id] = project_id
+        project_id = self._project_ids[raw_project_id]
+        return (project_id, None) if project_id else (None, "Unknown project_id")
+
+
+def _parse_timestamp(value):
+    if isinstance(value, (int, float)) or (isinstance(value, str) and value.replace(".", "", 1).isdigit()):
+        return datetime.fromtimestamp(float(value), dt_timezone.utc)
+    timestamp = parse_datetime(str(value))
+    if timestamp is not None and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+    return timestamp
+
+
+def parse_record(record, resolver, import_id=None):
+    """
+    Validate one record.
+
+    Args:
+        record: Record dict from read_records
+        resolver: ProjectResolver
+        import_id: Tag of the running import, stored with the row
+
+    Returns:
+        tuple: (row in IMPORT_FIELDS order, None) or (None, error message)
+    """
+    for name in ("endpoint", "status_code", "latency_ms", "timestamp"):
+        if record.get(name) in (None, ""):
+            return None, f"Missing field: {name}"
+
+    project_id, error = resolver.resolve(record)
+    if error:
+        return None, error
+
+    endpoint = str(record["endpoint"])
+    if endpoint == ROLLUP_ENDPOINT:
+        return None, f"endpoint '{ROLLUP_ENDPOINT}' is reserved for the project rollup"
+    if endpoint == OVERFLOW_ENDPOINT:
+        return None, f"endpoint '{OVERFLOW_ENDPOINT}' is reserved for folded endpoints"
+    if len(endpoint) > 255:
+        return None, "endpoint is longer than 255 characters"
+
+    method = str(record.get("method") or "GET").upper()
+    if len(method) > 10:
+        return None, "method is longer than 10 characters"
+
+    try:
+        status_code = int(record["status_code"])
+        latency_ms = int(round(float(record["latency_ms"])))
+        sample_rate = float(record.get("sample_rate") or 1.0)
+    except (TypeError, ValueError):
+        return None, "status_code, latency_ms and sample_rate must be numbers"
+    if not 0 < sample_rate <= 1:
+        return None, "sample_rate must be in (0, 1]"
+
+    timestamp = _parse_timestamp(record["timestamp"])
+    if timestamp is None:
+        return None, "Invalid timestamp format"
+
+    event_id = str(record.get("event_id") or "")
+    if len(event_id) > 64:
+        return None, "event_id must be a string of at most 64 characters"
+
+    return (project_id, endpoint, method, status_code, latency_ms, timestamp, sample_rate, event_id, import_id), None
+
+
+def _copy_rows(rows):
+    """Load rows with Postgres COPY FROM STDIN."""
+    quote = connection.ops.quote_name
+    table = quote(RequestMetric._meta.db_table)
+    columns = ", ".join(quote(RequestMetric._meta.get_field(name).column) for name in IMPORT_FIELDS)
+    with connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def _bulk_create_rows(rows):
+    RequestMetric.objects.bulk_create(
+        [RequestMetric(**dict(zip(IMPORT_FIELDS, row))) for row in rows]
+    )
+
+
+def import_files(paths, file_format=None, default_project_id=None, chunk_rows=10000,
+                 window=timedelta(hours=1), strict=False, progress=None):
+    """
+    Stream files into RequestMetric.
+
+    Args:
+        paths: File paths ("-" for stdin)
+        file_format: "csv" or "ndjson"; detected from each extension if None
+        default_project_id: Project of rows without project_id / api_key
+        chunk_rows: Rows per write (and per transaction)
+        window: Re-aggregation window size, for ImportResult.windows
+        strict: Raise MetricImportError on the first invalid row instead of
+            skipping it
+        progress: Called with the running ImportResult after each chunk
+
+    Returns:
+        ImportResult
+    """
+    write_rows = _copy_rows if connection.vendor == "postgresql" else _bulk_create_rows
+    resolver = ProjectResolver(default_project_id)
+    result = ImportResult()
+
+    def flush(chunk):
+        with transaction.atomic():
+            write_rows(chunk)
+        result.rows_imported += len(chunk)
+        chunk.clear()
+        if progress is not None:
+            progress(result)
+
+    chunk = []
+    for path in paths:
+        path_format = file_format or detect_format(path)
+        for line_number, record, error in read_records(path, path_format):
+            row = None
+            if error is None:
+                row, error = parse_record(record, resolver, result.import_id)
+            if error:
+                message = f"{path}:{line_number}: {error}"
+                if strict:
+                    raise MetricImportError(message)
+                result.rows_skipped += 1
+                if len(result.errors) < MAX_REPORTED_ERRORS:
+                    result.errors.append(message)
+                continue
+
+            result.windows.add(get_bucket_start(row[5], window))
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                flush(chunk)
+
+    if chunk:
+        flush(chunk)
+
+    return result
+
+
+def schedule_reaggregation(result, window=timedelta(hours=1)):
+    """
+    Queue re-aggregation of the imported rows, one task per window in
+    parallel, then one compaction of the touched days and weeks.
+
+    Rows newer than the newest window the live pipeline has committed
+    (AggregationWindow) are left to it.
+
+    Returns:
+        int: Number of re-aggregation tasks queued
+    """
+    from .tasks import compact_aggregated_metrics_task, reaggregate_metrics_task
+
+    if not result.rows_imported:
+        return 0
+
+    cutoff = AggregationWindow.objects.aggregate(end=Max("window_end"))["end"]
+    if cutoff is None:
+        cutoff = get_bucket_start(timezone.now(), timedelta(minutes=1))
+
+    windows = sorted(start for start in result.windows if start < cutoff)
+    if not windows:
+        return 0
+
+    header = group(
+        reaggregate_metrics_task.si(
+            start.isoformat(),
+            min(start + window, cutoff).isoformat(),
+            str(result.import_id),
+        )
+        for start in windows
+    )
+    chord(header)(compact_aggregated_metrics_task.si(since=windows[0].isoformat()))
+    return len(windows)
@@ -0,0 +1,251 @@
+"""
+Timing and query instrumentation for Celery tasks.
+
+Tasks open a TaskInstrumentation block. Inside it, pure functions such as
+aggregate_metrics mark phases and bump counters through the module-level
+phase() and incr() helpers. These are no-ops when nothing is being
+instrumented, so aggregation.py and policies.py stay free of task concerns.
+
+Each finished run is:
+- logged as one structured record (logger "core.instrumentation")
+- added to shared counters in Redis (per-process fallback without Redis),
+  which /metrics renders in the Prometheus text format
+- checked against the task's beat interval, with a warning when it gets close
+"""
+
+import contextvars
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import redis
+from django.conf import settings
+from django.db import connection
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("task_instrumentation", default=None)
+
+METRICS_KEY_PREFIX = "metrics:task:"
+METRICS_TASKS_KEY = "metrics:tasks"
+
+# Fallback store when Redis isn't configured: task -> field -> value
+_local_metrics = defaultdict(lambda: defaultdict(float))
+
+
+class TaskInstrumentation:
+    """
+    Collect phase timings, DB query counts and counters for one task run.
+
+    Usage:
+        with TaskInstrumentation("aggregate_metrics_task"):
+            aggregate_metrics(start, end)   # calls phase("fetch"), incr(...)
+
+    Args:
+        task_name: Name used in logs and exported metrics
+    """
+
+    def __init__(self, task_name: str):
+        self.task_name = task_name
+        self.phases = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.duration = 0.0
+        self.succeeded = False
+        self._token = None
+        self._wrapper = None
+        self._started = None
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._wrapper = connection.execute_wrapper(self._record_query)
+        self._wrapper.__enter__()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        self.succeeded = exc_type is None
+
+        self._wrapper.__exit__(exc_type, exc, tb)
+        _current.reset(self._token)
+
+        try:
+            self.report()
+        except Exception as e:
+            # Instrumentation must never fail the task itself
+            logger.error(f"Failed to report metrics for {self.task_name}: {e}")
+
+        return False
+
+    def _record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - started
+
+    def incr(self, name: str, amount=1):
+        self.counters[name] += amount
+
+    def as_dict(self) -> dict:
+        return {
+            "task": self.task_name,
+            "status": "success" if self.succeeded else "failure",
+            "duration_seconds": round(self.duration, 6),
+            "queries": self.queries,
+            "query_seconds": round(self.query_seconds, 6),
+            "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            "counters": dict(self.counters),
+        }
+
+    def report(self):
+        record = self.as_dict()
+        # One JSON document per run so log pipelines can parse it directly
+        logger.info(
+            f"task_metrics {json.dumps(record, sort_keys=True)}",
+            extra={"task_metrics": record},
+        )
+
+        interval = getattr(settings, "TASK_SCHEDULE_SECONDS", {}).get(self.task_name)
+        ratio = getattr(settings, "TASK_RUNTIME_WARNING_RATIO", 0.8)
+        if interval and self.duration >= interval * ratio:
+            logger.warning(
+                f"Task {self.task_name} took {self.duration:.1f}s, "
+                f"{self.duration / interval:.0%} of its {interval}s schedule",
+                extra={"task_metrics": record},
+            )
+
+        record_task_metrics(self)
+
+
+def phase(name: str):
+    """Time a phase of the current instrumented task (no-op outside one)."""
+    instrumentation = _current.get()
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.phase(name)
+
+
+def incr(name: str, amount=1):
+    """Bump a counter on the current instrumented task (no-op outside one)."""
+    instrumentation = _current.get()
+    if instrumentation is not None:
+        instrumentation.incr(name, amount)
+
+
+def _metric_fields(run: TaskInstrumentation) -> dict:
+    fields = {
+        "runs_total": 1,
+        "failures_total": 0 if run.succeeded else 1,
+        "duration_seconds_total": run.duration,
+        "queries_total": run.queries,
+        "query_seconds_total": run.query_seconds,
+    }
+    for name, seconds in run.phases.items():
+        fields[f"phase:{name}"] = seconds
+    for name, value in run.counters.items():
+        fields[f"counter:{name}"] = value
+    return fields
+
+
+def record_task_metrics(run: TaskInstrumentation) -> None:
+    """Add a finished run to the shared task metrics."""
+    fields = _metric_fields(run)
+    gauges = {"last_duration_seconds": run.duration}
+    if run.succeeded:
+        gauges["last_success_timestamp"] = time.time()
+
+    client = get_redis()
+    if client is not None:
+        key = METRICS_KEY_PREFIX + run.task_name
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.sadd(METRICS_TASKS_KEY, run.task_name)
+            for field, value in fields.items():
+                pipe.hincrbyfloat(key, field, value)
+            pipe.hset(key, mapping=gauges)
+            pipe.execute()
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Could not export task metrics to Redis: {e}")
+
+    local = _local_metrics[run.task_name]
+    for field, value in fields.items():
+        local[field] += value
+    local.update(gauges)
+
+
+def get_task_metrics() -> dict:
+    """
+    Return accumulated metrics for every instrumented task.
+
+    Returns:
+        dict: task name -> {field: float}
+    """
+    client = get_redis()
+    if client is not None:
+        try:
+            tasks = sorted(t.decode() for t in client.smembers(METRICS_TASKS_KEY))
+            pipe = client.pipeline(transaction=False)
+            for task in tasks:
+                pipe.hgetall(METRICS_KEY_PREFIX + task)
+            return {
+                task: {k.decode(): float(v) for k, v in values.items()}
+                for task, values in zip(tasks, pipe.execute())
+            }
+        except redis.RedisError as e:
+            logger.warning(f"Could not read task metrics from Redis: {e}")
+
+    return {task: dict(values) for task, values in _local_metrics.items()}
+
+
+def render_prometheus(task_metrics: dict) -> str:
+    """Render get_task_metrics() output in the Prometheus text format."""
+    families = {
+        "runs_total": ("counter", "Task runs"),
+        "failures_total": ("counter", "Task runs that raised"),
+        "duration_seconds_total": ("counter", "Total task runtime in seconds"),
+        "queries_total": ("counter", "Database queries issued by the task"),
+        "query_seconds_total": ("counter", "Time spent in database queries"),
+        "last_duration_seconds": ("gauge", "Runtime of the most recent run"),
+        "last_success_timestamp": ("gauge", "Unix time of the last successful run"),
+    }
+
+    lines = []
+    for field, (kind, help_text) in families.items():
+        name = f"observability_task_{field}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for task, values in task_metrics.items():
+            if field in values:
+                lines.append(f'{name}{{task="{task}"}} {values[field]}')
+
+    for prefix, name, help_text, label in [
+        ("phase:", "observability_task_phase_seconds_total", "Time spent per task phase", "phase"),
+        ("counter:", "observability_task_items_total", "Rows, groups and other items processed", "item"),
+    ]:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for task, values in task_metrics.items():
+            for field, value in sorted(values.items()):
+                if field.startswith(prefix):
+                    lines.append(
+                        f'{name}{{task="{task}",{label}="{field[len(prefix):]}"}} {value}'
+                    )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,130 @@
+"""
+Short-lived named leases with fencing tokens.
+
+A lease lets one worker at a time run a piece of work (e.g. aggregating one
+window shard) across beat, workers and Celery retries. Holders get a fencing
+token from a global counter: tokens only grow, so the durable side of the
+work (AggregationWindow for aggregation) can record which holder committed
+and reject a holder whose lease ran out mid-run.
+
+A lease is only an optimization against redundant work; exactly-once must
+still be enforced by the caller's commit (see aggregation.aggregate_window).
+
+Key properties:
+- One round-trip to acquire (SET NX PX plus INCR in a Lua script), one to
+  release
+- Release is compare-and-delete, so an expired holder can't drop a lease a
+  newer holder took over
+- Without Redis, leases only exclude work within the same process
+"""
+
+import itertools
+import logging
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+LEASE_KEY_PREFIX = "lease:"
+FENCING_KEY = "lease:fencing"
+
+# KEYS[1] = lease key, KEYS[2] = fencing counter
+# ARGV[1] = ttl (ms)
+# Returns the new fencing token, or 0 if the lease is held
+ACQUIRE_LEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local token = redis.call('INCR', KEYS[2])
+redis.call('SET', KEYS[1], token, 'PX', ARGV[1])
+return token
+"""
+
+# KEYS[1] = lease key
+# ARGV[1] = token
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_acquire_lease_script = None
+_release_lease_script = None
+
+
+class LocalLeaseTable:
+    """Per-process leases, used when Redis is unavailable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases = {}
+        self._tokens = itertools.count(1)
+
+    def acquire(self, name: str, ttl_seconds: float, now: float) -> Optional[int]:
+        with self._lock:
+            held = self._leases.get(name)
+            if held is not None and held[1] > now:
+                return None
+            token = next(self._tokens)
+            self._leases[name] = (token, now + ttl_seconds)
+            return token
+
+    def release(self, name: str, token: int) -> None:
+        with self._lock:
+            held = self._leases.get(name)
+            if held is not None and held[0] == token:
+                del self._leases[name]
+
+
+_local_leases = LocalLeaseTable()
+
+
+def acquire_lease(name: str, ttl_seconds: float, now: Optional[float] = None) -> Optional[int]:
+    """
+    Try to take the named lease.
+
+    Args:
+        name: Lease name, e.g. "aggregate:<window start>:<shard>"
+        ttl_seconds: Lease lifetime; must exceed the work's expected runtime
+        now: Current time in seconds, for tests (local leases only)
+
+    Returns:
+        int: Fencing token, or None if another holder has the lease
+    """
+    client = get_redis()
+    if client is not None:
+        global _acquire_lease_script
+        try:
+            if _acquire_lease_script is None:
+                _acquire_lease_script = client.register_script(ACQUIRE_LEASE_SCRIPT)
+            token = int(_acquire_lease_script(
+                keys=[f"{LEASE_KEY_PREFIX}{name}", FENCING_KEY],
+                args=[int(ttl_seconds * 1000)],
+            ))
+            return token or None
+        except redis.RedisError as e:
+            logger.warning(f"Lease {name} falling back to memory: {e}")
+
+    return _local_leases.acquire(name, ttl_seconds, time.time() if now is None else now)
+
+
+def release_lease(name: str, token: int) -> None:
+    """Release the named lease if token still holds it."""
+    client = get_redis()
+    if client is not None:
+        global _release_lease_script
+        try:
+            if _release_lease_script is None:
+                _release_lease_script = client.register_script(RELEASE_LEASE_SCRIPT)
+            _release_lease_script(keys=[f"{LEASE_KEY_PREFIX}{name}"], args=[token])
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Lease {name} falling back to memory: {e}")
+
+    _local_leases.release(name, token)
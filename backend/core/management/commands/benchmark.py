@@ -0,0 +1,129 @@
+import json
+import platform
+import subprocess
+
+from celery import current_app
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from core.benchmarks import BENCHMARKS, LATENCY_DISTRIBUTIONS, SyntheticWorkload
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark ingest, aggregation, policy evaluation and cleanup against "
+        "a throwaway test database and emit JSON results"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            choices=sorted(BENCHMARKS),
+            help="Benchmarks to run (default: all)",
+        )
+        parser.add_argument("--projects", type=int, default=5)
+        parser.add_argument("--endpoints", type=int, default=20)
+        parser.add_argument("--rpm", type=int, default=600, help="Requests per project per minute")
+        parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="lognormal")
+        parser.add_argument("--latency-median", type=float, default=120.0)
+        parser.add_argument("--error-rate", type=float, default=0.02)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--ingest-requests", type=int, default=2000)
+        parser.add_argument("--windows", type=_int_list, default=[1, 5, 60], help="Aggregation window sizes in minutes, e.g. 1,5,60")
+        parser.add_argument("--policy-counts", type=_int_list, default=[1, 10, 100])
+        parser.add_argument("--cleanup-minutes", type=int, default=10)
+        parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+        parser.add_argument("--keepdb", action="store_true", help="Reuse the test database between runs")
+
+    def handle(self, *args, **options):
+        selected = options["only"] or list(BENCHMARKS)
+
+        def workload():
+            # Fresh generator per benchmark so each one sees the same data
+            return SyntheticWorkload(
+                projects=options["projects"],
+                endpoints=options["endpoints"],
+                requests_per_minute=options["rpm"],
+                latency_distribution=options["latency_dist"],
+                latency_median_ms=options["latency_median"],
+                error_rate=options["error_rate"],
+                seed=options["seed"],
+            )
+
+        runners = {
+            "ingest": lambda: BENCHMARKS["ingest"](workload(), options["ingest_requests"]),
+            "aggregation": lambda: BENCHMARKS["aggregation"](workload(), options["windows"]),
+            "policies": lambda: BENCHMARKS["policies"](workload(), options["policy_counts"]),
+            "cleanup": lambda: BENCHMARKS["cleanup"](workload(), options["cleanup_minutes"]),
+        }
+
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options["keepdb"], serialize=False
+        )
+
+        # Keep benchmarks off external services: no quotas, no Redis, no SMTP
+        always_eager = current_app.conf.task_always_eager
+        current_app.conf.task_always_eager = True
+
+        results = {}
+        try:
+            with override_settings(
+                INGEST_DEFAULT_RATE_PER_SECOND=0,
+                INGEST_LOAD_SHED=False,
+                INGEST_LOAD_SHED_BACKLOG_SECONDS=0,
+                REDIS_URL=None,
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            ):
+                for name in selected:
+                    self.stderr.write(f"Running {name} benchmark...")
+                    results[name] = runners[name]()
+        finally:
+            current_app.conf.task_always_eager = always_eager
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options["keepdb"]
+            )
+
+        report = {
+            "meta": {
+                "commit": self._git_commit(),
+                "timestamp": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "parameters": {
+                    key: options[key]
+                    for key in [
+                        "projects", "endpoints", "rpm", "latency_dist",
+                        "latency_median", "error_rate", "seed",
+                    ]
+                },
+            },
+            "results": results,
+        }
+
+        output = json.dumps(report, indent=2, default=str)
+        if options["output"]:
+            try:
+                with open(options["output"], "w") as fh:
+                    fh.write(output + "\n")
+            except OSError as e:
+                raise CommandError(f"Could not write results: {e}")
+            self.stdout.write(self.style.SUCCESS(f"Wrote results to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def _git_commit(self):
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -2,7 +2,8 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
 
-from core.models import RequestMetric
+from core.instrumentation import incr, phase
+from core.models import AggregationWindow, RequestMetric
 
 
 class Command(BaseCommand):
@@ -12,9 +13,15 @@ class Command(BaseCommand):
         retention_days = 7
         cutoff = timezone.now() - timedelta(days=retention_days)
 
-        deleted_count, _ = RequestMetric.objects.filter(
-            timestamp__lt=cutoff
-        ).delete()
+        with phase("delete"):
+            deleted_count, _ = RequestMetric.objects.filter(
+                timestamp__lt=cutoff
+            ).delete()
+        incr("rows_deleted", deleted_count)
+
+        # Windows older than the raw data can't be aggregated again, so
+        # their ledger entries are no longer needed
+        AggregationWindow.objects.filter(window_start__lt=cutoff).delete()
 
         self.stdout.write(
             self.style.SUCCESS(
@@ -0,0 +1,74 @@
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import MetricImportError, import_files, schedule_reaggregation
+from core.models import APIKey, Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-load historical raw metrics from CSV or NDJSON files (optionally "
+        "gzip-compressed) and re-aggregate the affected windows in parallel. "
+        "Raw rows older than the raw retention are removed by the next "
+        "cleanup; their aggregates are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Files to import, or - for stdin")
+        parser.add_argument("--format", choices=["csv", "ndjson"], help="Default: from each file extension")
+        parser.add_argument("--project", help="Project id for rows without project_id / api_key")
+        parser.add_argument("--api-key", help="API key for rows without project_id / api_key")
+        parser.add_argument("--chunk-rows", type=int, default=10000, help="Rows per write")
+        parser.add_argument("--window-minutes", type=int, default=60, help="Rows per re-aggregation task, in minutes of data")
+        parser.add_argument("--strict", action="store_true", help="Abort on the first invalid row instead of skipping it (earlier chunks stay imported)")
+        parser.add_argument("--no-reaggregate", action="store_true", help="Only load raw rows")
+
+    def handle(self, *args, **options):
+        default_project_id = None
+        if options["project"]:
+            try:
+                default_project_id = Project.objects.get(id=uuid.UUID(options["project"])).id
+            except (ValueError, Project.DoesNotExist):
+                raise CommandError(f"Unknown project {options['project']}")
+        elif options["api_key"]:
+            try:
+                default_project_id = APIKey.objects.get(key=options["api_key"], is_active=True).project_id
+            except APIKey.DoesNotExist:
+                raise CommandError("Unknown or inactive API key")
+
+        window = timedelta(minutes=options["window_minutes"])
+
+        def progress(result):
+            self.stdout.write(f"Imported {result.rows_imported} rows...")
+
+        try:
+            result = import_files(
+                options["paths"],
+                file_format=options["format"],
+                default_project_id=default_project_id,
+                chunk_rows=options["chunk_rows"],
+                window=window,
+                strict=options["strict"],
+                progress=progress if options["verbosity"] > 1 else None,
+            )
+        except (MetricImportError, OSError) as e:
+            raise CommandError(str(e))
+
+        for error in result.errors:
+            self.stderr.write(error)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {result.rows_imported} raw metrics, skipped {result.rows_skipped} invalid rows"
+            )
+        )
+
+        if options["no_reaggregate"]:
+            return
+
+        queued = schedule_reaggregation(result, window=window)
+        self.stdout.write(
+            self.style.SUCCESS(f"Queued re-aggregation of {queued} windows")
+        )
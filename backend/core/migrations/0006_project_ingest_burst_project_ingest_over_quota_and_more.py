@@ -0,0 +1,33 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_project_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='ingest_burst',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='ingest_over_quota',
+            field=models.CharField(choices=[('reject', 'Reject with 429'), ('sample', 'Keep a sample')], default='reject', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='ingest_over_quota_sample_rate',
+            field=models.FloatField(default=0.1),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='ingest_rate_per_second',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_project_ingest_burst_project_ingest_over_quota_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestmetric',
+            name='sample_rate',
+            field=models.FloatField(default=1.0),
+        ),
+    ]
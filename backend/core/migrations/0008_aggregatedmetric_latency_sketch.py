@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_requestmetric_sample_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='latency_sketch',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:35
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_alerts_notified(apps, schema_editor):
+    # Alerts created before digests were mailed individually already
+    AlertEvent = apps.get_model("core", "AlertEvent")
+    AlertEvent.objects.filter(notified_at__isnull=True).update(notified_at=F("triggered_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_aggregatedmetric_latency_sketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertevent',
+            name='notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_alerts_notified, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(condition=models.Q(('notified_at__isnull', True)), fields=['triggered_at'], name='alertevent_pending_notify_idx'),
+        ),
+    ]
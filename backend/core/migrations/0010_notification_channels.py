@@ -0,0 +1,46 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_alertevent_notified_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationChannel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('kind', models.CharField(choices=[('email', 'Email'), ('webhook', 'Webhook'), ('slack', 'Slack-compatible webhook')], max_length=10)),
+                ('target', models.CharField(max_length=500)),
+                ('max_concurrency', models.IntegerField(default=4)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.project')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='channels',
+            field=models.ManyToManyField(blank=True, to='core.notificationchannel'),
+        ),
+        migrations.CreateModel(
+            name='NotificationDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10)),
+                ('target', models.CharField(max_length=500)),
+                ('payload', models.JSONField()),
+                ('alert_ids', models.JSONField(default=list)),
+                ('attempts', models.IntegerField()),
+                ('last_error', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('channel', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.notificationchannel')),
+            ],
+        ),
+    ]
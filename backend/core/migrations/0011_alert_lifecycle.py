@@ -0,0 +1,82 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def seed_alert_states(apps, schema_editor):
+    # The latest unresolved alert of each policy becomes its active alert;
+    # older unresolved ones predate the lifecycle and are closed.
+    AlertEvent = apps.get_model("core", "AlertEvent")
+    AlertState = apps.get_model("core", "AlertState")
+
+    latest = {}
+    for event in AlertEvent.objects.filter(resolved=False).order_by("policy_id", "-triggered_at"):
+        latest.setdefault(event.policy_id, event)
+
+    AlertState.objects.bulk_create([
+        AlertState(
+            policy_id=policy_id,
+            status="firing",
+            active_event=event,
+            last_triggered_at=event.triggered_at,
+            last_value=event.value,
+        )
+        for policy_id, event in latest.items()
+    ])
+
+    (
+        AlertEvent.objects
+        .filter(resolved=False)
+        .exclude(id__in=[event.id for event in latest.values()])
+        .update(resolved=True, resolved_at=F("triggered_at"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_notification_channels'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('ok', 'ok'), ('firing', 'firing')], default='ok', max_length=10)),
+                ('current_bucket_start', models.DateTimeField(blank=True, null=True)),
+                ('current_bucket_violated', models.BooleanField(default=False)),
+                ('consecutive_ok_buckets', models.IntegerField(default=0)),
+                ('last_triggered_at', models.DateTimeField(blank=True, null=True)),
+                ('last_value', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='alertevent',
+            name='resolved_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='resolve_after_buckets',
+            field=models.IntegerField(default=3),
+        ),
+        migrations.AddIndex(
+            model_name='alertevent',
+            index=models.Index(condition=models.Q(('resolved', False)), fields=['policy', '-triggered_at'], name='alertevent_active_idx'),
+        ),
+        migrations.AddField(
+            model_name='alertstate',
+            name='active_event',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.alertevent'),
+        ),
+        migrations.AddField(
+            model_name='alertstate',
+            name='policy',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='state', to='core.alertpolicy'),
+        ),
+        migrations.RunPython(seed_alert_states, migrations.RunPython.noop),
+    ]
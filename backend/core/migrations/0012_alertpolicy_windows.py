@@ -0,0 +1,38 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_alert_lifecycle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='condition',
+            field=models.CharField(choices=[('threshold', 'Threshold'), ('burn_rate', 'SLO burn rate')], default='threshold', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='for_duration_minutes',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='short_window_minutes',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='slo_target',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='window_minutes',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_alertpolicy_windows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='seasonal',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='alertpolicy',
+            name='comparison',
+            field=models.CharField(choices=[('>', '>'), ('<', '<'), ('anomaly', 'anomaly')], max_length=10),
+        ),
+        migrations.CreateModel(
+            name='MetricBaseline',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=255)),
+                ('stats', models.JSONField(default=dict)),
+                ('last_bucket_start', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.project')),
+            ],
+            options={
+                'unique_together': {('project', 'endpoint')},
+            },
+        ),
+    ]
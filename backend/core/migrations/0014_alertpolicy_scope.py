@@ -0,0 +1,34 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_metric_baselines'),
+    ]
+
+    operations = [
+        # Existing policies keep evaluating every bucket size; new ones default to 1m
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='bucket_size',
+            field=models.CharField(blank=True, choices=[('', 'Any'), ('1m', '1 minute'), ('5m', '5 minutes'), ('1h', '1 hour')], default='', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='alertpolicy',
+            name='bucket_size',
+            field=models.CharField(blank=True, choices=[('', 'Any'), ('1m', '1 minute'), ('5m', '5 minutes'), ('1h', '1 hour')], default='1m', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='endpoint_match',
+            field=models.CharField(choices=[('exact', 'Exact'), ('prefix', 'Prefix'), ('glob', 'Glob')], default='exact', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='alertpolicy',
+            name='endpoint_pattern',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def scope_unscoped_policies(apps, schema_editor):
+    # Unscoped policies now only see the project rollup series; keep existing
+    # ones evaluating every endpoint, as they did before
+    AlertPolicy = apps.get_model("core", "AlertPolicy")
+    AlertPolicy.objects.filter(endpoint_pattern="").update(
+        endpoint_pattern="*",
+        endpoint_match="glob",
+    )
+
+
+def unscope_policies(apps, schema_editor):
+    AlertPolicy = apps.get_model("core", "AlertPolicy")
+    AlertPolicy.objects.filter(endpoint_pattern="*", endpoint_match="glob").update(
+        endpoint_pattern="",
+        endpoint_match="exact",
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_alertpolicy_scope'),
+    ]
+
+    operations = [
+        migrations.RunPython(scope_unscoped_policies, unscope_policies),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_project_rollup_policies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestmetric',
+            name='event_id',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
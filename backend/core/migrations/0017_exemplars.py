@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_requestmetric_event_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='exemplars',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertevent',
+            name='aggregated_metric',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.aggregatedmetric'),
+        ),
+        migrations.AddField(
+            model_name='alertevent',
+            name='exemplars',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.11 on 2026-10-19 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_exemplars'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='method_breakdown',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='status_2xx_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='status_3xx_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='aggregatedmetric',
+            name='status_4xx_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='alertpolicy',
+            name='metric',
+            field=models.CharField(choices=[('latency_p95', 'Latency p95'), ('error_rate', 'Error rate'), ('client_error_rate', 'Client error (4xx) rate'), ('success_rate', 'Success (2xx/3xx) rate'), ('throughput', 'Throughput')], max_length=20),
+        ),
+    ]
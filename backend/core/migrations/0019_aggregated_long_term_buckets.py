@@ -0,0 +1,22 @@
+# Generated by Django 5.2.11 on 2026-10-19 05:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_status_and_method_breakdown'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='aggregatedmetric',
+            name='bucket_size',
+            field=models.CharField(choices=[('1m', '1 minute'), ('5m', '5 minutes'), ('1h', '1 hour'), ('1d', '1 day'), ('1w', '1 week')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='aggregatedmetric',
+            index=models.Index(fields=['bucket_size', 'bucket_start'], name='core_aggreg_bucket__945f2e_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.11 on 2026-10-19 05:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_aggregated_long_term_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregationWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField()),
+                ('window_end', models.DateTimeField()),
+                ('shard', models.IntegerField(default=0)),
+                ('shards', models.IntegerField(default=1)),
+                ('fencing_token', models.BigIntegerField()),
+                ('metric_count', models.IntegerField(default=0)),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('window_start', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-19 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_aggregation_window_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestmetric',
+            name='import_id',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,68 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import Now
+
+# core.aggregation.ROLLUP_ENDPOINT
+ROLLUP_ENDPOINT = "*"
+
+
+def assign_state_endpoints(apps, schema_editor):
+    # States were per policy. Attribute each one to the endpoint of the
+    # bucket that fired its active alert, or to the only series the policy
+    # can match; otherwise close its alert and drop it, the next violation
+    # starts a fresh lifecycle.
+    AlertEvent = apps.get_model("core", "AlertEvent")
+    AlertState = apps.get_model("core", "AlertState")
+
+    for state in AlertState.objects.select_related("policy", "active_event__aggregated_metric"):
+        policy = state.policy
+        endpoint = None
+        if state.active_event_id and state.active_event.aggregated_metric_id:
+            endpoint = state.active_event.aggregated_metric.endpoint
+        elif not policy.endpoint_pattern:
+            endpoint = ROLLUP_ENDPOINT
+        elif policy.endpoint_match == "exact":
+            endpoint = policy.endpoint_pattern
+
+        if endpoint is None:
+            if state.active_event_id:
+                AlertEvent.objects.filter(id=state.active_event_id).update(resolved=True, resolved_at=Now())
+            state.delete()
+        else:
+            state.endpoint = endpoint
+            state.save(update_fields=["endpoint"])
+
+
+def keep_one_state_per_policy(apps, schema_editor):
+    AlertState = apps.get_model("core", "AlertState")
+    seen = set()
+    for state in AlertState.objects.order_by("policy_id", "-updated_at"):
+        if state.policy_id in seen:
+            state.delete()
+        seen.add(state.policy_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_requestmetric_import_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertstate',
+            name='endpoint',
+            field=models.CharField(default='', max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='alertstate',
+            name='policy',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='states', to='core.alertpolicy'),
+        ),
+        migrations.RunPython(assign_state_endpoints, keep_one_state_per_policy),
+        migrations.AlterUniqueTogether(
+            name='alertstate',
+            unique_together={('policy', 'endpoint')},
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_alertstate_endpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertevent',
+            name='notify_claim',
+            field=models.UUIDField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='alertevent',
+            name='notify_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
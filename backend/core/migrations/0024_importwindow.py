@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_alertevent_notify_claim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('import_id', models.UUIDField()),
+                ('window_start', models.DateTimeField()),
+                ('window_end', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'unique_together': {('import_id', 'window_start')},
+            },
+        ),
+    ]
@@ -13,6 +13,19 @@ class Project(models.Model):
     email = models.EmailField(null=True,blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Ingest quota per API key; null falls back to the INGEST_DEFAULT_* settings
+    ingest_rate_per_second = models.FloatField(null=True, blank=True)
+    ingest_burst = models.IntegerField(null=True, blank=True)
+    ingest_over_quota = models.CharField(
+        max_length=10,
+        choices=[
+            ("reject", "Reject with 429"),
+            ("sample", "Keep a sample"),
+        ],
+        default="reject",
+    )
+    ingest_over_quota_sample_rate = models.FloatField(default=0.1)
+
     def __str__(self):
         return self.name
 
@@ -33,6 +46,14 @@ class RequestMetric(models.Model):
     status_code = models.IntegerField()
     latency_ms = models.IntegerField()
     timestamp = models.DateTimeField()
+    # Fraction of traffic this row represents (1.0 = unsampled)
+    sample_rate = models.FloatField(default=1.0)
+    # Optional client-generated id, identical across retries (see dedup.py).
+    # Deliberately not unique: duplicates are filtered at ingest.
+    event_id = models.CharField(max_length=64, blank=True, default="")
+    # Set on rows loaded by import_metrics, so re-aggregation picks up
+    # exactly that import's rows
+    import_id = models.UUIDField(null=True, blank=True)
 
     class Meta:
         indexes = [
@@ -55,22 +76,127 @@ class AggregatedMetric(models.Model):
             ("1m", "1 minute"),
             ("5m", "5 minutes"),
             ("1h", "1 hour"),
+            ("1d", "1 day"),
+            ("1w", "1 week"),
         ],
     )
 
     request_count = models.IntegerField()
     error_count = models.IntegerField()
     p95_latency_ms = models.IntegerField()
+    # Requests per status class; 5xx is error_count. Weighted like
+    # request_count.
+    status_2xx_count = models.IntegerField(default=0)
+    status_3xx_count = models.IntegerField(default=0)
+    status_4xx_count = models.IntegerField(default=0)
+    # Per-method sub-series: {"GET": {"request_count", "error_count",
+    # "p95_latency_ms"}, ...}
+    method_breakdown = models.JSONField(null=True, blank=True)
+    # Serialized LatencySketch for rows that must be merged after the fact
+    # (e.g. pre-aggregated agent submissions); null for raw-only buckets
+    latency_sketch = models.JSONField(null=True, blank=True)
+    # Slowest and sampled 5xx requests of the bucket (core/exemplars.py);
+    # null for buckets built only from pre-aggregated data
+    exemplars = models.JSONField(null=True, blank=True)
 
     class Meta:
         unique_together = ("project", "endpoint", "bucket_start", "bucket_size")
         indexes = [
             models.Index(fields=["project", "bucket_start"]),
+            # Compaction and retention scan one resolution at a time
+            models.Index(fields=["bucket_size", "bucket_start"]),
         ]
 
     def __str__(self):
         return f"{self.project.name} {self.endpoint} {self.bucket_size}"
 
+
+class AggregationWindow(models.Model):
+    """
+    Ledger of raw-metric windows already aggregated, one row per (window,
+    shard). Written in the same transaction as the window's AggregatedMetric
+    rows, so a window's counts are committed at most once.
+    """
+
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    # Project shard of the window (see aggregation.shard_project_ids)
+    shard = models.IntegerField(default=0)
+    shards = models.IntegerField(default=1)
+    # Lease token of the run that committed the window (core/leases.py)
+    fencing_token = models.BigIntegerField()
+    metric_count = models.IntegerField(default=0)
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("window_start", "shard")
+
+    def __str__(self):
+        return f"{self.window_start} shard {self.shard}/{self.shards}"
+
+
+class ImportWindow(models.Model):
+    """
+    Ledger of bulk-import windows already re-aggregated, one row per
+    (import_id, window). Written in the same transaction as the window's
+    AggregatedMetric updates, so an import's rows are added at most once.
+    """
+
+    # RequestMetric.import_id of the import
+    import_id = models.UUIDField()
+    window_start = models.DateTimeField()
+    window_end = models.DateTimeField()
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("import_id", "window_start")
+
+    def __str__(self):
+        return f"import {self.import_id} {self.window_start}"
+
+class NotificationChannel(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+
+    kind = models.CharField(
+        max_length=10,
+        choices=[
+            ("email", "Email"),
+            ("webhook", "Webhook"),
+            ("slack", "Slack-compatible webhook"),
+        ],
+    )
+    # Email address for email channels, URL for webhook/slack channels
+    target = models.CharField(max_length=500)
+    # Concurrent in-flight HTTP requests to this channel's receiver
+    max_concurrency = models.IntegerField(default=4)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.project.name} - {self.name} ({self.kind})"
+
+class MetricBaseline(models.Model):
+    """
+    Streaming statistics of an endpoint's metrics, maintained by
+    core.baselines for anomaly policies. stats maps metric name to
+    {"n", "m", "v"} (EWMA count/mean/variance), "s" (hour-of-week slots),
+    "z"/"sz" (scores of the last bucket) and "p"/"ps" (stats before the last
+    bucket, to re-fold it when it is updated).
+    """
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    endpoint = models.CharField(max_length=255)
+    stats = models.JSONField(default=dict)
+    last_bucket_start = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("project", "endpoint")
+
+    def __str__(self):
+        return f"{self.project.name} {self.endpoint} baseline"
+
 class AlertPolicy(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     name = models.CharField(max_length=100)
@@ -80,18 +206,26 @@ class AlertPolicy(models.Model):
         choices=[
             ("latency_p95", "Latency p95"),
             ("error_rate", "Error rate"),
+            ("client_error_rate", "Client error (4xx) rate"),
+            ("success_rate", "Success (2xx/3xx) rate"),
             ("throughput", "Throughput"),
         ],
     )
 
     threshold = models.FloatField()
+    # "anomaly": threshold is k, fires when the metric deviates from its
+    # streaming baseline by more than k standard deviations
     comparison = models.CharField(
-        max_length=5,
+        max_length=10,
         choices=[
             (">", ">"),
             ("<", "<"),
+            ("anomaly", "anomaly"),
         ],
     )
+    # Anomaly policies: compare with the same hour of the week instead of
+    # the recent EWMA
+    seasonal = models.BooleanField(default=False)
 
     severity = models.CharField(
         max_length=10,
@@ -102,8 +236,57 @@ class AlertPolicy(models.Model):
         ],
     )
 
+    # Which metrics the policy applies to. An empty pattern makes the policy
+    # project-wide (evaluated on the "*" rollup series only); glob patterns
+    # use fnmatch syntax ("/api/v1/users/*").
+    # An empty bucket_size matches every bucket size.
+    endpoint_pattern = models.CharField(max_length=255, blank=True, default="")
+    endpoint_match = models.CharField(
+        max_length=10,
+        choices=[
+            ("exact", "Exact"),
+            ("prefix", "Prefix"),
+            ("glob", "Glob"),
+        ],
+        default="exact",
+    )
+    bucket_size = models.CharField(
+        max_length=10,
+        blank=True,
+        choices=[
+            ("", "Any"),
+            ("1m", "1 minute"),
+            ("5m", "5 minutes"),
+            ("1h", "1 hour"),
+        ],
+        default="1m",
+    )
+
+    # "threshold": metric compared to threshold, optionally sustained over a
+    # window ("for_duration_minutes of the last window_minutes")
+    # "burn_rate": error budget burn rate (error_rate / (1 - slo_target)) must
+    # exceed threshold over both window_minutes and short_window_minutes
+    condition = models.CharField(
+        max_length=10,
+        choices=[
+            ("threshold", "Threshold"),
+            ("burn_rate", "SLO burn rate"),
+        ],
+        default="threshold",
+    )
+    window_minutes = models.IntegerField(default=1)
+    for_duration_minutes = models.IntegerField(default=1)
+    short_window_minutes = models.IntegerField(null=True, blank=True)
+    slo_target = models.FloatField(null=True, blank=True)
+
     cooldown_minutes = models.IntegerField(default=15)
+    # A firing alert resolves after this many consecutive buckets within
+    # threshold, of bucket_size (1m when bucket_size is empty)
+    resolve_after_buckets = models.IntegerField(default=3)
     is_active = models.BooleanField(default=True)
+    # Where alerts go; empty = all active channels of the project, or the
+    # project email if it has none
+    channels = models.ManyToManyField(NotificationChannel, blank=True)
 
     def __str__(self):
         return f"{self.project.name} - {self.name}"
@@ -113,6 +296,87 @@ class AlertEvent(models.Model):
     triggered_at = models.DateTimeField()
     value = models.FloatField()
     resolved = models.BooleanField(default=False)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    # Set once the alert went out in a notification digest; null = pending
+    notified_at = models.DateTimeField(null=True, blank=True)
+    # Dispatch currently sending the alert's email digests, and when it
+    # claimed them; other dispatchers skip the alert until the claim expires
+    notify_claim = models.UUIDField(null=True, blank=True)
+    notify_claimed_at = models.DateTimeField(null=True, blank=True)
+    # Bucket that fired the alert, and a copy of its exemplars that outlives
+    # raw and aggregated retention
+    aggregated_metric = models.ForeignKey(
+        AggregatedMetric, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    exemplars = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["triggered_at"],
+                condition=models.Q(notified_at__isnull=True),
+                name="alertevent_pending_notify_idx",
+            ),
+            models.Index(
+                fields=["policy", "-triggered_at"],
+                condition=models.Q(resolved=False),
+                name="alertevent_active_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.policy.name} @ {self.triggered_at}"
+
+
+class AlertState(models.Model):
+    """
+    Current lifecycle state of a policy on one endpoint series, updated
+    incrementally by the evaluator so it never has to scan AlertEvent
+    history. A policy matching several endpoints has one state per endpoint.
+    """
+
+    policy = models.ForeignKey(AlertPolicy, on_delete=models.CASCADE, related_name="states")
+    endpoint = models.CharField(max_length=255)
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            ("ok", "ok"),
+            ("firing", "firing"),
+        ],
+        default="ok",
+    )
+    active_event = models.ForeignKey(
+        AlertEvent, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+
+    # Bucket currently being evaluated (of the policy's bucket size, or 1m),
+    # and whether anything in it violated
+    current_bucket_start = models.DateTimeField(null=True, blank=True)
+    current_bucket_violated = models.BooleanField(default=False)
+    consecutive_ok_buckets = models.IntegerField(default=0)
+
+    last_triggered_at = models.DateTimeField(null=True, blank=True)
+    last_value = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("policy", "endpoint")
+
+    def __str__(self):
+        return f"{self.policy.name} {self.endpoint}: {self.status}"
+
+
+class NotificationDeadLetter(models.Model):
+    """A notification that could not be delivered after all retries."""
+
+    channel = models.ForeignKey(NotificationChannel, on_delete=models.SET_NULL, null=True)
+    kind = models.CharField(max_length=10)
+    target = models.CharField(max_length=500)
+    payload = models.JSONField()
+    alert_ids = models.JSONField(default=list)
+    attempts = models.IntegerField()
+    last_error = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.kind} -> {self.target} @ {self.created_at}"
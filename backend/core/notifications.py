@@ -0,0 +1,451 @@
+"""
+Alert notification dispatch.
+
+Alerts are not sent one by one. evaluate_policies only leaves new
+AlertEvents pending (notified_at is null) and schedules a dispatch. The
+dispatch runs once per NOTIFICATION_BATCH_WINDOW_SECONDS, however many alerts
+fired in the meantime. It then sends one digest per notification channel:
+email digests over a single mail connection, and webhook / Slack payloads
+through the async pool in delivery.py.
+
+Key properties:
+- Coalesced: during an incident, recipients get one digest per window
+  instead of one email per violation
+- Deduplicated: repeated alerts for the same policy collapse into one line
+  with a count and the latest value
+- Rate limited: each channel has a token bucket
+  (NOTIFICATION_RATE_PER_MINUTE / NOTIFICATION_BURST). Over-limit digests
+  stay pending and roll into the next window; every channel is checked
+  before any tokens are taken, so deferred digests cost nothing.
+- Sent once: the transaction that selects pending alerts (with row locks)
+  also claims the alerts of its email digests, so concurrent dispatchers
+  skip them while they are being sent. Each digest marks its alerts
+  notified once it went out; a failed digest releases its claim, so only
+  its alerts are retried. Claims of a dispatcher that died expire after
+  NOTIFICATION_CLAIM_SECONDS.
+- Dead-lettered: webhook deliveries that still fail after their retries are
+  stored as NotificationDeadLetter rows
+
+The mail backend is whatever EMAIL_BACKEND points at, so the locmem or
+console backends can stand in for SMTP locally.
+"""
+
+import logging
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+import redis
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .delivery import Delivery
+from .models import AlertEvent, NotificationChannel, NotificationDeadLetter
+from .ratelimit import take_tokens
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_SCHEDULED_KEY = "notifications:dispatch_scheduled"
+
+# Fallback when Redis isn't configured: monotonic time the pending dispatch runs
+_local_dispatch = {"scheduled_until": 0.0}
+
+
+def _batch_window() -> int:
+    return int(getattr(settings, "NOTIFICATION_BATCH_WINDOW_SECONDS", 60))
+
+
+def schedule_notification_dispatch() -> bool:
+    """
+    Queue a dispatch at the end of the current batch window, unless one is
+    already queued.
+
+    Returns:
+        bool: True if a dispatch was queued by this call
+    """
+    window = _batch_window()
+
+    client = get_redis()
+    acquired = None
+    if client is not None:
+        try:
+            acquired = bool(client.set(DISPATCH_SCHEDULED_KEY, 1, nx=True, ex=max(window, 1)))
+        except redis.RedisError as e:
+            logger.warning(f"Could not coordinate notification dispatch: {e}")
+
+    if acquired is None:
+        now = time.monotonic()
+        acquired = now >= _local_dispatch["scheduled_until"]
+        if acquired:
+            _local_dispatch["scheduled_until"] = now + window
+
+    if acquired:
+        # Import here to avoid circular dependency
+        from .tasks import dispatch_alert_notifications_task
+
+        dispatch_alert_notifications_task.apply_async(countdown=window)
+
+    return acquired
+
+
+def _collapse_by_policy(alerts):
+    """Group alerts by policy: (policy, count, first, latest) per policy."""
+    by_policy = defaultdict(list)
+    for alert in alerts:
+        by_policy[alert.policy_id].append(alert)
+
+    entries = []
+    for policy_alerts in by_policy.values():
+        first = policy_alerts[0]
+        latest = policy_alerts[-1]
+        entries.append((latest.policy, len(policy_alerts), first, latest))
+
+    severity_order = {"critical": 0, "warn": 1, "info": 2}
+    entries.sort(key=lambda entry: (severity_order.get(entry[0].severity, 3), entry[0].name))
+    return entries
+
+
+def _digest_subject(project, entries) -> str:
+    if len(entries) == 1:
+        policy, count, _, _ = entries[0]
+        subject = f"[ALERT] {policy.metric} violated"
+        if count > 1:
+            subject += f" ({count}x)"
+        return subject
+    return f"[ALERT] {len(entries)} policies violated in {project.name}"
+
+
+def _digest_text(project, entries) -> str:
+    lines = [
+        "🚨 Alerts Triggered",
+        "",
+        f"Project: {project.name}",
+        "",
+    ]
+    for policy, count, first, latest in entries:
+        lines.extend([
+            f"[{policy.severity}] {policy.name}",
+            f"  Metric: {policy.metric} {policy.comparison} {policy.threshold}",
+            f"  Actual Value: {latest.value}",
+            f"  Triggered At: {latest.triggered_at}",
+        ])
+        if count > 1:
+            lines.append(f"  Repeated: {count} times since {first.triggered_at}")
+        lines.append("")
+    lines.append("Please investigate.")
+    return "\n".join(lines) + "\n"
+
+
+def build_digest(project, recipient, alerts) -> EmailMessage:
+    """
+    Build one digest email for a project's pending alerts.
+
+    Args:
+        project: Project the alerts belong to
+        recipient: Email address
+        alerts: AlertEvents ordered by triggered_at, policy loaded
+
+    Returns:
+        EmailMessage: Not yet sent
+    """
+    entries = _collapse_by_policy(alerts)
+
+    return EmailMessage(
+        subject=_digest_subject(project, entries),
+        body=_digest_text(project, entries),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[recipient],
+    )
+
+
+def build_webhook_payload(project, channel, alerts) -> dict:
+    """
+    Build the JSON body for a webhook or Slack channel.
+
+    Slack-compatible channels get {"text": ...}; generic webhooks get the
+    structured digest.
+    """
+    entries = _collapse_by_policy(alerts)
+
+    if channel.kind == "slack":
+        return {
+            "text": f"*{_digest_subject(project, entries)}*\n{_digest_text(project, entries)}"
+        }
+
+    return {
+        "project": {"id": str(project.id), "name": project.name},
+        "alerts": [
+            {
+                "policy_id": policy.id,
+                "policy": policy.name,
+                "metric": policy.metric,
+                "comparison": policy.comparison,
+                "threshold": policy.threshold,
+                "severity": policy.severity,
+                "value": latest.value,
+                "triggered_at": latest.triggered_at.isoformat(),
+                "first_triggered_at": first.triggered_at.isoformat(),
+                "count": count,
+                "exemplars": latest.exemplars,
+            }
+            for policy, count, first, latest in entries
+        ],
+    }
+
+
+def _rate_allowed(key: str, peek: bool = False) -> bool:
+    per_minute = getattr(settings, "NOTIFICATION_RATE_PER_MINUTE", 0)
+    if not per_minute:
+        return True
+
+    burst = getattr(settings, "NOTIFICATION_BURST", 1)
+    allowed, _ = take_tokens(
+        f"ratelimit:notify:{key}", per_minute / 60, max(int(burst), 1), peek=peek
+    )
+    return allowed
+
+
+def _channel_key(channel):
+    if channel.pk is None:
+        return (channel.kind, channel.target.lower())
+    return ("channel", channel.pk)
+
+
+def resolve_channels(alert, project_channels):
+    """
+    Channels an alert is sent to: the policy's own channels, else every
+    active channel of the project, else the project email.
+
+    Args:
+        alert: AlertEvent with policy, policy.project and policy.channels loaded
+        project_channels: project id -> active NotificationChannels
+
+    Returns:
+        list[NotificationChannel]: May contain an unsaved email channel
+    """
+    policy_channels = [c for c in alert.policy.channels.all() if c.is_active]
+    if policy_channels:
+        return policy_channels
+
+    project = alert.policy.project
+    if project_channels.get(project.id):
+        return project_channels[project.id]
+
+    if project.email:
+        return [NotificationChannel(project=project, name="email", kind="email", target=project.email)]
+    return []
+
+
+def dispatch_pending_notifications(now=None) -> dict:
+    """
+    Send digests for every pending AlertEvent to its channels.
+
+    Pending alerts are selected, grouped and claimed in one transaction;
+    the alerts of email digests are claimed with a token so other
+    dispatchers skip them once the transaction commits. Email digests are
+    then sent one at a time over one connection, each marking its alerts
+    notified after it went out, so a failing digest only leaves its own
+    alerts pending and a retry never resends the digests that went out. An
+    alert on several channels is marked with the last of its digests.
+    Webhook and Slack payloads are handed to deliver_notifications_task
+    after commit, so slow receivers never hold the dispatch task.
+
+    Returns:
+        dict: digests sent, webhook deliveries queued, alerts notified,
+        alerts deferred by the rate limit and alerts skipped for lack of a
+        channel
+
+    Raises:
+        Exception: The first email send failure, after the remaining
+            digests were attempted
+    """
+    now = now or timezone.now()
+    limit = getattr(settings, "NOTIFICATION_MAX_ALERTS_PER_DISPATCH", 1000)
+    claim_expired_at = now - timedelta(seconds=getattr(settings, "NOTIFICATION_CLAIM_SECONDS", 300))
+    claim = uuid.uuid4()
+    stats = {"digests": 0, "deliveries": 0, "alerts": 0, "deferred": 0, "skipped": 0}
+    deliveries = []
+    emails = []
+
+    with transaction.atomic():
+        # 1. Read pending alerts. Alerts another dispatcher is planning are
+        # locked and skipped; alerts it is sending are claimed by it.
+        pending = list(
+            AlertEvent.objects
+            .filter(notified_at__isnull=True)
+            .filter(Q(notify_claim__isnull=True) | Q(notify_claimed_at__lt=claim_expired_at))
+            .select_related("policy", "policy__project")
+            .prefetch_related("policy__channels")
+            .select_for_update(skip_locked=True, of=("self",))
+            .order_by("triggered_at")[:limit]
+        )
+        if not pending:
+            return stats
+
+        project_channels = defaultdict(list)
+        for channel in NotificationChannel.objects.filter(
+            project_id__in={alert.policy.project_id for alert in pending},
+            is_active=True,
+        ):
+            project_channels[channel.project_id].append(channel)
+
+        # 2. Group alerts per channel
+        groups = defaultdict(list)
+        channels = {}
+        skipped_ids = []
+        for alert in pending:
+            alert_channels = resolve_channels(alert, project_channels)
+            if not alert_channels:
+                skipped_ids.append(alert.id)
+                continue
+            for channel in alert_channels:
+                key = _channel_key(channel)
+                channels[key] = channel
+                groups[key].append(alert)
+
+        if skipped_ids:
+            logger.warning(
+                f"Skipping {len(skipped_ids)} alert notifications: "
+                f"no channel or email configured"
+            )
+            stats["skipped"] = len(skipped_ids)
+
+        # 3. An alert over any of its channels' rate limits waits for the next
+        # window on all of them, so no channel sees it twice. All channels
+        # are checked before tokens are taken, so a channel whose digest is
+        # emptied by another channel's limit isn't charged for it.
+        deferred_ids = set()
+        for key, alerts in groups.items():
+            if not _rate_allowed(f"{key[0]}:{key[1]}", peek=True):
+                deferred_ids.update(alert.id for alert in alerts)
+        for key, alerts in groups.items():
+            if any(alert.id not in deferred_ids for alert in alerts):
+                if not _rate_allowed(f"{key[0]}:{key[1]}"):
+                    # Another dispatcher took the last tokens since the check
+                    deferred_ids.update(alert.id for alert in alerts)
+
+        # 4. Build email digests and webhook payloads
+        for key, alerts in groups.items():
+            alerts = [alert for alert in alerts if alert.id not in deferred_ids]
+            if not alerts:
+                continue
+
+            channel = channels[key]
+            project = alerts[0].policy.project
+
+            if channel.kind == "email":
+                emails.append((
+                    build_digest(project, channel.target, alerts),
+                    [alert.id for alert in alerts],
+                ))
+            else:
+                deliveries.append(Delivery(
+                    channel_id=channel.pk,
+                    kind=channel.kind,
+                    url=channel.target,
+                    payload=build_webhook_payload(project, channel, alerts),
+                    alert_ids=[alert.id for alert in alerts],
+                    max_concurrency=channel.max_concurrency,
+                ))
+
+        handled_ids = [alert.id for alert in pending if alert.id not in deferred_ids]
+        stats["deferred"] = len(deferred_ids)
+        stats["deliveries"] = len(deliveries)
+
+        # 5. Queue webhooks, mark the alerts that have no email digest and
+        # claim the others until their digests are sent
+        remaining_digests = Counter(
+            alert_id for _, alert_ids in emails for alert_id in alert_ids
+        )
+        done_ids = [alert_id for alert_id in handled_ids if not remaining_digests[alert_id]]
+        AlertEvent.objects.filter(id__in=done_ids).update(
+            notified_at=now, notify_claim=None, notify_claimed_at=None
+        )
+        AlertEvent.objects.filter(id__in=list(remaining_digests)).update(
+            notify_claim=claim, notify_claimed_at=now
+        )
+        stats["alerts"] = len(done_ids) - len(skipped_ids)
+
+        if deliveries:
+            # Import here to avoid circular dependency
+            from .tasks import deliver_notifications_task
+
+            payload = [delivery.as_dict() for delivery in deliveries]
+            transaction.on_commit(lambda: deliver_notifications_task.delay(payload))
+
+    # 6. Send email digests one by one; each marks the alerts whose last
+    # digest it is once it went out. Whatever is still claimed afterwards
+    # (failed digests, or an error before their turn) is released.
+    error = None
+    failed_ids = set()
+    if emails:
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            try:
+                for message, alert_ids in emails:
+                    for alert_id in alert_ids:
+                        remaining_digests[alert_id] -= 1
+                    finished_ids = [
+                        alert_id for alert_id in alert_ids
+                        if not remaining_digests[alert_id] and alert_id not in failed_ids
+                    ]
+                    try:
+                        stats["digests"] += connection.send_messages([message]) or 0
+                    except Exception as e:
+                        logger.error(f"Could not send alert digest to {', '.join(message.to)}: {e}")
+                        failed_ids.update(alert_ids)
+                        error = error or e
+                        continue
+                    stats["alerts"] += AlertEvent.objects.filter(
+                        id__in=finished_ids, notify_claim=claim
+                    ).update(notified_at=now, notify_claim=None, notify_claimed_at=None)
+            finally:
+                connection.close()
+        finally:
+            AlertEvent.objects.filter(notify_claim=claim, notified_at__isnull=True).update(
+                notify_claim=None, notify_claimed_at=None
+            )
+
+    if stats["deferred"] or len(pending) >= limit:
+        schedule_notification_dispatch()
+
+    if error is not None:
+        # The task retries; digests that went out are already marked
+        raise error
+
+    return stats
+
+
+def record_dead_letters(results) -> int:
+    """
+    Store failed deliveries as NotificationDeadLetter rows.
+
+    Returns:
+        int: Number of dead letters written
+    """
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        logger.error(
+            f"Giving up on {result.delivery.kind} notification to "
+            f"{result.delivery.url} after {result.attempts} attempts: {result.error}"
+        )
+
+    NotificationDeadLetter.objects.bulk_create([
+        NotificationDeadLetter(
+            channel_id=result.delivery.channel_id,
+            kind=result.delivery.kind,
+            target=result.delivery.url,
+            payload=result.delivery.payload,
+            alert_ids=result.delivery.alert_ids,
+            attempts=result.attempts,
+            last_error=result.error,
+        )
+        for result in failed
+    ])
+    return len(failed)
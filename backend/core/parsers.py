@@ -0,0 +1,44 @@
+"""
+Request parsers for the ingest endpoints.
+
+Clients (see client/ at the repo root) send batches gzip-compressed with
+Content-Encoding: gzip; metric batches are repetitive JSON and typically
+shrink 10-20x.
+
+Key properties:
+- Uncompressed requests parse exactly as with DRF's JSONParser
+- The decompressed size is capped (INGEST_MAX_DECOMPRESSED_BYTES), so a
+  small compressed body can't expand into an unbounded allocation
+"""
+
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+
+class CompressedJSONParser(JSONParser):
+    """JSONParser that also accepts gzip-encoded bodies."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get("request")
+        encoding = ""
+        if request is not None:
+            encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+
+        if encoding == "gzip":
+            limit = int(getattr(settings, "INGEST_MAX_DECOMPRESSED_BYTES", 10 * 1024 * 1024))
+            try:
+                body = gzip.GzipFile(fileobj=stream).read(limit + 1)
+            except (OSError, EOFError, zlib.error) as e:
+                raise ParseError(f"Invalid gzip body: {e}")
+            if len(body) > limit:
+                raise ParseError(f"Decompressed body exceeds {limit} bytes")
+            stream = io.BytesIO(body)
+        elif encoding not in ("", "identity"):
+            raise ParseError(f"Unsupported Content-Encoding: {encoding}")
+
+        return super().parse(stream, media_type, parser_context)
@@ -3,19 +3,26 @@ Policy evaluation logic for aggregated metrics.
 
 This module provides deterministic, idempotent evaluation of alert policies
 against aggregated metrics. It ensures alerts are only created when policies
-are violated and cooldown periods are respected.
+are violated and cooldown periods are respected, and resolves them once the
+metric stays within threshold.
 
 Key properties:
 - Deterministic: Same inputs always produce same output
 - Idempotent: Multiple evaluations of the same metric don't create duplicate alerts
-- Side-effect free: Only creates AlertEvent records
+- Incremental: Each policy's lifecycle on an endpoint series lives in one
+  AlertState row, so evaluation never scans AlertEvent history, and the
+  endpoints a glob or prefix policy matches don't share a lifecycle
+- Side-effect free: Only creates/resolves AlertEvent records and updates AlertState
 """
 
 from django.utils import timezone
 from django.db import transaction
 from datetime import timedelta
 from typing import Union, Optional
-from .models import AlertPolicy, AlertEvent, AggregatedMetric
+from .baselines import get_anomaly_score
+from .models import AlertPolicy, AlertEvent, AlertState, AggregatedMetric, MetricBaseline
+from .policy_index import get_policy_index
+from .windows import record_value
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,7 +33,8 @@ def resolve_metric_value(policy_metric: str, aggregated_metric: AggregatedMetric
     Resolve the numeric value for a given policy metric type.
 
     Args:
-        policy_metric: One of "latency_p95", "error_rate", "throughput"
+        policy_metric: One of "latency_p95", "error_rate", "client_error_rate",
+            "success_rate", "throughput"
         aggregated_metric: AggregatedMetric instance to extract value from
 
     Returns:
@@ -54,6 +62,21 @@ def resolve_metric_value(policy_metric: str, aggregated_metric: AggregatedMetric
             return 0.0
         return aggregated_metric.error_count / aggregated_metric.request_count
 
+    if policy_metric == "client_error_rate":
+        # 4xx responses as a fraction of requests, from the status class counters
+        if aggregated_metric.request_count == 0:
+            return 0.0
+        return aggregated_metric.status_4xx_count / aggregated_metric.request_count
+
+    if policy_metric == "success_rate":
+        # 2xx and 3xx responses as a fraction of requests; an idle bucket
+        # counts as fully successful so "success_rate < x" doesn't fire on it
+        if aggregated_metric.request_count == 0:
+            return 1.0
+        return (
+            aggregated_metric.status_2xx_count + aggregated_metric.status_3xx_count
+        ) / aggregated_metric.request_count
+
     if policy_metric == "throughput":
         # Throughput as request count (requests per bucket)
         return float(aggregated_metric.request_count)
@@ -61,15 +84,18 @@ def resolve_metric_value(policy_metric: str, aggregated_metric: AggregatedMetric
     raise ValueError(f"Unknown policy metric type: {policy_metric}")
 
 
-def is_in_cooldown(policy: AlertPolicy) -> bool:
+def is_in_cooldown(policy: AlertPolicy, state: Optional[AlertState] = None) -> bool:
     """
     Check if a policy is currently in cooldown (preventing duplicate alerts).
 
-    Cooldown is determined by the most recent alert for this policy.
-    If an alert was triggered within the last cooldown_minutes, return True.
+    Cooldown is determined by the most recent alert for this policy (on the
+    state's endpoint, when a state is given). If an alert was triggered
+    within the last cooldown_minutes, return True.
 
     Args:
         policy: AlertPolicy instance to check
+        state: The policy's AlertState for the endpoint, if loaded. Its
+            last_triggered_at is used instead of querying AlertEvent history.
 
     Returns:
         bool: True if policy is in cooldown, False otherwise
@@ -78,18 +104,22 @@ def is_in_cooldown(policy: AlertPolicy) -> bool:
         - Zero cooldown_minutes means no cooldown (always returns False)
         - Query is efficient: indexes on policy + triggered_at
     """
-    last_event = (
-        AlertEvent.objects
-        .filter(policy=policy)
-        .order_by("-triggered_at")
-        .first()
-    )
-
-    if not last_event:
+    if state is not None:
+        last_triggered_at = state.last_triggered_at
+    else:
+        last_event = (
+            AlertEvent.objects
+            .filter(policy=policy)
+            .order_by("-triggered_at")
+            .first()
+        )
+        last_triggered_at = last_event.triggered_at if last_event else None
+
+    if not last_triggered_at:
         # No prior alert, not in cooldown
         return False
 
-    cooldown_until = last_event.triggered_at + timedelta(
+    cooldown_until = last_triggered_at + timedelta(
         minutes=policy.cooldown_minutes
     )
 
@@ -121,24 +151,225 @@ def is_policy_violated(
         return metric_value > policy.threshold
     elif policy.comparison == "<":
         return metric_value < policy.threshold
+    elif policy.comparison == "anomaly":
+        # metric_value is a deviation from baseline in standard deviations
+        return abs(metric_value) > policy.threshold
     else:
         # Should not happen if model validation is correct
         raise ValueError(f"Unknown comparison operator: {policy.comparison}")
 
 
+def uses_window(policy: AlertPolicy) -> bool:
+    """True if the policy looks at more than the bucket being evaluated."""
+    return policy.condition == "burn_rate" or policy.window_minutes > 1
+
+
+def burn_rate(samples, slo_target: float) -> float:
+    """
+    Error budget burn rate over (request_count, error_count) samples.
+
+    A burn rate of 1 spends the budget (1 - slo_target) exactly over the SLO
+    period; 14.4 over one hour spends 2% of a 30-day budget.
+    """
+    requests = sum(sample[0] for sample in samples)
+    errors = sum(sample[1] for sample in samples)
+    if requests == 0:
+        return 0.0
+    budget = 1.0 - slo_target
+    if budget <= 0:
+        raise ValueError(f"slo_target must be below 1, got {slo_target}")
+    return (errors / requests) / budget
+
+
+def evaluate_window(
+    policy: AlertPolicy, aggregated_metric: AggregatedMetric, metric_value: float
+) -> Optional[tuple]:
+    """
+    Evaluate a windowed condition from the series' ring buffer.
+
+    The 1m bucket is recorded into the ring buffer of (policy, endpoint) and
+    the condition is evaluated on the buffer's running window sums, so each
+    evaluation is one O(1) update instead of a range query over
+    AggregatedMetric. Windows end at the newest bucket recorded.
+
+    Args:
+        policy: Policy with uses_window(policy) True
+        aggregated_metric: Metric being evaluated
+        metric_value: Resolved value for policy.metric
+
+    Returns:
+        tuple[bool, float] | None: (violated, value to report), or None for
+        buckets other than 1m, which windowed policies ignore
+
+    Raises:
+        ValueError: If a burn_rate policy has no valid slo_target
+    """
+    if aggregated_metric.bucket_size != "1m":
+        return None
+
+    minute = int(aggregated_metric.bucket_start.timestamp()) // 60
+    series = f"{policy.id}:{aggregated_metric.endpoint}"
+
+    if policy.condition == "burn_rate":
+        if policy.slo_target is None:
+            raise ValueError(f"burn_rate policy {policy.id} has no slo_target")
+
+        short_window = min(
+            policy.short_window_minutes or max(1, policy.window_minutes // 12),
+            policy.window_minutes,
+        )
+        sums = record_value(
+            series,
+            policy.window_minutes,
+            minute,
+            [aggregated_metric.request_count, aggregated_metric.error_count],
+            windows=[policy.window_minutes, short_window],
+        )
+        # record_value caps windows at ALERT_WINDOW_MAX_MINUTES
+        long_sums = sums[max(sums)]
+        short_sums = sums[min(short_window, max(sums))]
+        long_rate = burn_rate([long_sums], policy.slo_target)
+        short_rate = burn_rate([short_sums], policy.slo_target)
+
+        # Both windows must burn: the long one for significance, the short
+        # one so the alert stops as soon as the burn stops
+        violated = is_policy_violated(policy, long_rate) and is_policy_violated(policy, short_rate)
+        return violated, long_rate
+
+    sums = record_value(
+        series,
+        policy.window_minutes,
+        minute,
+        [1 if is_policy_violated(policy, metric_value) else 0],
+    )
+    violating = next(iter(sums.values()))[0]
+    return violating >= policy.for_duration_minutes, metric_value
+
+
+def lifecycle_bucket_size(policy: AlertPolicy) -> str:
+    """
+    Bucket size that drives a policy's lifecycle: its scoped bucket size, or
+    1m for policies evaluated on every bucket size.
+    """
+    return policy.bucket_size or "1m"
+
+
+def _advances_bucket(
+    state: Optional[AlertState], policy: AlertPolicy, aggregated_metric: AggregatedMetric
+) -> bool:
+    """
+    True if the metric opens a newer bucket, of the policy's lifecycle bucket
+    size, than the state is tracking.
+    """
+    if aggregated_metric.bucket_size != lifecycle_bucket_size(policy):
+        return False
+    if state is None or state.current_bucket_start is None:
+        return True
+    return aggregated_metric.bucket_start > state.current_bucket_start
+
+
+def needs_transition(
+    state: Optional[AlertState],
+    policy: AlertPolicy,
+    aggregated_metric: AggregatedMetric,
+    violated: bool,
+) -> bool:
+    """
+    Cheap pre-check, without locking, of whether apply_evaluation would
+    change the state. Most evaluations of a steady policy change nothing.
+    """
+    if state is None:
+        return violated
+    if state.status == "ok" and not violated:
+        # Healthy buckets only matter while firing (resolution streak)
+        return False
+    if _advances_bucket(state, policy, aggregated_metric):
+        return True
+    if violated:
+        return state.status == "ok" or not state.current_bucket_violated
+    return False
+
+
+def apply_evaluation(
+    state: AlertState,
+    policy: AlertPolicy,
+    aggregated_metric: AggregatedMetric,
+    metric_value: float,
+    violated: bool,
+) -> Optional[str]:
+    """
+    Advance a policy's lifecycle by one evaluation (mutates state).
+
+    The state tracks the newest bucket seen of the policy's lifecycle bucket
+    size (its scoped bucket size, or 1m). When a newer bucket arrives, the
+    previous one is closed: a bucket with no violation extends the
+    consecutive-ok streak, and a violating bucket resets it. A firing alert
+    resolves once the streak reaches resolve_after_buckets. Violations in
+    other bucket sizes count towards the current bucket.
+
+    Args:
+        state: AlertState to update (locked by the caller)
+        policy: Its AlertPolicy
+        aggregated_metric: Metric being evaluated
+        metric_value: Resolved value for policy.metric
+        violated: Whether metric_value violates the policy
+
+    Returns:
+        str | None: "fire", "resolve" or None
+    """
+    transition = None
+
+    # 1. Close the previous bucket when a newer one opens
+    if _advances_bucket(state, policy, aggregated_metric):
+        if state.current_bucket_start is not None:
+            if state.current_bucket_violated:
+                state.consecutive_ok_buckets = 0
+            else:
+                state.consecutive_ok_buckets += 1
+        state.current_bucket_start = aggregated_metric.bucket_start
+        state.current_bucket_violated = False
+
+        if (
+            state.status == "firing"
+            and not violated
+            and state.consecutive_ok_buckets >= max(policy.resolve_after_buckets, 1)
+        ):
+            state.status = "ok"
+            transition = "resolve"
+
+    # 2. Record a violation and fire if the policy isn't already firing
+    if violated:
+        state.current_bucket_violated = True
+        state.consecutive_ok_buckets = 0
+        state.last_value = metric_value
+
+        if state.status == "ok" and not is_in_cooldown(policy, state):
+            state.status = "firing"
+            state.last_triggered_at = timezone.now()
+            transition = "fire"
+
+    return transition
+
+
 def evaluate_policies(aggregated_metric: AggregatedMetric) -> int:
     """
     Evaluate all active policies for an aggregated metric and create alerts.
 
     This is the main entry point for policy evaluation. It:
-    1. Loads all active policies for the metric's project
+    1. Loads the active policies whose endpoint and bucket-size scope match
+       the metric (via the project's PolicyIndex), with their AlertState for
+       the metric's endpoint
     2. Resolves the metric value for each policy's metric type
-    3. Applies the policy's comparison operator
-    4. Creates an AlertEvent only if:
-       - Policy is violated
-       - Policy is not in cooldown
-       - Alert doesn't already exist (idempotency via unique constraints)
-    5. Triggers async email notification via Celery for new alerts
+    3. Applies the policy's comparison operator, to the bucket alone or to
+       the policy's window (sustained threshold or burn rate). Anomaly
+       policies compare the bucket's deviation from its streaming baseline.
+    4. Advances the policy's lifecycle (ok -> firing -> ok):
+       - Creates an AlertEvent when a policy that is not firing is violated
+         and not in cooldown
+       - Resolves the active AlertEvent after resolve_after_buckets
+         consecutive buckets within threshold (of the policy's bucket size,
+         or 1m for policies on every bucket size)
+    5. Schedules a batched notification digest for new alerts
 
     Args:
         aggregated_metric: AggregatedMetric instance to evaluate
@@ -152,79 +383,138 @@ def evaluate_policies(aggregated_metric: AggregatedMetric) -> int:
         - Alert creation is idempotent: re-running on same metric won't create duplicates
 
         Idempotency:
-        - Uses get_or_create pattern with atomic transaction
-        - If called twice on same metric, second call may fail to create alerts
-          (due to cooldown), but this is correct behavior
+        - State changes happen under a row lock on the (policy, endpoint)
+          AlertState
+        - A firing policy doesn't create further alerts until it resolves,
+          so re-evaluating the same metric never duplicates an alert
 
         Side effects:
-        - Creates AlertEvent records in the database
-        - Queues email tasks to Celery for async delivery
-        - Email failures are logged but don't fail the evaluation
+        - Creates and resolves AlertEvent records, updates AlertState
+        - Schedules a notification dispatch (alerts are mailed in digests)
+        - Scheduling failures are logged but don't fail the evaluation
     """
     alerts_created = 0
 
-    # Load all active policies for this project
+    # Only load the policies scoped to this endpoint and bucket size
+    policy_ids = get_policy_index(aggregated_metric.project_id).match(
+        aggregated_metric.endpoint, aggregated_metric.bucket_size
+    )
+    if not policy_ids:
+        return alerts_created
+
+    # Load the matching active policies, with their lifecycle state on this
+    # endpoint
     policies = AlertPolicy.objects.filter(
-        project=aggregated_metric.project,
+        id__in=policy_ids,
         is_active=True
     )
+    states = {
+        state.policy_id: state
+        for state in AlertState.objects.filter(
+            policy_id__in=policy_ids,
+            endpoint=aggregated_metric.endpoint,
+        )
+    }
+
+    # Anomaly policies score the metric against the endpoint's baseline
+    baseline = None
+    if any(policy.comparison == "anomaly" for policy in policies):
+        baseline = MetricBaseline.objects.filter(
+            project_id=aggregated_metric.project_id,
+            endpoint=aggregated_metric.endpoint,
+        ).first()
 
     # Evaluate each policy
     for policy in policies:
         try:
-            # 1. Resolve the metric value
-            metric_value = resolve_metric_value(policy.metric, aggregated_metric)
-
-            # 2. Check if policy is violated
-            if not is_policy_violated(policy, metric_value):
-                # No violation, skip this policy
+            # 1. Resolve the metric value (a deviation score for anomaly policies)
+            if policy.comparison == "anomaly":
+                metric_value = get_anomaly_score(baseline, policy, aggregated_metric)
+                if metric_value is None:
+                    # Baseline still warming up, or not a scored 1m bucket
+                    continue
+            else:
+                metric_value = resolve_metric_value(policy.metric, aggregated_metric)
+
+            # 2. Check if policy is violated (over its window, if it has one)
+            if uses_window(policy):
+                result = evaluate_window(policy, aggregated_metric, metric_value)
+                if result is None:
+                    continue
+                violated, metric_value = result
+            else:
+                violated = is_policy_violated(policy, metric_value)
+
+            # 3. Skip the write path when the state wouldn't change
+            state = states.get(policy.id)
+            if not needs_transition(state, policy, aggregated_metric, violated):
                 continue
 
-            # 3. Check cooldown
-            if is_in_cooldown(policy):
-                # In cooldown, skip alert creation
-                continue
-
-            # 4. Create alert atomically
-            # Using atomic transaction ensures consistency if multiple workers
-            # evaluate the same metric concurrently
+            # 4. Update the state and fire / resolve atomically.
+            # Locking the state row serializes concurrent workers evaluating
+            # the same policy and endpoint, so an alert fires at most once
+            # per incident.
             with transaction.atomic():
-                alert_event, created = AlertEvent.objects.get_or_create(
-                    policy=policy,
-                    triggered_at=timezone.now(),
-                    defaults={
-                        "value": metric_value,
-                        "resolved": False,
-                    }
+                state, _ = (
+                    AlertState.objects
+                    .select_for_update()
+                    .get_or_create(policy=policy, endpoint=aggregated_metric.endpoint)
+                )
+                transition = apply_evaluation(
+                    state, policy, aggregated_metric, metric_value, violated
                 )
 
-                if created:
+                if transition == "resolve" and state.active_event_id:
+                    AlertEvent.objects.filter(id=state.active_event_id).update(
+                        resolved=True, resolved_at=timezone.now()
+                    )
+                    logger.info(
+                        f"Alert {state.active_event_id} resolved "
+                        f"(policy: {policy.name}, endpoint: {state.endpoint})"
+                    )
+                    state.active_event = None
+
+                if transition == "fire":
+                    alert_event = AlertEvent.objects.create(
+                        policy=policy,
+                        triggered_at=state.last_triggered_at,
+                        value=metric_value,
+                        resolved=False,
+                        # Virtual no-data metrics (series.py) are never saved
+                        aggregated_metric=aggregated_metric if aggregated_metric.pk else None,
+                        exemplars=aggregated_metric.exemplars,
+                    )
+                    state.active_event = alert_event
                     alerts_created += 1
-                    
-                    # Queue email task AFTER transaction commits to avoid race condition
+
+                    # Schedule a notification digest AFTER the transaction
+                    # commits; alerts are batched rather than mailed one by one.
                     # Import here to avoid circular dependency
-                    from .tasks import send_alert_email_task
-                    
-                    def queue_email():
+                    from .notifications import schedule_notification_dispatch
+
+                    def queue_notification():
                         try:
-                            send_alert_email_task.delay(alert_event.id)
+                            schedule_notification_dispatch()
                             logger.info(
-                                f"Email task queued for alert {alert_event.id} "
+                                f"Notification pending for alert {alert_event.id} "
                                 f"(policy: {policy.name}, value: {metric_value})"
                             )
-                        except Exception as email_error:
+                        except Exception as notify_error:
                             # Log but don't fail the policy evaluation
-                            # Alert is already created; email failure shouldn't break monitoring
+                            # Alert is already created and stays pending; the
+                            # periodic dispatch will still pick it up
                             logger.error(
-                                f"Failed to queue email for alert {alert_event.id}: {email_error}",
+                                f"Failed to schedule notification for alert {alert_event.id}: {notify_error}",
                                 extra={
                                     "alert_id": alert_event.id,
                                     "policy_id": policy.id,
                                 }
                             )
-                    
-                    # Defer email task until after transaction commits
-                    transaction.on_commit(queue_email)
+
+                    # Defer scheduling until after transaction commits
+                    transaction.on_commit(queue_notification)
+
+                state.save()
 
         except ValueError as e:
             # Log policy metric type errors, but continue evaluating other policies
@@ -0,0 +1,162 @@
+"""
+Index of a project's alert policies by endpoint scope and bucket size.
+
+evaluate_policies runs once per AggregatedMetric. Instead of loading every
+policy of the project and discarding the ones that don't apply, it asks the
+project's PolicyIndex which policy ids can match (endpoint, bucket_size) and
+loads only those.
+
+Unscoped policies (empty endpoint_pattern) are project-wide: they only match
+the ROLLUP_ENDPOINT row of each bucket. Scoped policies never match it.
+
+Per bucket size the index holds:
+- unscoped policies
+- exact patterns in a dict
+- prefix patterns, and the literal prefix of glob patterns, in a character
+  trie walked once along the endpoint. Globs are then confirmed with their
+  precompiled regex.
+
+Indexes are cached per process and rebuilt after POLICY_INDEX_TTL_SECONDS
+or when a policy is saved or deleted in this process (see signals.py).
+"""
+
+import fnmatch
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .aggregation import ROLLUP_ENDPOINT
+from .models import AlertPolicy
+
+GLOB_CHARS = "*?["
+
+ANY_BUCKET = ""
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        # (policy_id, compiled glob regex or None for plain prefixes)
+        self.entries = []
+
+
+class _ScopeIndex:
+    """Endpoint matching structures for one bucket size."""
+
+    def __init__(self):
+        self.unscoped = []
+        self.exact = {}
+        self.trie = _TrieNode()
+
+    def add(self, policy_id, pattern, match):
+        if not pattern:
+            self.unscoped.append(policy_id)
+            return
+
+        if match == "exact":
+            self.exact.setdefault(pattern, []).append(policy_id)
+            return
+
+        if match == "glob":
+            literal_end = min(
+                (pattern.index(c) for c in GLOB_CHARS if c in pattern),
+                default=len(pattern),
+            )
+            prefix = pattern[:literal_end]
+            regex = re.compile(fnmatch.translate(pattern))
+        else:
+            prefix = pattern
+            regex = None
+
+        node = self.trie
+        for char in prefix:
+            node = node.children.setdefault(char, _TrieNode())
+        node.entries.append((policy_id, regex))
+
+    def match(self, endpoint, matched):
+        if endpoint == ROLLUP_ENDPOINT:
+            matched.extend(self.unscoped)
+            return
+
+        matched.extend(self.exact.get(endpoint, ()))
+
+        node = self.trie
+        for policy_id, regex in node.entries:
+            if regex is None or regex.match(endpoint):
+                matched.append(policy_id)
+        for char in endpoint:
+            node = node.children.get(char)
+            if node is None:
+                break
+            for policy_id, regex in node.entries:
+                if regex is None or regex.match(endpoint):
+                    matched.append(policy_id)
+
+
+class PolicyIndex:
+    """
+    Precompiled endpoint / bucket-size matcher for one project's active policies.
+
+    Args:
+        policies: Iterable of (id, endpoint_pattern, endpoint_match, bucket_size)
+    """
+
+    def __init__(self, policies):
+        self._scopes = {}
+        self.size = 0
+        for policy_id, pattern, match, bucket_size in policies:
+            scope = self._scopes.setdefault(bucket_size or ANY_BUCKET, _ScopeIndex())
+            scope.add(policy_id, pattern, match)
+            self.size += 1
+
+    def match(self, endpoint: str, bucket_size: str) -> list:
+        """
+        Return the ids of policies that apply to a metric, in id order.
+        """
+        matched = []
+        for key in (ANY_BUCKET, bucket_size):
+            scope = self._scopes.get(key)
+            if scope is not None:
+                scope.match(endpoint, matched)
+        return sorted(set(matched))
+
+
+_cache_lock = threading.Lock()
+_cache = {}
+
+
+def build_policy_index(project_id) -> PolicyIndex:
+    return PolicyIndex(
+        AlertPolicy.objects
+        .filter(project_id=project_id, is_active=True)
+        .values_list("id", "endpoint_pattern", "endpoint_match", "bucket_size")
+    )
+
+
+def get_policy_index(project_id) -> PolicyIndex:
+    """Return the cached PolicyIndex of a project, rebuilding it when stale."""
+    ttl = getattr(settings, "POLICY_INDEX_TTL_SECONDS", 30)
+    now = time.monotonic()
+
+    with _cache_lock:
+        cached = _cache.get(project_id)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+
+    index = build_policy_index(project_id)
+    with _cache_lock:
+        _cache[project_id] = (now, index)
+    return index
+
+
+def invalidate_policy_index(project_id=None) -> None:
+    """Drop the cached index of a project (or of all projects)."""
+    with _cache_lock:
+        if project_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(project_id, None)
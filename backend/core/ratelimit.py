@@ -0,0 +1,301 @@
+"""
+Ingest rate limiting and load shedding.
+
+Each API key gets a token bucket sized from its project's quota. Buckets live
+in Redis and are updated by a single Lua script, so concurrent web workers
+share one consistent budget at the cost of one round-trip per request.
+
+Key properties:
+- Atomic: refill and take happen inside one EVALSHA call
+- Fast rejection: once a key is denied, the worker rejects it locally until
+  the returned retry-after has elapsed, without calling Redis again (for at
+  most INGEST_DENIED_CACHE_SIZE keys per worker)
+- Fail-open: if Redis is unavailable the limiter falls back to a per-process
+  bucket instead of blocking ingest
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Optional
+
+import redis
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .aggregation import aggregation_shards
+from .models import AggregationWindow
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS[1] = bucket hash
+# ARGV[1] = refill rate (tokens/second), ARGV[2] = burst capacity, ARGV[3] = cost,
+# ARGV[4] = 1 to only check whether cost tokens are available
+# Returns {allowed, retry_after_ms}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local peek = ARGV[4] == '1'
+
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+
+local allowed = 0
+local retry_after_ms = 0
+if tokens >= cost then
+    allowed = 1
+    if peek then
+        return {allowed, retry_after_ms}
+    end
+    tokens = tokens - cost
+else
+    retry_after_ms = math.ceil((cost - tokens) * 1000 / rate)
+    if peek then
+        return {allowed, retry_after_ms}
+    end
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+
+return {allowed, retry_after_ms}
+"""
+
+
+@dataclass
+class RateLimitDecision:
+    """Outcome of a quota check."""
+
+    allowed: bool
+    retry_after: int = 0  # whole seconds, for the Retry-After header
+
+
+class LocalTokenBucket:
+    """Thread-safe in-process token bucket, used when Redis is unavailable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key: str, rate: float, burst: int, cost: int = 1, peek: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (float(burst), now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+
+            if tokens >= cost:
+                if not peek:
+                    self._buckets[key] = (tokens - cost, now)
+                return True, 0
+
+            if peek:
+                return False, int((cost - tokens) * 1000 / rate) + 1
+
+            self._buckets[key] = (tokens, now)
+            return False, int((cost - tokens) * 1000 / rate) + 1
+
+
+_local_buckets = LocalTokenBucket()
+_token_bucket_script = None
+
+# Denied key -> monotonic time its retry window ends, oldest denial first
+_denied_lock = threading.Lock()
+_denied_until = OrderedDict()
+
+_load_shed_lock = threading.Lock()
+_load_shed_state = {"checked_at": 0.0, "active": False}
+
+
+def get_project_quota(project):
+    """
+    Resolve the effective (rate, burst) for a project.
+
+    Returns:
+        tuple[float, int] | None: None if ingest is unlimited
+    """
+    rate = project.ingest_rate_per_second
+    if rate is None:
+        rate = getattr(settings, "INGEST_DEFAULT_RATE_PER_SECOND", 0)
+
+    burst = project.ingest_burst
+    if burst is None:
+        burst = getattr(settings, "INGEST_DEFAULT_BURST", 0)
+
+    if not rate or rate <= 0:
+        return None
+
+    return float(rate), max(int(burst), 1)
+
+
+def _take_from_redis(client, key: str, rate: float, burst: int, cost: int, peek: bool):
+    global _token_bucket_script
+
+    if _token_bucket_script is None:
+        _token_bucket_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    allowed, retry_after_ms = _token_bucket_script(
+        keys=[key], args=[rate, burst, cost, 1 if peek else 0], client=client
+    )
+    return bool(allowed), int(retry_after_ms)
+
+
+def take_tokens(key: str, rate: float, burst: int, cost: int = 1, peek: bool = False):
+    """
+    Take cost tokens from a shared bucket, falling back to a local one.
+
+    Args:
+        key: Redis key of the bucket
+        rate: Refill rate in tokens per second
+        burst: Bucket capacity
+        cost: Tokens to take
+        peek: Only report whether cost tokens are available, taking none
+
+    Returns:
+        tuple[bool, int]: allowed flag and retry-after in milliseconds
+    """
+    client = get_redis()
+    try:
+        if client is None:
+            raise redis.ConnectionError("REDIS_URL not configured")
+        return _take_from_redis(client, key, rate, burst, cost, peek)
+    except redis.RedisError as e:
+        if client is not None:
+            logger.warning(f"Rate limiter falling back to local bucket: {e}")
+        return _local_buckets.take(key, rate, burst, cost, peek)
+
+
+def check_ingest_quota(api_key, cost: int = 1) -> RateLimitDecision:
+    """
+    Take cost tokens from the API key's bucket.
+
+    Args:
+        api_key: APIKey with its project loaded
+        cost: Number of metrics being ingested
+
+    Returns:
+        RateLimitDecision: allowed flag and Retry-After seconds when denied
+    """
+    quota = get_project_quota(api_key.project)
+    if quota is None:
+        return RateLimitDecision(allowed=True)
+
+    rate, burst = quota
+    key = f"ratelimit:ingest:{api_key.id}"
+
+    # Fast path: this key was denied recently and its retry window is still open
+    now = time.monotonic()
+    with _denied_lock:
+        denied_until = _denied_until.get(key)
+        if denied_until is not None and now >= denied_until:
+            del _denied_until[key]
+    if denied_until is not None and now < denied_until:
+        return RateLimitDecision(
+            allowed=False, retry_after=max(1, int(denied_until - now + 0.999))
+        )
+
+    allowed, retry_after_ms = take_tokens(key, rate, burst, cost)
+
+    if allowed:
+        return RateLimitDecision(allowed=True)
+
+    max_keys = getattr(settings, "INGEST_DENIED_CACHE_SIZE", 10000)
+    with _denied_lock:
+        _denied_until[key] = now + retry_after_ms / 1000
+        _denied_until.move_to_end(key)
+        # Denials are short-lived; past the cap the oldest ones go first and
+        # those keys are simply checked against Redis again
+        while len(_denied_until) > max_keys:
+            _denied_until.popitem(last=False)
+    return RateLimitDecision(
+        allowed=False, retry_after=max(1, (retry_after_ms + 999) // 1000)
+    )
+
+
+def get_ingest_backlog(horizon_seconds: float) -> Optional[float]:
+    """
+    Return how far aggregation is behind ingest, in seconds: the age of the
+    oldest raw data not yet aggregated, i.e. the time since the end of the
+    newest window the slowest shard committed to the AggregationWindow
+    ledger.
+
+    Every closed minute gets a ledger row, even without traffic, so the
+    backlog stays under a minute or two while aggregation keeps up and grows
+    with wall-clock time as soon as it falls behind, however few tasks are
+    queued.
+
+    Args:
+        horizon_seconds: How far back to look; a shard with no window in it
+            is reported as horizon_seconds behind
+
+    Returns:
+        float | None: Backlog in seconds, or None if no window was ever
+        aggregated (nothing to compare with)
+    """
+    now = timezone.now()
+    horizon = now - timedelta(seconds=horizon_seconds)
+
+    newest_end = dict(
+        AggregationWindow.objects
+        .filter(window_start__gte=horizon)
+        .values_list("shard")
+        .annotate(end=Max("window_end"))
+    )
+    if not newest_end and not AggregationWindow.objects.exists():
+        return None
+
+    oldest_end = min(newest_end.get(shard, horizon) for shard in range(aggregation_shards()))
+    return max(0.0, (now - oldest_end).total_seconds())
+
+
+def is_load_shedding() -> bool:
+    """
+    Check whether global load-shed mode is active.
+
+    Active when INGEST_LOAD_SHED is set, or when aggregation is more than
+    INGEST_LOAD_SHED_BACKLOG_SECONDS behind ingest (see get_ingest_backlog).
+    The backlog is sampled at most once every INGEST_LOAD_SHED_CHECK_SECONDS
+    per process.
+    """
+    if getattr(settings, "INGEST_LOAD_SHED", False):
+        return True
+
+    threshold = getattr(settings, "INGEST_LOAD_SHED_BACKLOG_SECONDS", 0)
+    if not threshold:
+        return False
+
+    interval = getattr(settings, "INGEST_LOAD_SHED_CHECK_SECONDS", 5)
+    now = time.monotonic()
+
+    with _load_shed_lock:
+        if now - _load_shed_state["checked_at"] < interval:
+            return _load_shed_state["active"]
+        _load_shed_state["checked_at"] = now
+
+    backlog = get_ingest_backlog(2 * threshold)
+    active = backlog is not None and backlog > threshold
+
+    if active != _load_shed_state["active"]:
+        logger.warning(
+            f"Ingest load shedding {'enabled' if active else 'disabled'} "
+            f"(backlog={backlog if backlog is None else round(backlog)}s, threshold={threshold}s)"
+        )
+    _load_shed_state["active"] = active
+
+    return active
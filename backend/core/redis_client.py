@@ -0,0 +1,50 @@
+"""
+Shared Redis connection for request-path features (rate limiting, dedup, ...).
+
+Celery talks to Redis through its own broker connection; this module gives
+application code a lazily created client for the same server. Callers must
+treat Redis as optional: get_redis() returns None when REDIS_URL is unset,
+and any redis.RedisError should degrade to a local fallback rather than fail
+the request.
+"""
+
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Return the shared Redis client, or None if REDIS_URL is not configured.
+
+    The client is created on first use and reused for the lifetime of the
+    process (redis-py clients are thread-safe and pool their connections).
+    """
+    global _client
+
+    url = getattr(settings, "REDIS_URL", None)
+    if not url:
+        return None
+
+    if _client is None:
+        _client = redis.Redis.from_url(
+            url,
+            socket_timeout=getattr(settings, "REDIS_SOCKET_TIMEOUT", 0.25),
+            socket_connect_timeout=getattr(settings, "REDIS_SOCKET_TIMEOUT", 0.25),
+        )
+
+    return _client
+
+
+def broker_queue_keys(queue):
+    """
+    Redis lists holding a Celery queue's pending messages.
+
+    The Redis transport emulates priorities with one list per priority step
+    ("<queue>", "<queue><sep>3", ...); a queue's depth is the sum of them.
+    """
+    options = getattr(settings, "CELERY_BROKER_TRANSPORT_OPTIONS", {})
+    steps = options.get("priority_steps", [0, 3, 6, 9])
+    sep = options.get("sep", "\x06\x16")
+    return [f"{queue}{sep}{step}" if step else queue for step in steps]
@@ -0,0 +1,232 @@
+"""
+Expected-series registry for no-data detection.
+
+aggregate_metrics only writes rows for buckets that received traffic, so a
+series that goes silent is simply never evaluated and a "throughput < X"
+policy can't fire when traffic drops to zero. The registry remembers which
+(project, endpoint) series were active recently. After each window,
+aggregate_metrics_task diffs the window's 1m rows against it and evaluates
+a zero-valued virtual AggregatedMetric for every series that went silent.
+
+Per project the registry is one Redis hash (endpoint -> last active minute),
+plus a set of project ids. A series stops being expected after
+SERIES_EXPECTED_MINUTES without traffic.
+
+Key properties:
+- Cheap: one round-trip to record a window and two to read the registry,
+  whatever the number of endpoints; the diff is a set difference in memory
+- No per-endpoint queries: virtual metrics are built in memory, never saved
+- Only raw-ingested series are tracked (not pre-aggregated agent data,
+  which may legitimately arrive after the window closes)
+- Without Redis, each worker keeps its own registry in memory
+"""
+
+import logging
+import threading
+import uuid
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+
+from .aggregation import BUCKET_DEFINITIONS
+from .models import AggregatedMetric
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+SERIES_KEY_PREFIX = "series:"
+SERIES_PROJECTS_KEY = "series:projects"
+
+# KEYS[1] = project hash
+# ARGV[1] = ttl (seconds), ARGV[2..] = endpoint, minute pairs
+# Keeps the newest minute per endpoint, so re-run windows can't move it back
+RECORD_SERIES_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    local current = tonumber(redis.call('HGET', KEYS[1], ARGV[i]))
+    if not current or current < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+_record_series_script = None
+
+
+def _minute(bucket_start) -> int:
+    return int(bucket_start.timestamp()) // 60
+
+
+def _expected_minutes() -> int:
+    return int(getattr(settings, "SERIES_EXPECTED_MINUTES", 30))
+
+
+class LocalSeriesRegistry:
+    """Per-process registry, used when Redis is unavailable."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = defaultdict(dict)
+
+    def record(self, active: dict) -> None:
+        with self._lock:
+            for project_id, endpoints in active.items():
+                series = self._series[project_id]
+                for endpoint, minute in endpoints.items():
+                    if series.get(endpoint, minute - 1) < minute:
+                        series[endpoint] = minute
+
+    def snapshot(self, oldest_minute: int) -> dict:
+        with self._lock:
+            for project_id in list(self._series):
+                series = self._series[project_id]
+                for endpoint in [e for e, minute in series.items() if minute < oldest_minute]:
+                    del series[endpoint]
+                if not series:
+                    del self._series[project_id]
+            return {project_id: dict(series) for project_id, series in self._series.items()}
+
+
+_local_registry = LocalSeriesRegistry()
+
+
+def record_active_series(active: dict) -> None:
+    """
+    Mark series as active.
+
+    Args:
+        active: project_id -> {endpoint: minute of the newest active bucket}
+    """
+    if not active:
+        return
+
+    client = get_redis()
+    if client is not None:
+        global _record_series_script
+        try:
+            if _record_series_script is None:
+                _record_series_script = client.register_script(RECORD_SERIES_SCRIPT)
+            ttl = (_expected_minutes() + 1) * 60
+            pipe = client.pipeline(transaction=False)
+            for project_id, endpoints in active.items():
+                args = [ttl]
+                for endpoint, minute in endpoints.items():
+                    args.extend([endpoint, minute])
+                _record_series_script(
+                    keys=[f"{SERIES_KEY_PREFIX}{project_id}"], args=args, client=pipe
+                )
+            pipe.sadd(SERIES_PROJECTS_KEY, *[str(project_id) for project_id in active])
+            pipe.execute()
+            return
+        except redis.RedisError as e:
+            logger.warning(f"Series registry falling back to memory: {e}")
+
+    _local_registry.record(active)
+
+
+def expected_series(oldest_minute: int) -> dict:
+    """
+    Series active at or after oldest_minute.
+
+    Returns:
+        dict: project_id (str) -> {endpoint: last active minute}
+    """
+    client = get_redis()
+    if client is not None:
+        try:
+            project_ids = [p.decode() for p in client.smembers(SERIES_PROJECTS_KEY)]
+            pipe = client.pipeline(transaction=False)
+            for project_id in project_ids:
+                pipe.hgetall(f"{SERIES_KEY_PREFIX}{project_id}")
+            expected = {}
+            expired_projects = []
+            for project_id, raw in zip(project_ids, pipe.execute()):
+                series = {
+                    endpoint.decode(): int(minute)
+                    for endpoint, minute in raw.items()
+                    if int(minute) >= oldest_minute
+                }
+                if series:
+                    expected[project_id] = series
+                elif not raw:
+                    expired_projects.append(project_id)
+            if expired_projects:
+                client.srem(SERIES_PROJECTS_KEY, *expired_projects)
+            return expected
+        except redis.RedisError as e:
+            logger.warning(f"Series registry falling back to memory: {e}")
+
+    return {
+        str(project_id): series
+        for project_id, series in _local_registry.snapshot(oldest_minute).items()
+    }
+
+
+def find_silent_series(start_time, end_time, aggregated_metrics, project_ids=None) -> list:
+    """
+    Diff a window against the registry, then record the window's series.
+
+    Args:
+        start_time: Inclusive window start (1m aligned)
+        end_time: Exclusive window end
+        aggregated_metrics: Rows aggregate_metrics wrote for the window
+        project_ids: Projects of the window's shard (None for all); other
+            shards' series aren't expected here
+
+    Returns:
+        list[AggregatedMetric]: Unsaved zero-valued 1m metrics, one per
+        expected series and bucket of the window without traffic
+    """
+    bucket_delta = BUCKET_DEFINITIONS["1m"]
+
+    active_by_bucket = defaultdict(set)
+    latest = defaultdict(dict)
+    for metric in aggregated_metrics:
+        if metric.bucket_size != "1m":
+            continue
+        active_by_bucket[metric.bucket_start].add((str(metric.project_id), metric.endpoint))
+        minute = _minute(metric.bucket_start)
+        if latest[metric.project_id].get(metric.endpoint, minute - 1) < minute:
+            latest[metric.project_id][metric.endpoint] = minute
+
+    expected = expected_series(_minute(start_time) - _expected_minutes())
+    if project_ids is not None:
+        shard_projects = {str(project_id) for project_id in project_ids}
+        expected = {
+            project_id: series
+            for project_id, series in expected.items()
+            if project_id in shard_projects
+        }
+
+    silent = []
+    bucket_start = start_time
+    while bucket_start < end_time:
+        minute = _minute(bucket_start)
+        # Series seen before this bucket and within the expected horizon
+        expected_now = {
+            (project_id, endpoint)
+            for project_id, series in expected.items()
+            for endpoint, last_minute in series.items()
+            if minute - _expected_minutes() <= last_minute < minute
+        }
+        active = active_by_bucket[bucket_start]
+        for project_id, endpoint in sorted(expected_now - active):
+            silent.append(AggregatedMetric(
+                project_id=uuid.UUID(project_id),
+                endpoint=endpoint,
+                bucket_start=bucket_start,
+                bucket_size="1m",
+                request_count=0,
+                error_count=0,
+                p95_latency_ms=0,
+            ))
+
+        # Later buckets of the window also expect this bucket's series
+        for project_id, endpoint in active:
+            expected.setdefault(project_id, {})[endpoint] = minute
+        bucket_start += bucket_delta
+
+    record_active_series(latest)
+    return silent
@@ -1,8 +1,9 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Project, APIKey
+from .models import AlertPolicy, Project, APIKey
 from .models import generate_api_key
+from .policy_index import invalidate_policy_index
 
 
 @receiver(post_save, sender=Project)
@@ -12,3 +13,9 @@ def create_api_key_for_project(sender, instance, created, **kwargs):
             project=instance,
             key=generate_api_key()
         )
+
+
+@receiver(post_save, sender=AlertPolicy)
+@receiver(post_delete, sender=AlertPolicy)
+def invalidate_policy_index_on_change(sender, instance, **kwargs):
+    invalidate_policy_index(instance.project_id)
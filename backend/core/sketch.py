@@ -0,0 +1,113 @@
+"""
+Mergeable latency sketch.
+
+AggregatedMetric stores a single p95, which cannot be combined with another
+p95. Rows that have to be merged after the fact (pre-aggregated agent
+submissions, later coarser rollups) carry this sketch alongside so that
+percentiles stay accurate across merges.
+
+The sketch uses logarithmic bins with a fixed relative accuracy (DDSketch
+style): every value in bin i lies in (gamma**(i-1), gamma**i], and the bin is
+represented by a value within relative_accuracy of all of them. Counts may be
+fractional, which lets weighted (sampled) rows be added directly.
+"""
+
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+
+class LatencySketch:
+    """
+    Log-binned histogram of latencies in milliseconds.
+
+    Args:
+        relative_accuracy: Maximum relative error of quantile estimates
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.bins = {}
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value, count=1) -> None:
+        """Add count occurrences of a latency value."""
+        if count <= 0:
+            return
+
+        if value <= 0:
+            self.zero_count += count
+            return
+
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+
+    def merge(self, other: "LatencySketch") -> None:
+        """Merge another sketch with the same relative accuracy into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracies")
+
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> int:
+        """
+        Estimate the q-quantile, using the same rank rule as compute_p95:
+        the first value whose cumulative count reaches int(count * q).
+        """
+        total = self.count
+        if total <= 0:
+            return 0
+
+        target = int(total * q)
+
+        cumulative = self.zero_count
+        if cumulative >= target and self.zero_count:
+            return 0
+
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative >= target:
+                return int(round(2 * self.gamma ** index / (self.gamma + 1)))
+
+        return int(round(2 * self.gamma ** max(self.bins) / (self.gamma + 1)))
+
+    def p95(self) -> int:
+        return self.quantile(0.95)
+
+    def to_dict(self) -> dict:
+        """Compact JSON-serialisable form (stored on AggregatedMetric)."""
+        return {
+            "a": self.relative_accuracy,
+            "z": _compact(self.zero_count),
+            "b": {str(index): _compact(count) for index, count in self.bins.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencySketch":
+        sketch = cls(data.get("a", DEFAULT_RELATIVE_ACCURACY))
+        sketch.zero_count = data.get("z", 0)
+        sketch.bins = {int(index): count for index, count in data.get("b", {}).items()}
+        return sketch
+
+    @classmethod
+    def from_values(cls, samples) -> "LatencySketch":
+        """Build a sketch from (latency_ms, weight) pairs."""
+        sketch = cls()
+        for latency, weight in samples:
+            sketch.add(latency, weight)
+        return sketch
+
+
+def _compact(count):
+    """Store whole-number counts as ints to keep the JSON small."""
+    if isinstance(count, float) and count.is_integer():
+        return int(count)
+    return count
@@ -8,73 +8,224 @@ Tasks are designed to be:
 """
 
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.utils import timezone
 from django.core.management import call_command
-from datetime import timedelta
+from datetime import datetime, timedelta
 import logging
-from .aggregation import aggregate_metrics
+import uuid
+from .aggregation import aggregate_window, aggregation_shards, reaggregate_import_window, shard_project_ids
+from .archive import archive_closed_hours, prune_archive
+from .compaction import COMPACTION_SOURCES, compact_buckets, prune_aggregated_metrics
+from .delivery import Delivery, deliver
+from .health import record_pipeline_health
+from .instrumentation import TaskInstrumentation, incr, phase
+from .notifications import dispatch_pending_notifications, record_dead_letters
 from .policies import evaluate_policies
-from django.core.mail import send_mail
-from django.conf import settings
-from core.models import AlertEvent
+from .series import find_silent_series
+from core.models import AggregatedMetric
 
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=10, retry_kwargs={"max_retries": 3})
-def aggregate_metrics_task(self):
+@shared_task(bind=True, max_retries=3)
+def aggregate_metrics_task(self, window_start=None, shard=0, catchup=False):
     """
     Window-based catch-up aggregation task.
 
     Processes completed 1-minute windows only (not the current incomplete window).
     This ensures:
     - Restart safety: If task crashes, next run will process same windows
-    - Idempotency: aggregate_metrics is idempotent per window
+    - Exactly-once: aggregate_window leases the window and records it in the
+      AggregationWindow ledger in the same transaction as its rows, so a
+      duplicated beat or a retry after a commit is a no-op
     - Completeness: Only aggregates when all data for a window is likely collected
 
-    After aggregation, evaluates alert policies on all created/updated metrics.
+    With AGGREGATION_SHARDS > 1 the beat run fans the window out: it queues
+    one task per other shard and aggregates shard 0 itself.
+
+    Retries are explicit and pinned to the same window and shard; a plain
+    autoretry would re-run the task without arguments and aggregate whatever
+    minute had just closed instead. They only cover aggregation: once the
+    window committed, a repeat is a no-op, so a failed policy evaluation is
+    handed to evaluate_aggregated_metrics_task with the committed metric ids
+    instead.
+
+    A run that hits its soft time limit isn't retried (it would time out
+    again and the window would be dropped after max_retries): the window is
+    handed to one catch-up run with AGGREGATION_CATCHUP_TIME_LIMIT instead.
+
+    After aggregation, evaluates alert policies on all created/updated metrics,
+    and on zero-valued virtual metrics for recently active series that got
+    no traffic in the window (see series.py).
+
+    Args:
+        window_start: ISO start of the window; None for the beat run, which
+            takes the most recently completed minute
+        shard: Project shard, in [0, AGGREGATION_SHARDS)
+        catchup: Set on the catch-up run of a window that timed out
 
     Runs: Every minute via Celery Beat
     """
-    # Process the most recently completed 1-minute window
-    # Current time: 14:32:45 -> Process window [14:31:00, 14:32:00)
-    now = timezone.now()
-    
-    # Round down to the previous minute boundary
-    end_time = now.replace(second=0, microsecond=0)
-    
-    # Start time is 1 minute before end_time
-    start_time = end_time - timedelta(minutes=1)
-    
-    try:
-        logger.info(
-            f"Aggregating metrics for window [{start_time}, {end_time})"
+    if window_start is None:
+        # Process the most recently completed 1-minute window
+        # Current time: 14:32:45 -> Process window [14:31:00, 14:32:00)
+        now = timezone.now()
+
+        # Round down to the previous minute boundary
+        end_time = now.replace(second=0, microsecond=0)
+
+        # Start time is 1 minute before end_time
+        start_time = end_time - timedelta(minutes=1)
+
+        for other_shard in range(1, aggregation_shards()):
+            aggregate_metrics_task.apply_async(
+                kwargs={"window_start": start_time.isoformat(), "shard": other_shard}
+            )
+    else:
+        start_time = datetime.fromisoformat(window_start)
+        end_time = start_time + timedelta(minutes=1)
+
+    with TaskInstrumentation("aggregate_metrics_task"):
+        try:
+            logger.info(
+                f"Aggregating metrics for window [{start_time}, {end_time}) shard {shard}"
+            )
+
+            # Delegate aggregation logic to pure function
+            catchup_limit = getattr(settings, "AGGREGATION_CATCHUP_TIME_LIMIT", 600)
+            aggregated_metrics = aggregate_window(
+                start_time,
+                end_time,
+                shard,
+                lease_seconds=catchup_limit + 120 if catchup else None,
+            )
+            if aggregated_metrics is None:
+                # Leased or already committed by another run
+                return
+
+            logger.info(
+                f"Created/updated {len(aggregated_metrics)} aggregated metrics"
+            )
+
+            try:
+                _evaluate_window(start_time, end_time, shard, aggregated_metrics)
+            except Exception as e:
+                # The window is committed, so retrying this task would be a
+                # no-op; retry the evaluation on its own
+                logger.error(
+                    f"Policy evaluation failed for window [{start_time}, {end_time}) "
+                    f"shard {shard}, handing it to a separate task: {e}"
+                )
+                incr("evaluations_handed_off")
+                evaluate_aggregated_metrics_task.delay(
+                    [agg_metric.id for agg_metric in aggregated_metrics],
+                    window_start=start_time.isoformat(),
+                    shard=shard,
+                )
+
+        except SoftTimeLimitExceeded:
+            # The transaction was rolled back; nothing of the window is stored
+            if catchup:
+                logger.error(
+                    f"Catch-up aggregation timed out for window [{start_time}, {end_time}) shard {shard}"
+                )
+                raise
+            logger.warning(
+                f"Aggregation timed out for window [{start_time}, {end_time}) shard {shard}; "
+                f"handing it to a catch-up run"
+            )
+            catchup_limit = getattr(settings, "AGGREGATION_CATCHUP_TIME_LIMIT", 600)
+            aggregate_metrics_task.apply_async(
+                kwargs={"window_start": start_time.isoformat(), "shard": shard, "catchup": True},
+                soft_time_limit=catchup_limit,
+                time_limit=catchup_limit + 60,
+                priority=6,
+            )
+
+        except Exception as e:
+            logger.error(
+                f"Aggregation task failed for window [{start_time}, {end_time}) shard {shard}: {e}"
+            )
+            raise self.retry(
+                exc=e,
+                kwargs={"window_start": start_time.isoformat(), "shard": shard, "catchup": catchup},
+                countdown=10 * 2 ** self.request.retries,
+            )
+
+
+def _evaluate_window(start_time, end_time, shard, aggregated_metrics):
+    """
+    Evaluate alert policies on a committed window's metrics, and on
+    zero-valued metrics for recently active series of the shard that got
+    no traffic in it (see series.py).
+
+    Safe to repeat: evaluate_policies never duplicates an alert for a metric
+    it already evaluated.
+    """
+    # Evaluate policies on each aggregated metric
+    total_alerts = 0
+    with phase("evaluate"):
+        for agg_metric in aggregated_metrics:
+            alerts_created = evaluate_policies(agg_metric)
+            total_alerts += alerts_created
+
+    # Series that were active recently but got no traffic in this
+    # window are evaluated as zero-valued buckets, so no-data fires
+    with phase("no_data"):
+        silent_metrics = find_silent_series(
+            start_time,
+            end_time,
+            aggregated_metrics,
+            shard_project_ids(shard, aggregation_shards()),
         )
-        
-        # Delegate aggregation logic to pure function
-        aggregated_metrics = aggregate_metrics(start_time, end_time)
-        
+        for agg_metric in silent_metrics:
+            total_alerts += evaluate_policies(agg_metric)
+    incr("silent_series", len(silent_metrics))
+    incr("alerts_created", total_alerts)
+
+    if total_alerts > 0:
         logger.info(
-            f"Created/updated {len(aggregated_metrics)} aggregated metrics"
+            f"Policy evaluation created {total_alerts} new alerts"
         )
-        
-        # Evaluate policies on each aggregated metric
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=10, retry_kwargs={"max_retries": 3})
+def evaluate_aggregated_metrics_task(self, metric_ids, window_start=None, shard=0):
+    """
+    Evaluate alert policies for committed AggregatedMetric rows: rows written
+    outside the per-minute aggregation task (e.g. pre-aggregated agent
+    ingest), or a window whose inline evaluation failed.
+
+    Args:
+        metric_ids: AggregatedMetric ids to evaluate
+        window_start: ISO start of the aggregation window the rows belong
+            to; also evaluates the shard's silent series of that window
+        shard: Project shard of the window
+
+    Runs: On demand, queued after the ingest transaction commits or by
+    aggregate_metrics_task
+    """
+    with TaskInstrumentation("evaluate_aggregated_metrics_task"):
+        metrics = list(AggregatedMetric.objects.filter(id__in=metric_ids).select_related("project"))
+
+        if window_start is not None:
+            start_time = datetime.fromisoformat(window_start)
+            _evaluate_window(start_time, start_time + timedelta(minutes=1), shard, metrics)
+            return
+
         total_alerts = 0
-        for agg_metric in aggregated_metrics:
-            alerts_created = evaluate_policies(agg_metric)
-            total_alerts += alerts_created
-        
+        with phase("evaluate"):
+            for agg_metric in metrics:
+                total_alerts += evaluate_policies(agg_metric)
+        incr("alerts_created", total_alerts)
+
         if total_alerts > 0:
             logger.info(
                 f"Policy evaluation created {total_alerts} new alerts"
             )
-        
-    except Exception as e:
-        logger.error(
-            f"Aggregation task failed for window [{start_time}, {end_time}): {e}"
-        )
-        raise  # Re-raise for Celery retry logic
 
 
 @shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={"max_retries": 2})
@@ -91,59 +242,184 @@ def cleanup_raw_metrics_task(self):
 
     Runs: Daily via Celery Beat
     """
-    try:
-        logger.info("Starting raw metrics cleanup")
+    with TaskInstrumentation("cleanup_raw_metrics_task"):
+        try:
+            logger.info("Starting raw metrics cleanup")
         
-        # Delegate fully to existing management command
-        call_command('cleanup_raw_metrics')
+            # Delegate fully to existing management command
+            call_command('cleanup_raw_metrics')
         
-        logger.info("Raw metrics cleanup completed")
+            logger.info("Raw metrics cleanup completed")
         
-    except Exception as e:
-        logger.error(f"Cleanup task failed: {e}")
-        raise  # Re-raise for Celery retry logic
-
-@shared_task(
-    bind=True,
-    autoretry_for=(Exception,),
-    retry_backoff=30,
-    retry_kwargs={"max_retries": 3},
-)
-def send_alert_email_task(self, alert_event_id):
-    alert = (
-        AlertEvent.objects
-        .select_related("policy", "policy__project")
-        .get(id=alert_event_id)
-    )
-
-    project = alert.policy.project
-    recipient_email = project.email
-
-    if not recipient_email:
-        logger.warning(
-            f"No email configured for project {project.id}. Skipping alert email."
-        )
-        return
+        except Exception as e:
+            logger.error(f"Cleanup task failed: {e}")
+            raise  # Re-raise for Celery retry logic
 
-    subject = f"[ALERT] {alert.policy.metric} violated"
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=60, retry_kwargs={"max_retries": 2})
+def archive_raw_metrics_task(self):
+    """
+    Compact closed hours of raw metrics into the columnar archive and prune
+    archived days past their retention.
 
-    body = f"""
-🚨 Alert Triggered
+    Must run more often than cleanup_raw_metrics deletes rows, so every
+    hour is archived before its raw rows disappear.
 
-Project: {project.name}
-Metric: {alert.policy.metric}
-Threshold: {alert.policy.threshold}
-Actual Value: {alert.value}
-Severity: {alert.policy.severity}
-Triggered At: {alert.triggered_at}
+    Runs: Hourly via Celery Beat
+    """
+    with TaskInstrumentation("archive_raw_metrics_task"):
+        try:
+            archived = archive_closed_hours()
+            pruned = prune_archive()
+
+            logger.info(
+                f"Archived {archived} raw metrics, pruned {pruned} archived days"
+            )
+
+        except Exception as e:
+            logger.error(f"Archive task failed: {e}")
+            raise  # Re-raise for Celery retry logic
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=60, retry_kwargs={"max_retries": 2})
+def reaggregate_metrics_task(self, start, end, import_id):
+    """
+    Add the raw rows of one bulk import (tagged with import_id) in
+    [start, end) to their aggregated buckets.
+
+    Only the import's rows are aggregated, so buckets that already hold
+    other traffic, including rows ingested while the import ran, are
+    extended rather than counted twice. The whole range commits in one
+    transaction together with its ImportWindow ledger row, so a retry
+    either starts from a clean slate or skips the finished window.
+
+    Runs: On demand, queued by the import_metrics command
+    """
+    start_time = datetime.fromisoformat(start)
+    end_time = datetime.fromisoformat(end)
+    with TaskInstrumentation("reaggregate_metrics_task"):
+        try:
+            aggregated_metrics = reaggregate_import_window(
+                start_time, end_time, uuid.UUID(import_id)
+            )
+            if aggregated_metrics is None:
+                return
+
+            logger.info(
+                f"Re-aggregated [{start_time}, {end_time}) for import "
+                f"{import_id}: {len(aggregated_metrics)} aggregated metrics"
+            )
+
+        except Exception as e:
+            logger.error(f"Re-aggregation failed for [{start_time}, {end_time}): {e}")
+            raise  # Re-raise for Celery retry logic
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=60, retry_kwargs={"max_retries": 2})
+def compact_aggregated_metrics_task(self, since=None):
+    """
+    Roll completed 1h buckets into 1d and 1d into 1w, then prune aggregated
+    resolutions past their retention.
+
+    Compaction runs first (finest target first, so a fresh day feeds its
+    week) and pruning never deletes rows a coarser bucket doesn't cover yet.
+
+    Args:
+        since: ISO time to recompute from instead of the recent lookback;
+            queued by import_metrics once the imported range is aggregated
+
+    Runs: Hourly via Celery Beat
+    """
+    since = datetime.fromisoformat(since) if since else None
+    with TaskInstrumentation("compact_aggregated_metrics_task"):
+        try:
+            compacted = {
+                target_size: compact_buckets(target_size, since=since)
+                for target_size in COMPACTION_SOURCES
+            }
+            pruned = prune_aggregated_metrics()
+
+            logger.info(
+                f"Compacted aggregated metrics {compacted}, pruned {pruned}"
+            )
+
+        except Exception as e:
+            logger.error(f"Compaction task failed: {e}")
+            raise  # Re-raise for Celery retry logic
 
-Please investigate.
-"""
 
-    send_mail(
-        subject=subject,
-        message=body,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[recipient_email],
-        fail_silently=False,
-    )
+@shared_task(bind=True)
+def record_pipeline_health_task(self):
+    """
+    Record the pipeline's own health (aggregation lag, ingest rate, queue
+    depths, evaluation latency) as metrics of the built-in system project,
+    then evaluate that project's policies like any other.
+
+    Not retried: a missed sample is superseded by the next run.
+
+    Runs: Every minute via Celery Beat
+    """
+    with TaskInstrumentation("record_pipeline_health_task"):
+        metrics = record_pipeline_health()
+
+        total_alerts = 0
+        with phase("evaluate"):
+            for agg_metric in metrics:
+                total_alerts += evaluate_policies(agg_metric)
+        incr("alerts_created", total_alerts)
+
+
+@shared_task(bind=True, autoretry_for=(Exception,), retry_backoff=30, retry_kwargs={"max_retries": 3})
+def dispatch_alert_notifications_task(self):
+    """
+    Send notification digests for all pending alerts.
+
+    Queued by evaluate_policies at most once per batch window, and run by
+    Celery Beat as a safety net. Alerts are only marked notified when their
+    digest was sent, so retries don't drop notifications.
+
+    Runs: After each batch window, and every minute via Celery Beat
+    """
+    with TaskInstrumentation("dispatch_alert_notifications_task"):
+        with phase("send"):
+            stats = dispatch_pending_notifications()
+
+        incr("digests_sent", stats["digests"])
+        incr("deliveries_queued", stats["deliveries"])
+        incr("alerts_notified", stats["alerts"])
+        incr("alerts_deferred", stats["deferred"])
+
+        if stats["digests"] or stats["deliveries"] or stats["deferred"]:
+            logger.info(
+                f"Sent {stats['digests']} email digests and queued {stats['deliveries']} "
+                f"webhook deliveries covering {stats['alerts']} alerts "
+                f"({stats['deferred']} deferred by rate limit)"
+            )
+
+
+@shared_task(bind=True)
+def deliver_notifications_task(self, deliveries):
+    """
+    POST webhook / Slack notifications through the async delivery pool.
+
+    Retries happen inside the pool (per delivery, with jittered backoff), so
+    the task itself is not retried. Whatever still fails is dead-lettered.
+
+    Runs: On demand, queued by dispatch_alert_notifications_task
+    """
+    with TaskInstrumentation("deliver_notifications_task"):
+        with phase("send"):
+            results = deliver([Delivery(**delivery) for delivery in deliveries])
+
+        delivered = sum(1 for result in results if result.ok)
+        incr("delivered", delivered)
+        incr("dead_lettered", record_dead_letters(results))
+
+
+@shared_task(bind=True)
+def send_alert_email_task(self, alert_event_id):
+    """
+    Deprecated: alerts are now mailed in digests by
+    dispatch_alert_notifications_task. Kept so tasks queued before the switch
+    still get delivered; it simply runs a dispatch.
+    """
+    dispatch_alert_notifications_task.delay()
@@ -1,3 +1,1046 @@
-from django.test import TestCase
+import fnmatch
+import gzip
+import importlib.util
+import json
+import os
+import tempfile
+import random
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import IntegrityError, connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import aggregation, dedup, delivery, health, ratelimit, redis_client, views, windows
+from .aggregation import _group_python, aggregate_window, merge_preaggregated, reaggregate_import_window
+from .baselines import update_baselines
+from .cardinality import EndpointCardinalityLimiter
+from .compaction import compact_buckets, prune_aggregated_metrics
+from .importer import import_files
+from .models import (
+    AggregatedMetric,
+    AlertEvent,
+    AlertPolicy,
+    AggregationWindow,
+    AlertState,
+    APIKey,
+    ImportWindow,
+    MetricBaseline,
+    NotificationChannel,
+    NotificationDeadLetter,
+    Project,
+    RequestMetric,
+)
+from .leases import acquire_lease, release_lease
+from .notifications import dispatch_pending_notifications, record_dead_letters
+from .policies import evaluate_policies
+from .policy_index import PolicyIndex, get_policy_index
+from .sketch import LatencySketch
+
+HAS_FAKEREDIS = importlib.util.find_spec("fakeredis") is not None
+
+
+@contextmanager
+def fake_redis():
+    """Point get_redis() at a fresh in-process fakeredis server."""
+    import fakeredis
+
+    client = fakeredis.FakeRedis()
+    with override_settings(REDIS_URL="redis://fake"), mock.patch.object(redis_client, "_client", client):
+        yield client
+
+
+@skipUnless(importlib.util.find_spec("numpy"), "numpy is not installed")
+class AggregationEngineEquivalenceTests(TestCase):
+    """The numpy engine must group a window exactly like the Python engine."""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        projects = [Project.objects.create(name=f"engine-{i}") for i in range(2)]
+        cls.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+
+        RequestMetric.objects.bulk_create([
+            RequestMetric(
+                project=rng.choice(projects),
+                endpoint=f"/api/e{rng.randint(0, 7)}",
+                method=rng.choice(["GET", "GET", "POST"]),
+                status_code=rng.choice([200, 200, 201, 404, 429, 500, 503]),
+                latency_ms=rng.randint(1, 2000),
+                timestamp=cls.start + timedelta(microseconds=rng.randint(0, 70 * 60 * 10**6)),
+                # Fractional weights (1 / 0.3, 1 / 0.7) as well as unit and
+                # integral ones
+                sample_rate=rng.choice([1.0, 0.5, 0.3, 0.7, 0.1]),
+            )
+            for _ in range(3000)
+        ])
+
+    @staticmethod
+    def _snapshot(groups_by_size):
+        return {
+            bucket_size: sorted(
+                (
+                    str(group.project_id),
+                    group.endpoint,
+                    group.bucket_start,
+                    group.request_count,
+                    group.error_count,
+                    group.p95_latency_ms,
+                    sorted(group.status_counts.items()),
+                    json.dumps(group.method_breakdown, sort_keys=True),
+                    json.dumps(group.exemplars, sort_keys=True, default=str),
+                    sorted(group.samples()),
+                )
+                for group in groups
+            )
+            for bucket_size, groups in groups_by_size.items()
+        }
+
+    def test_numpy_engine_matches_python_engine(self):
+        from .vectorized import group_window
+
+        end = self.start + timedelta(minutes=70)
+        # Fewer admitted endpoints than the fixture has, so folding is covered
+        python_limiter = EndpointCardinalityLimiter(5)
+        numpy_limiter = EndpointCardinalityLimiter(5)
+
+        python_rows, python_groups = _group_python(self.start, end, python_limiter)
+        numpy_rows, numpy_groups = group_window(self.start, end, numpy_limiter)
+
+        self.assertEqual(python_rows, 3000)
+        self.assertEqual(numpy_rows, python_rows)
+        self.assertEqual(self._snapshot(numpy_groups), self._snapshot(python_groups))
+        self.assertEqual(numpy_limiter.overflow_stats(), python_limiter.overflow_stats())
+        self.assertTrue(python_limiter.overflow_stats())
+
+
+class _WebhookStub(BaseHTTPRequestHandler):
+    """/ok answers 200, /flaky 503 once and then 200, /down always 500."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.hits[self.path] += 1
+            hits = self.server.hits[self.path]
+
+        if self.path == "/ok" or (self.path == "/flaky" and hits > 1):
+            status = 200
+        elif self.path == "/flaky":
+            status = 503
+        else:
+            status = 500
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(
+    NOTIFICATION_MAX_ATTEMPTS=3,
+    NOTIFICATION_RETRY_BACKOFF_SECONDS=0.01,
+    NOTIFICATION_RETRY_BACKOFF_MAX_SECONDS=0.05,
+)
+class WebhookDeliveryTests(TestCase):
+    """deliver() against a local HTTP server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _WebhookStub)
+        cls.server.lock = threading.Lock()
+        cls.server.hits = Counter()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.hits.clear()
+
+    def _delivery(self, path):
+        return delivery.Delivery(
+            channel_id=None,
+            kind="webhook",
+            url=self.base_url + path,
+            payload={"alert": path},
+            alert_ids=[1],
+        )
+
+    def test_success_retry_and_dead_letter(self):
+        with mock.patch.object(delivery, "backoff_delay", wraps=delivery.backoff_delay) as backoff:
+            ok, flaky, down = delivery.deliver([
+                self._delivery("/ok"),
+                self._delivery("/flaky"),
+                self._delivery("/down"),
+            ])
+
+        self.assertEqual((ok.ok, ok.attempts, ok.status_code), (True, 1, 200))
+        self.assertEqual((flaky.ok, flaky.attempts, flaky.status_code), (True, 2, 200))
+        self.assertEqual((down.ok, down.attempts, down.status_code), (False, 3, 500))
+        self.assertEqual(self.server.hits, Counter({"/ok": 1, "/flaky": 2, "/down": 3}))
+        # One backoff before /flaky's retry and two before /down's
+        self.assertEqual(sorted(call.args[0] for call in backoff.call_args_list), [1, 1, 2])
+
+        self.assertEqual(record_dead_letters([ok, flaky, down]), 1)
+        dead_letter = NotificationDeadLetter.objects.get()
+        self.assertEqual(dead_letter.target, self.base_url + "/down")
+        self.assertEqual(dead_letter.attempts, 3)
+        self.assertEqual(dead_letter.alert_ids, [1])
+        self.assertIn("HTTP 500", dead_letter.last_error)
+
+
+class AlertLifecycleTests(TestCase):
+    """Policies fire and resolve on buckets of their own bucket size."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="lifecycle")
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+
+    def _evaluate(self, offset_minutes, p95, bucket_size="5m", endpoint="/api/orders"):
+        metric = AggregatedMetric.objects.create(
+            project=self.project,
+            endpoint=endpoint,
+            bucket_start=self.start + timedelta(minutes=offset_minutes),
+            bucket_size=bucket_size,
+            request_count=100,
+            error_count=0,
+            p95_latency_ms=p95,
+        )
+        return evaluate_policies(metric)
+
+    def _policy(self, **kwargs):
+        return AlertPolicy.objects.create(**{
+            "project": self.project,
+            "name": "slow orders",
+            "metric": "latency_p95",
+            "threshold": 500,
+            "comparison": ">",
+            "severity": "warn",
+            "endpoint_pattern": "/api/orders",
+            "cooldown_minutes": 0,
+            "resolve_after_buckets": 2,
+            **kwargs,
+        })
+
+    def test_five_minute_policy_fires_and_resolves(self):
+        policy = self._policy(bucket_size="5m")
+
+        self.assertEqual(self._evaluate(0, 900), 1)
+        # Closes the violating bucket, so the streak starts over
+        self.assertEqual(self._evaluate(5, 100), 0)
+        self.assertEqual(self._evaluate(10, 100), 0)
+        # 1m buckets are not the policy's; they neither match nor advance it
+        self.assertEqual(self._evaluate(11, 100, bucket_size="1m"), 0)
+        self.assertEqual(AlertState.objects.get(policy=policy).status, "firing")
+
+        self._evaluate(15, 100)
+        state = AlertState.objects.get(policy=policy)
+        self.assertEqual(state.status, "ok")
+        self.assertEqual(state.consecutive_ok_buckets, 2)
+        self.assertTrue(AlertEvent.objects.get(policy=policy).resolved)
+
+        # Resolved, so the next violation raises a new alert
+        self.assertEqual(self._evaluate(20, 900), 1)
+        self.assertEqual(AlertEvent.objects.filter(policy=policy, resolved=False).count(), 1)
+
+    def test_glob_policy_keeps_a_lifecycle_per_endpoint(self):
+        policy = self._policy(endpoint_pattern="/api/*", endpoint_match="glob", bucket_size="1m")
+
+        self.assertEqual(self._evaluate(0, 900, "1m", "/api/orders"), 1)
+        # Healthy buckets of another endpoint don't resolve /api/orders ...
+        for minute in range(1, 4):
+            self._evaluate(minute, 100, "1m", "/api/users")
+        # ... and its own violation raises its own alert
+        self.assertEqual(self._evaluate(4, 900, "1m", "/api/users"), 1)
+
+        states = {state.endpoint: state.status for state in AlertState.objects.filter(policy=policy)}
+        self.assertEqual(states, {"/api/orders": "firing", "/api/users": "firing"})
+        self.assertEqual(AlertEvent.objects.filter(policy=policy, resolved=False).count(), 2)
+
+    def test_windowed_policies_reject_coarse_bucket_sizes(self):
+        client = APIClient()
+        url = f"/api/projects/{self.project.id}/policies/"
+        base = {"name": "p", "metric": "latency_p95", "threshold": 500, "severity": "warn"}
+
+        for extra in (
+            {"comparison": ">", "window_minutes": 10, "for_duration_minutes": 5},
+            {"comparison": ">", "condition": "burn_rate", "slo_target": 0.999, "metric": "error_rate"},
+            {"comparison": "anomaly", "threshold": 3},
+        ):
+            response = client.post(url, {**base, **extra, "bucket_size": "5m"}, format="json")
+            self.assertEqual(response.status_code, 400, extra)
+            response = client.post(url, {**base, **extra, "bucket_size": "1m"}, format="json")
+            self.assertEqual(response.status_code, 201, extra)
+
+        response = client.post(url, {**base, "comparison": ">", "bucket_size": "1h"}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+
+class IngestDedupTests(TestCase):
+    """Retried events are stored once, at one filter call and one query per batch."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="dedup")
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {APIKey.objects.get(project=self.project).key}")
+        self.timestamp = timezone.now().replace(microsecond=0).isoformat()
+
+    def _metric(self, event_id):
+        return {
+            "endpoint": "/api/orders",
+            "status_code": 200,
+            "latency_ms": 12,
+            "timestamp": self.timestamp,
+            "event_id": event_id,
+        }
+
+    def _post(self, event_ids):
+        with mock.patch.object(views, "probably_seen", wraps=dedup.probably_seen) as check, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/ingest/", {"metrics": [self._metric(e) for e in event_ids]}, format="json"
+            )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(check.call_count, 1)
+        return [q["sql"] for q in queries if '"event_id" IN' in q["sql"]]
+
+    def test_retried_batch_is_stored_once(self):
+        ids = [uuid.uuid4().hex for _ in range(3)]
+
+        # In-batch repeats are dropped, and nothing is confirmed on a miss
+        self.assertEqual(self._post([ids[0], ids[1], ids[0]]), [])
+        self.assertEqual(RequestMetric.objects.filter(project=self.project).count(), 2)
+
+        confirmations = self._post(ids)
+        self.assertEqual(len(confirmations), 1)
+        self.assertEqual(
+            sorted(RequestMetric.objects.filter(project=self.project).values_list("event_id", flat=True)),
+            sorted(ids),
+        )
+
+    @skipUnless(HAS_FAKEREDIS, "fakeredis is not installed")
+    def test_redis_filter_matches_local_filter(self):
+        ids = [uuid.uuid4().hex for _ in range(50)]
+        now = timezone.now().timestamp()
+        local = [
+            dedup.probably_seen(self.project.id, ids[:30], now=now),
+            dedup.probably_seen(self.project.id, ids[20:], now=now + 60),
+        ]
+        with fake_redis():
+            shared = [
+                dedup.probably_seen(self.project.id, ids[:30], now=now),
+                dedup.probably_seen(self.project.id, ids[20:], now=now + 60),
+            ]
+
+        self.assertEqual(shared, local)
+        self.assertEqual(shared[0], [False] * 30)
+        self.assertEqual(shared[1], [True] * 10 + [False] * 20)
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+    NOTIFICATION_RATE_PER_MINUTE=1,
+    NOTIFICATION_BURST=1,
+)
+class NotificationDispatchTests(TestCase):
+    """Digests go out once per alert and channel, within each channel's rate."""
+
+    def setUp(self):
+        patcher = mock.patch.object(ratelimit, "_local_buckets", ratelimit.LocalTokenBucket())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.project = Project.objects.create(name="notify", email="team@example.com")
+        self.ops = NotificationChannel.objects.create(
+            project=self.project, name="ops", kind="email", target="ops@example.com"
+        )
+        self.oncall = NotificationChannel.objects.create(
+            project=self.project, name="oncall", kind="email", target="oncall@example.com"
+        )
+
+    def _alert(self, *channels):
+        policy = AlertPolicy.objects.create(
+            project=self.project,
+            name=f"policy {AlertPolicy.objects.count()}",
+            metric="error_rate",
+            threshold=0.1,
+            comparison=">",
+            severity="critical",
+        )
+        policy.channels.set(channels)
+        return AlertEvent.objects.create(policy=policy, triggered_at=timezone.now(), value=0.5)
+
+    def _bucket(self, channel):
+        return f"ratelimit:notify:channel:{channel.pk}"
+
+    def test_concurrent_dispatch_skips_alerts_being_sent(self):
+        from django.core import mail
+        from django.core.mail.backends.locmem import EmailBackend
+
+        alert = self._alert(self.ops)
+        concurrent = []
+        send_messages = EmailBackend.send_messages
+
+        def send_while_another_dispatch_runs(backend, messages):
+            concurrent.append(dispatch_pending_notifications())
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, "send_messages", send_while_another_dispatch_runs):
+            stats = dispatch_pending_notifications()
+
+        self.assertEqual(concurrent, [{"digests": 0, "deliveries": 0, "alerts": 0, "deferred": 0, "skipped": 0}])
+        self.assertEqual((stats["digests"], stats["alerts"]), (1, 1))
+        self.assertEqual(len(mail.outbox), 1)
+        alert.refresh_from_db()
+        self.assertIsNotNone(alert.notified_at)
+        self.assertIsNone(alert.notify_claim)
+
+    def test_failed_digest_releases_only_its_alerts(self):
+        from django.core.mail.backends.locmem import EmailBackend
+
+        ops_alert = self._alert(self.ops)
+        oncall_alert = self._alert(self.oncall)
+        send_messages = EmailBackend.send_messages
+
+        def fail_for_oncall(backend, messages):
+            if messages[0].to == [self.oncall.target]:
+                raise OSError("connection reset")
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, "send_messages", fail_for_oncall):
+            with self.assertRaises(OSError):
+                dispatch_pending_notifications()
+
+        ops_alert.refresh_from_db()
+        oncall_alert.refresh_from_db()
+        self.assertIsNotNone(ops_alert.notified_at)
+        self.assertIsNone(oncall_alert.notified_at)
+        # Released, so the retry picks it up
+        self.assertIsNone(oncall_alert.notify_claim)
+
+    def test_deferred_digest_does_not_spend_tokens(self):
+        self._alert(self.ops, self.oncall)
+        # oncall is out of tokens, so the alert waits on both channels
+        ratelimit.take_tokens(self._bucket(self.oncall), 1 / 60, 1)
+
+        stats = dispatch_pending_notifications()
+
+        self.assertEqual((stats["digests"], stats["deferred"]), (0, 1))
+        self.assertEqual(ratelimit.take_tokens(self._bucket(self.ops), 1 / 60, 1, peek=True)[0], True)
+
+
+class IngestLoadSheddingTests(TestCase):
+    """Ingest is shed on aggregation lag, and denied keys are remembered boundedly."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(ratelimit._load_shed_state, {"checked_at": 0.0, "active": False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.now = timezone.now().replace(second=0, microsecond=0)
+
+    def _window(self, minutes_ago, shard=0):
+        end = self.now - timedelta(minutes=minutes_ago)
+        AggregationWindow.objects.create(
+            window_start=end - timedelta(minutes=1),
+            window_end=end,
+            shard=shard,
+            shards=2,
+            fencing_token=1,
+        )
+
+    def test_backlog_is_the_slowest_shards_lag(self):
+        self.assertIsNone(ratelimit.get_ingest_backlog(600))
+
+        self._window(20)
+        self._window(2)
+        self.assertAlmostEqual(ratelimit.get_ingest_backlog(3600) // 60, 2)
+
+        with override_settings(AGGREGATION_SHARDS=2):
+            # Shard 1 never committed a window within the horizon
+            self.assertAlmostEqual(ratelimit.get_ingest_backlog(3600) // 60, 60)
+            self._window(25, shard=1)
+            self.assertAlmostEqual(ratelimit.get_ingest_backlog(3600) // 60, 25)
+
+    @override_settings(INGEST_LOAD_SHED_BACKLOG_SECONDS=600)
+    def test_sheds_while_aggregation_is_behind(self):
+        self._window(15)
+        self.assertTrue(ratelimit.is_load_shedding())
+
+        self._window(1)
+        ratelimit._load_shed_state["checked_at"] = 0.0
+        self.assertFalse(ratelimit.is_load_shedding())
+
+    @override_settings(INGEST_DENIED_CACHE_SIZE=2)
+    def test_denied_keys_are_bounded(self):
+        project = Project.objects.create(name="quota", ingest_rate_per_second=0.001, ingest_burst=1)
+        keys = [APIKey.objects.create(project=project, key=uuid.uuid4().hex) for _ in range(3)]
+
+        with mock.patch.object(ratelimit, "_denied_until", ratelimit.OrderedDict()) as denied, \
+                mock.patch.object(ratelimit, "_local_buckets", ratelimit.LocalTokenBucket()):
+            for key in keys:
+                self.assertTrue(ratelimit.check_ingest_quota(key).allowed)
+                self.assertFalse(ratelimit.check_ingest_quota(key).allowed)
+
+            self.assertEqual(list(denied), [f"ratelimit:ingest:{key.id}" for key in keys[1:]])
+            # Still denied through the bucket once forgotten locally
+            self.assertFalse(ratelimit.check_ingest_quota(keys[0]).allowed)
+
+
+class AggregateWindowTests(TestCase):
+    """Each window shard is committed exactly once, and real failures surface."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="windows")
+        self.start = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=5)
+        self.end = self.start + timedelta(minutes=1)
+        RequestMetric.objects.create(
+            project=self.project,
+            endpoint="/api/orders",
+            method="GET",
+            status_code=200,
+            latency_ms=40,
+            timestamp=self.start + timedelta(seconds=10),
+        )
+
+    def test_window_is_committed_once(self):
+        metrics = aggregate_window(self.start, self.end)
+
+        self.assertTrue(metrics)
+        self.assertIsNone(aggregate_window(self.start, self.end))
+        ledger = AggregationWindow.objects.get(window_start=self.start, shard=0)
+        self.assertEqual(ledger.metric_count, len(metrics))
+
+    def test_leased_window_is_skipped(self):
+        name = f"aggregate:{self.start.isoformat()}:0"
+        token = acquire_lease(name, 60)
+        try:
+            self.assertIsNone(aggregate_window(self.start, self.end))
+        finally:
+            release_lease(name, token)
+        self.assertFalse(AggregationWindow.objects.exists())
+
+    def test_only_a_ledger_conflict_is_skipped(self):
+        with mock.patch.object(aggregation, "aggregate_metrics", side_effect=IntegrityError("bad row")):
+            with self.assertRaises(IntegrityError):
+                aggregate_window(self.start, self.end)
+        self.assertFalse(AggregationWindow.objects.exists())
+
+        # Another run committed the window after this one's ledger check
+        AggregationWindow.objects.create(
+            window_start=self.start, window_end=self.end, shard=0, fencing_token=0
+        )
+        with mock.patch.object(aggregation, "aggregate_metrics", return_value=[]), \
+                mock.patch.object(QuerySet, "exists", side_effect=[False, True]):
+            self.assertIsNone(aggregate_window(self.start, self.end))
+
+
+class AggregatedMetricsApiTests(TestCase):
+    """The aggregated metrics list keeps its per-endpoint default."""
+
+    def test_rollup_is_only_listed_when_asked_for(self):
+        project = Project.objects.create(name="api")
+        bucket_start = timezone.now().replace(second=0, microsecond=0) - timedelta(minutes=3)
+        for endpoint, requests in (("/api/a", 3), ("/api/b", 2), ("*", 5)):
+            AggregatedMetric.objects.create(
+                project=project,
+                endpoint=endpoint,
+                bucket_start=bucket_start,
+                bucket_size="1m",
+                request_count=requests,
+                error_count=0,
+                p95_latency_ms=10,
+            )
+        url = f"/api/projects/{project.id}/metrics/aggregated/"
+
+        def listed(**params):
+            response = APIClient().get(url, params)
+            self.assertEqual(response.status_code, 200)
+            return sorted((row["endpoint"], row["request_count"]) for row in response.json())
+
+        self.assertEqual(listed(), [("/api/a", 3), ("/api/b", 2)])
+        self.assertEqual(listed(endpoint="*"), [("*", 5)])
+        self.assertEqual(listed(endpoint="/api/b"), [("/api/b", 2)])
+
+
+class PipelineHealthTests(TestCase):
+    """Health gauges keep the latest sample of their bucket."""
+
+    @staticmethod
+    def _snapshot(queue_depth, lag_seconds):
+        return {
+            "ingest": {"rate_per_second": None},
+            "aggregation": {"lag_seconds": lag_seconds},
+            "queues": {"celery": queue_depth},
+            "alert_evaluation": {"avg_seconds_per_run": None},
+        }
+
+    def _gauges(self):
+        return {
+            (m.endpoint, m.bucket_size): (m.request_count, m.p95_latency_ms)
+            for m in AggregatedMetric.objects.filter(endpoint__startswith="pipeline/")
+        }
+
+    def test_sampling_twice_in_a_bucket_overwrites(self):
+        now = timezone.now().replace(second=10)
+        with mock.patch.object(health.timezone, "now", return_value=now):
+            with mock.patch.object(health, "collect_pipeline_health", return_value=self._snapshot(40, 90)):
+                health.record_pipeline_health()
+            with mock.patch.object(health, "collect_pipeline_health", return_value=self._snapshot(7, 30)):
+                health.record_pipeline_health()
+
+        gauges = self._gauges()
+        for bucket_size in aggregation.BUCKET_DEFINITIONS:
+            self.assertEqual(gauges[("pipeline/queue/celery", bucket_size)][0], 7)
+            self.assertEqual(gauges[("pipeline/aggregation_lag", bucket_size)][0], 1)
+            self.assertAlmostEqual(gauges[("pipeline/aggregation_lag", bucket_size)][1], 30000, delta=30000 * 0.02)
+
+
+class BaselineTests(TestCase):
+    """Each 1m bucket counts once in its endpoint's baseline."""
+
+    def setUp(self):
+        self.start = timezone.now().replace(second=0, microsecond=0) - timedelta(hours=1)
+
+    @staticmethod
+    def _submission(bucket_start, requests, latency_ms):
+        sketch = LatencySketch()
+        sketch.add(latency_ms, requests)
+        return {
+            "endpoint": "/api/orders",
+            "bucket_start": bucket_start,
+            "request_count": requests,
+            "error_count": 0,
+            "sketch": sketch,
+        }
+
+    def _baseline(self, project):
+        return MetricBaseline.objects.get(project=project, endpoint="/api/orders")
+
+    def test_later_partials_replace_the_minute(self):
+        partials = Project.objects.create(name="partials")
+        whole = Project.objects.create(name="whole")
+        for minute in range(3):
+            bucket_start = self.start + timedelta(minutes=minute)
+            first = 10 * (minute + 1)
+            merge_preaggregated(partials.id, [self._submission(bucket_start, first, 50)])
+            merge_preaggregated(partials.id, [self._submission(bucket_start, 30, 50)])
+            merge_preaggregated(whole.id, [self._submission(bucket_start, first + 30, 50)])
+
+        stats = self._baseline(partials).stats["throughput"]
+        expected = self._baseline(whole).stats["throughput"]
+        self.assertEqual(stats["n"], 3)
+        self.assertEqual((stats["n"], stats["m"], stats["v"]), (expected["n"], expected["m"], expected["v"]))
+        self.assertEqual(stats["s"], expected["s"])
+
+    @override_settings(BASELINE_MIN_SAMPLES=3)
+    def test_scores_after_warm_up_and_skips_late_buckets(self):
+        project = Project.objects.create(name="warm-up")
+        rows = [
+            AggregatedMetric.objects.create(
+                project=project,
+                endpoint="/api/orders",
+                bucket_start=self.start + timedelta(minutes=minute),
+                bucket_size="1m",
+                request_count=requests,
+                error_count=0,
+                p95_latency_ms=10,
+            )
+            for minute, requests in enumerate([100, 100, 100, 400])
+        ]
+
+        scores = []
+        for row in rows:
+            update_baselines([row])
+            scores.append(self._baseline(project).stats["throughput"]["z"])
+        self.assertEqual(scores[:3], [None, None, None])
+        self.assertGreater(scores[3], 3)
+
+        # An older bucket arriving now doesn't move the baseline
+        before = self._baseline(project).stats
+        self.assertEqual(update_baselines([rows[1]]), 0)
+        self.assertEqual(self._baseline(project).stats, before)
+
+
+class SketchMergeTests(TestCase):
+    """Pre-aggregated submissions merge with raw-aggregated buckets."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="sketch")
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        # p95 of the raw rows alone is 1000ms
+        RequestMetric.objects.bulk_create([
+            RequestMetric(
+                project=self.project,
+                endpoint="/api/orders",
+                method="GET",
+                status_code=200,
+                latency_ms=1000 if i < 10 else 10,
+                timestamp=self.start + timedelta(seconds=i % 60),
+            )
+            for i in range(100)
+        ])
+        aggregation.aggregate_metrics(self.start, self.start + timedelta(minutes=1))
+
+    def _merge_fast_requests(self):
+        sketch = LatencySketch()
+        sketch.add(10, 200)
+        merge_preaggregated(self.project.id, [{
+            "endpoint": "/api/orders",
+            "bucket_start": self.start,
+            "request_count": 200,
+            "error_count": 0,
+            "sketch": sketch,
+        }])
+
+    def _p95s(self):
+        return {
+            (m.endpoint, m.bucket_size): (m.request_count, m.p95_latency_ms)
+            for m in AggregatedMetric.objects.filter(project=self.project)
+        }
+
+    def test_raw_buckets_store_sketches(self):
+        rows = AggregatedMetric.objects.filter(project=self.project)
+        self.assertEqual(
+            {m.bucket_size for m in rows if m.latency_sketch is not None},
+            set(aggregation.BUCKET_DEFINITIONS),
+        )
+
+        self._merge_fast_requests()
+        for bucket_size in aggregation.BUCKET_DEFINITIONS:
+            for endpoint in ("/api/orders", aggregation.ROLLUP_ENDPOINT):
+                # 290 of 300 requests took 10ms
+                self.assertEqual(self._p95s()[(endpoint, bucket_size)][0], 300)
+                self.assertAlmostEqual(self._p95s()[(endpoint, bucket_size)][1], 10, delta=1)
+
+    def test_rows_without_sketch_are_rebuilt_from_raw(self):
+        AggregatedMetric.objects.filter(project=self.project).update(latency_sketch=None)
+
+        self._merge_fast_requests()
+        for (endpoint, bucket_size), (requests, p95) in self._p95s().items():
+            self.assertEqual(requests, 300)
+            self.assertAlmostEqual(p95, 10, delta=1)
+
+
+class EndpointCardinalityTests(TestCase):
+    """Over-limit endpoints fold by real request volume."""
+
+    def test_ranking_weighs_sampled_rows(self):
+        project = Project.objects.create(name="cardinality")
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        # /api/busy stores fewer rows but stands for 20 requests
+        RequestMetric.objects.bulk_create([
+            RequestMetric(
+                project=project,
+                endpoint=endpoint,
+                method="GET",
+                status_code=200,
+                latency_ms=10,
+                timestamp=start + timedelta(seconds=i),
+                sample_rate=sample_rate,
+            )
+            for endpoint, rows, sample_rate in (("/api/busy", 2, 0.1), ("/api/quiet", 5, 1.0))
+            for i in range(rows)
+        ])
+
+        _, groups = _group_python(start, start + timedelta(minutes=1), EndpointCardinalityLimiter(1))
+        self.assertEqual(
+            sorted((g.endpoint, g.request_count) for g in groups["1m"]),
+            [("*", 25), ("/api/busy", 20), ("__other__", 5)],
+        )
+
+    def test_overflow_name_is_reserved_at_ingest(self):
+        timestamp = timezone.now().isoformat()
+        for endpoint in ("*", "__other__"):
+            _, error = views._parse_raw_metric(
+                {"endpoint": endpoint, "status_code": 200, "latency_ms": 1, "timestamp": timestamp}
+            )
+            self.assertIn("reserved", error)
+            _, error = views._parse_aggregated_submission(
+                {"endpoint": endpoint, "bucket_start": timestamp, "request_count": 1, "error_count": 0}
+            )
+            self.assertIn("reserved", error)
+
+
+class ReaggregateImportTests(TestCase):
+    """An import's window is added to its buckets once."""
+
+    def test_repeated_window_is_skipped(self):
+        project = Project.objects.create(name="import")
+        import_id = uuid.uuid4()
+        start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=2)
+        end = start + timedelta(hours=1)
+        RequestMetric.objects.bulk_create([
+            RequestMetric(
+                project=project,
+                endpoint="/api/orders",
+                method="GET",
+                status_code=200,
+                latency_ms=10,
+                timestamp=start + timedelta(minutes=i),
+                import_id=import_id,
+            )
+            for i in range(4)
+        ])
+
+        self.assertTrue(reaggregate_import_window(start, end, import_id))
+        self.assertIsNone(reaggregate_import_window(start, end, import_id))
+
+        hour = AggregatedMetric.objects.get(project=project, endpoint="/api/orders", bucket_size="1h")
+        self.assertEqual(hour.request_count, 4)
+        self.assertEqual(ImportWindow.objects.filter(import_id=import_id).count(), 1)
+
+
+class CompactionTests(TestCase):
+    """Hours roll up into days, and fine rows are pruned only once covered."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="compaction")
+        self.midnight = timezone.now().astimezone(dt_timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.now = self.midnight + timedelta(hours=1)
+        rows = []
+        for day in (2, 1):
+            for hour in range(24):
+                # The second day has two slow hours, 20 of its 240 requests
+                latency = 1000 if day == 1 and hour < 2 else 10
+                rows.append(self._hour(self.midnight - timedelta(days=day, hours=-hour), latency))
+        # Today's first hour isn't part of a closed day yet
+        rows.append(self._hour(self.midnight, 10))
+        AggregatedMetric.objects.bulk_create(rows)
+
+    def _hour(self, bucket_start, latency_ms):
+        sketch = LatencySketch()
+        sketch.add(latency_ms, 10)
+        return AggregatedMetric(
+            project=self.project,
+            endpoint="/api/orders",
+            bucket_start=bucket_start,
+            bucket_size="1h",
+            request_count=10,
+            error_count=1,
+            p95_latency_ms=latency_ms,
+            latency_sketch=sketch.to_dict(),
+        )
+
+    def _days(self):
+        return {
+            m.bucket_start: (m.request_count, m.error_count, m.p95_latency_ms)
+            for m in AggregatedMetric.objects.filter(project=self.project, bucket_size="1d")
+        }
+
+    def test_compaction_is_idempotent(self):
+        self.assertEqual(compact_buckets("1d", now=self.now), 2)
+        days = self._days()
+        self.assertEqual(compact_buckets("1d", now=self.now), 2)
+        self.assertEqual(self._days(), days)
+
+        self.assertEqual(sorted(days), [self.midnight - timedelta(days=2), self.midnight - timedelta(days=1)])
+        quiet, slow = (days[start] for start in sorted(days))
+        self.assertEqual(quiet[:2], (240, 24))
+        self.assertAlmostEqual(quiet[2], 10, delta=1)
+        self.assertEqual(slow[:2], (240, 24))
+        self.assertAlmostEqual(slow[2], 1000, delta=20)
+
+    def test_prune_keeps_uncompacted_rows(self):
+        retention = {"1m": 7, "5m": 30, "1h": 0, "1d": 1825, "1w": None}
+        with override_settings(AGGREGATED_RETENTION_DAYS=retention):
+            # Nothing compacted yet: every hour is kept
+            self.assertEqual(prune_aggregated_metrics(now=self.now).get("1h"), None)
+
+            compact_buckets("1d", now=self.now)
+            self.assertEqual(prune_aggregated_metrics(now=self.now)["1h"], 48)
+
+        self.assertEqual(
+            list(AggregatedMetric.objects.filter(bucket_size="1h").values_list("bucket_start", flat=True)),
+            [self.midnight],
+        )
+        self.assertEqual(len(self._days()), 2)
+
+
+class AlertWindowTests(TestCase):
+    """Ring buffer sums match a recomputation from the recorded minutes."""
+
+    SIZE = 10
+    WINDOWS = [3, 10]
+
+    def _writes(self):
+        rng = random.Random(11)
+        minute = 1000
+        writes = []
+        for _ in range(200):
+            # Mostly the next minute, with gaps, repeats and late buckets
+            minute += rng.choice([1, 1, 1, 2, 5, 12, 0])
+            late = rng.choice([0, 0, 0, 1, 3, 9, 15])
+            writes.append((minute - late, [rng.randint(0, 9), rng.randint(0, 1)]))
+        return writes
+
+    def _expected(self, writes):
+        values = {}
+        newest = None
+        expected = []
+        for minute, row in writes:
+            if newest is None or minute > newest:
+                newest = minute
+            if minute > newest - self.SIZE:
+                values[minute] = row
+            expected.append({
+                window: [
+                    sum(v[i] for m, v in values.items() if newest - window < m <= newest)
+                    for i in range(2)
+                ]
+                for window in self.WINDOWS
+            })
+        return expected
+
+    def _recorded(self, writes):
+        return [
+            {
+                window: [float(v) for v in sums]
+                for window, sums in windows.record_value("series", self.SIZE, minute, row, self.WINDOWS).items()
+            }
+            for minute, row in writes
+        ]
+
+    def test_local_buffer(self):
+        writes = self._writes()
+        with mock.patch.object(windows, "_local_store", windows.LocalWindowStore()):
+            self.assertEqual(self._recorded(writes), self._expected(writes))
+
+    @skipUnless(HAS_FAKEREDIS, "fakeredis is not installed")
+    def test_redis_buffer(self):
+        writes = self._writes()
+        with fake_redis():
+            self.assertEqual(self._recorded(writes), self._expected(writes))
+
+
+class PolicyIndexTests(TestCase):
+    """The policy index returns exactly the policies a full scan would."""
+
+    POLICIES = [
+        (1, "", "prefix", ""),
+        (2, "", "prefix", "5m"),
+        (3, "/api/orders", "exact", ""),
+        (4, "/api/", "prefix", "1m"),
+        (5, "/api/*/items", "glob", ""),
+        (6, "/v?/users", "glob", "1m"),
+        (7, "/api/orders", "prefix", "5m"),
+        (8, "/api/o", "exact", ""),
+        (9, "*", "glob", "1h"),
+    ]
+    ENDPOINTS = [
+        "*", "/api/orders", "/api/orders/1", "/api/o", "/api/carts/items",
+        "/api/carts/items/2", "/v1/users", "/v10/users", "/health", "",
+    ]
+
+    @staticmethod
+    def _applies(policy, endpoint, bucket_size):
+        _, pattern, match, policy_bucket_size = policy
+        if policy_bucket_size and policy_bucket_size != bucket_size:
+            return False
+        if endpoint == aggregation.ROLLUP_ENDPOINT:
+            return not pattern
+        if not pattern:
+            return False
+        if match == "exact":
+            return endpoint == pattern
+        if match == "glob":
+            return fnmatch.fnmatchcase(endpoint, pattern)
+        return endpoint.startswith(pattern)
+
+    def test_index_matches_full_scan(self):
+        index = PolicyIndex(self.POLICIES)
+        for endpoint in self.ENDPOINTS:
+            for bucket_size in ("1m", "5m", "1h"):
+                self.assertEqual(
+                    index.match(endpoint, bucket_size),
+                    [p[0] for p in self.POLICIES if self._applies(p, endpoint, bucket_size)],
+                    (endpoint, bucket_size),
+                )
+
+    def test_saving_a_policy_refreshes_the_index(self):
+        project = Project.objects.create(name="index")
+        self.assertEqual(get_policy_index(project.id).match("/api/orders", "1m"), [])
+
+        policy = AlertPolicy.objects.create(
+            project=project,
+            name="slow orders",
+            metric="latency_p95",
+            threshold=500,
+            comparison=">",
+            severity="warn",
+            endpoint_pattern="/api/orders",
+            endpoint_match="exact",
+        )
+        self.assertEqual(get_policy_index(project.id).match("/api/orders", "1m"), [policy.id])
+
+        policy.is_active = False
+        policy.save()
+        self.assertEqual(get_policy_index(project.id).match("/api/orders", "1m"), [])
+
+
+class MetricImportTests(TestCase):
+    """Files stream into tagged raw rows, which re-aggregate into buckets."""
+
+    def setUp(self):
+        self.project = Project.objects.create(name="import")
+        self.start = timezone.now().astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(days=1)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _path(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with gzip.open(path, "wt") if name.endswith(".gz") else open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def test_import_and_reaggregate(self):
+        ndjson = self._path("metrics.ndjson.gz", [
+            json.dumps({
+                "endpoint": "/api/orders",
+                "status_code": 500 if i == 0 else 200,
+                "latency_ms": 10 + i,
+                "timestamp": (self.start + timedelta(minutes=i * 20)).isoformat(),
+            })
+            for i in range(5)
+        ] + [
+            "not json",
+            json.dumps({"endpoint": "__other__", "status_code": 200, "latency_ms": 1, "timestamp": self.start.isoformat()}),
+        ])
+        csv_path = self._path("metrics.csv", [
+            "endpoint,status_code,latency_ms,timestamp,sample_rate",
+            f"/api/carts,200,30,{int(self.start.timestamp())},0.5",
+            f"/api/carts,200,30,,1.0",
+        ])
+
+        result = import_files([ndjson, csv_path], default_project_id=self.project.id, chunk_rows=2)
+
+        self.assertEqual((result.rows_imported, result.rows_skipped), (6, 3))
+        self.assertEqual(len(result.errors), 3)
+        self.assertEqual(sorted(result.windows), [self.start, self.start + timedelta(hours=1)])
+        self.assertEqual(
+            RequestMetric.objects.filter(project=self.project, import_id=result.import_id).count(), 6
+        )
+
+        for start in result.windows:
+            reaggregate_import_window(start, start + timedelta(hours=1), result.import_id)
+        hours = {
+            m.endpoint: (m.request_count, m.error_count)
+            for m in AggregatedMetric.objects.filter(project=self.project, bucket_size="1h", bucket_start=self.start)
+        }
+        self.assertEqual(hours, {"/api/orders": (3, 1), "/api/carts": (2, 0), "*": (5, 1)})
@@ -1,73 +1,372 @@
+import random
+from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator, validate_email
 from django.utils.dateparse import parse_datetime
 from django.utils import timezone
+from django.conf import settings
 from datetime import timezone as dt_timezone
-from .models import APIKey, RequestMetric, Project, AggregatedMetric, AlertPolicy, AlertEvent, generate_api_key
+from .models import APIKey, RequestMetric, Project, AggregatedMetric, AlertPolicy, AlertEvent, NotificationChannel, generate_api_key
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
+from django.db import transaction
+from .archive import query_archive
+from .cardinality import OVERFLOW_ENDPOINT
+from .aggregation import BUCKET_DEFINITIONS, ROLLUP_ENDPOINT, STATUS_CLASS_FIELDS, get_bucket_start, merge_preaggregated
+from .health import collect_pipeline_health
+from .dedup import probably_seen
+from .instrumentation import get_task_metrics, render_prometheus
+from .parsers import CompressedJSONParser
+from .ratelimit import check_ingest_quota, get_project_quota, is_load_shedding
+from .sketch import LatencySketch
+from .tasks import evaluate_aggregated_metrics_task
+
+def _authorize_ingest(request, cost=1, allow_sampling=True):
+    """
+    Authenticate an ingest request and apply load shedding and quotas.
+
+    Returns:
+        tuple: (api_key, quota_sample_rate, response). When response is not
+        None the view must return it as-is. quota_sample_rate is below 1.0
+        when the request was kept by over-quota sampling.
+    """
+    # 1. Read API key
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, 1.0, Response(
+            {"error": "Missing API key"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    key = auth_header.split(" ")[1]
+
+    # Shed load before touching the database
+    if is_load_shedding():
+        return None, 1.0, Response(
+            {"error": "Ingest temporarily unavailable"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(settings.INGEST_LOAD_SHED_CHECK_SECONDS)},
+        )
+
+    try:
+        api_key = APIKey.objects.select_related("project").get(key=key, is_active=True)
+    except APIKey.DoesNotExist:
+        return None, 1.0, Response(
+            {"error": "Invalid API key"},
+            status=status.HTTP_401_UNAUTHORIZED,
+        )
+
+    # A request costing more than the bucket holds could never be admitted,
+    # so reject it outright instead of answering 429 forever
+    project_quota = get_project_quota(api_key.project)
+    if project_quota is not None and cost > project_quota[1]:
+        return api_key, 1.0, Response(
+            {"error": f"Batch of {cost} metrics exceeds the project's ingest burst of "
+                      f"{project_quota[1]}; send at most {project_quota[1]} per request"},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+
+    # Enforce per-key quota
+    quota = check_ingest_quota(api_key, cost=cost)
+    if quota.allowed:
+        return api_key, 1.0, None
+
+    project = api_key.project
+    if not allow_sampling or project.ingest_over_quota != "sample":
+        return api_key, 1.0, Response(
+            {"error": "Rate limit exceeded"},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(quota.retry_after)},
+        )
+
+    if random.random() >= project.ingest_over_quota_sample_rate:
+        # Sampled out: accepted but not stored, so clients don't retry
+        return api_key, 1.0, Response(status=status.HTTP_204_NO_CONTENT)
+
+    return api_key, project.ingest_over_quota_sample_rate, None
+
 
 class IngestMetricView(APIView):
+    """
+    Ingest raw per-request metrics.
+
+    Accepts a single object or a batch: a list, optionally wrapped as
+    {"metrics": [...]}, of up to INGEST_MAX_BATCH_SIZE objects with:
+        endpoint, status_code, latency_ms, timestamp,
+        optional method, sample_rate, event_id
+
+    Bodies may be gzip-compressed (Content-Encoding: gzip). A batch is
+    validated as a whole and stored with one insert.
+    """
     authentication_classes = []
     permission_classes = []
+    parser_classes = [CompressedJSONParser]
 
     def post(self, request):
-        # 1. Read API key
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
+        # 1. Unwrap the batch
+        data = request.data
+        is_batch = isinstance(data, list) or (isinstance(data, dict) and "metrics" in data)
+        if isinstance(data, dict) and "metrics" in data:
+            data = data["metrics"]
+        items = data if isinstance(data, list) else [data]
+        if not items:
             return Response(
-                {"error": "Missing API key"},
-                status=status.HTTP_401_UNAUTHORIZED,
+                {"error": "Expected a metric or a non-empty list of metrics"},
+                status=status.HTTP_400_BAD_REQUEST,
             )
 
-        key = auth_header.split(" ")[1]
-
-        try:
-            api_key = APIKey.objects.get(key=key, is_active=True)
-        except APIKey.DoesNotExist:
+        max_batch_size = getattr(settings, "INGEST_MAX_BATCH_SIZE", 1000)
+        if len(items) > max_batch_size:
             return Response(
-                {"error": "Invalid API key"},
-                status=status.HTTP_401_UNAUTHORIZED,
+                {"error": f"At most {max_batch_size} metrics per request"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             )
 
-        # 2. Parse payload
-        data = request.data
+        api_key, quota_sample_rate, error_response = _authorize_ingest(request, cost=len(items))
+        if error_response is not None:
+            return error_response
 
-        required_fields = ["endpoint", "status_code", "latency_ms", "timestamp"]
-        for field in required_fields:
-            if field not in data:
+        # 2. Parse payload
+        metrics = []
+        for index, item in enumerate(items):
+            metric, error = _parse_raw_metric(item)
+            if error:
                 return Response(
-                    {"error": f"Missing field: {field}"},
+                    {"error": f"metrics[{index}]: {error}" if is_batch else error},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
+            metrics.append(metric)
+
+        # Optional idempotency key: retries of a stored event are accepted
+        # without storing it again. The batch's ids are checked in one
+        # Bloom filter call.
+        batch_event_ids = {}
+        for metric in metrics:
+            if metric["event_id"]:
+                batch_event_ids.setdefault(metric["event_id"], metric["timestamp"])
+        candidates = {
+            event_id: timestamp
+            for (event_id, timestamp), seen in zip(
+                batch_event_ids.items(),
+                probably_seen(api_key.project_id, list(batch_event_ids)),
+            )
+            if seen
+        }
+
+        # Bloom filter hits: confirm with one query on the (project,
+        # timestamp) index, since a retry carries the original timestamp
+        stored = set()
+        if candidates:
+            stored = set(
+                RequestMetric.objects.filter(
+                    project=api_key.project,
+                    timestamp__in=set(candidates.values()),
+                    event_id__in=list(candidates),
+                ).values_list("event_id", "timestamp")
+            )
+
+        rows = []
+        for metric in metrics:
+            event_id = metric["event_id"]
+            if event_id:
+                if event_id not in batch_event_ids:
+                    # Repeated within the batch
+                    continue
+                if (event_id, batch_event_ids.pop(event_id)) in stored:
+                    continue
+
+            rows.append(RequestMetric(
+                project=api_key.project,
+                sample_rate=metric.pop("sample_rate") * quota_sample_rate,
+                **metric,
+            ))
+
+        # 3. Insert raw metrics
+        RequestMetric.objects.bulk_create(rows)
 
-        timestamp = parse_datetime(data["timestamp"])
-        if not timestamp:
+        # 4. Return immediately
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+def _parse_raw_metric(item):
+    """
+    Validate one raw metric.
+
+    Returns:
+        tuple: (RequestMetric field values, None) or (None, error message)
+    """
+    if not isinstance(item, dict):
+        return None, "Expected an object"
+
+    required_fields = ["endpoint", "status_code", "latency_ms", "timestamp"]
+    for field in required_fields:
+        if field not in item:
+            return None, f"Missing field: {field}"
+
+    if item["endpoint"] == ROLLUP_ENDPOINT:
+        return None, f"endpoint '{ROLLUP_ENDPOINT}' is reserved for the project rollup"
+    if item["endpoint"] == OVERFLOW_ENDPOINT:
+        return None, f"endpoint '{OVERFLOW_ENDPOINT}' is reserved for folded endpoints"
+
+    timestamp = parse_datetime(str(item["timestamp"]))
+    if not timestamp:
+        return None, "Invalid timestamp format"
+
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
+
+    # Client-side sampling: each stored row stands for 1 / sample_rate requests
+    try:
+        sample_rate = float(item.get("sample_rate", 1.0))
+    except (TypeError, ValueError):
+        sample_rate = 0.0
+    if not 0 < sample_rate <= 1:
+        return None, "sample_rate must be in (0, 1]"
+
+    event_id = item.get("event_id") or ""
+    if not isinstance(event_id, str) or len(event_id) > 64:
+        return None, "event_id must be a string of at most 64 characters"
+
+    return {
+        "endpoint": item["endpoint"],
+        "method": item.get("method", "GET"),
+        "status_code": item["status_code"],
+        "latency_ms": item["latency_ms"],
+        "timestamp": timestamp,
+        "sample_rate": sample_rate,
+        "event_id": event_id,
+    }, None
+
+
+class IngestAggregatedMetricView(APIView):
+    """
+    Ingest pre-aggregated per-(endpoint, minute) data from local agents.
+
+    Accepts a single object or a list (optionally wrapped as {"metrics": [...]})
+    of up to INGEST_MAX_BATCH_SIZE objects with:
+        endpoint, bucket_start (minute), request_count, error_count,
+        latency_histogram: [[upper_bound_ms, count], ...]
+
+    Submissions are merged straight into AggregatedMetric; policies are
+    evaluated asynchronously on the touched rows.
+    """
+    authentication_classes = []
+    permission_classes = []
+    parser_classes = [CompressedJSONParser]
+
+    def post(self, request):
+        data = request.data
+        if isinstance(data, dict) and "metrics" in data:
+            data = data["metrics"]
+        if isinstance(data, dict):
+            data = [data]
+        if not isinstance(data, list) or not data:
             return Response(
-                {"error": "Invalid timestamp format"},
+                {"error": "Expected a non-empty list of metrics"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        
-        if timezone.is_naive(timestamp):
-            timestamp = timezone.make_aware(timestamp, dt_timezone.utc)
-
-
-        # 3. Insert raw metric
-        RequestMetric.objects.create(
-            project=api_key.project,
-            endpoint=data["endpoint"],
-            method=data.get("method", "GET"),
-            status_code=data["status_code"],
-            latency_ms=data["latency_ms"],
-            timestamp=timestamp,
+
+        max_batch_size = getattr(settings, "INGEST_MAX_BATCH_SIZE", 1000)
+        if len(data) > max_batch_size:
+            return Response(
+                {"error": f"At most {max_batch_size} metrics per request"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        api_key, _, error_response = _authorize_ingest(
+            request, cost=len(data), allow_sampling=False
         )
+        if error_response is not None:
+            return error_response
+
+        submissions = []
+        for index, item in enumerate(data):
+            submission, error = _parse_aggregated_submission(item)
+            if error:
+                return Response(
+                    {"error": f"metrics[{index}]: {error}"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            submissions.append(submission)
+
+        with transaction.atomic():
+            touched = merge_preaggregated(api_key.project_id, submissions)
+
+            metric_ids = [m.id for m in touched]
+            transaction.on_commit(
+                lambda: evaluate_aggregated_metrics_task.delay(metric_ids)
+            )
 
-        # 4. Return immediately
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+def _parse_aggregated_submission(item):
+    """
+    Validate one pre-aggregated submission.
+
+    Returns:
+        tuple: (submission dict, None) or (None, error message)
+    """
+    if not isinstance(item, dict):
+        return None, "must be an object"
+
+    for field in ["endpoint", "bucket_start", "request_count", "error_count"]:
+        if field not in item:
+            return None, f"Missing field: {field}"
+
+    if str(item["endpoint"]) == ROLLUP_ENDPOINT:
+        return None, f"endpoint '{ROLLUP_ENDPOINT}' is reserved for the project rollup"
+    if str(item["endpoint"]) == OVERFLOW_ENDPOINT:
+        return None, f"endpoint '{OVERFLOW_ENDPOINT}' is reserved for folded endpoints"
+
+    bucket_start = parse_datetime(str(item["bucket_start"]))
+    if not bucket_start:
+        return None, "Invalid bucket_start format"
+    if timezone.is_naive(bucket_start):
+        bucket_start = timezone.make_aware(bucket_start, dt_timezone.utc)
+
+    try:
+        request_count = int(item["request_count"])
+        error_count = int(item["error_count"])
+    except (TypeError, ValueError):
+        return None, "request_count and error_count must be integers"
+    if request_count < 0 or not 0 <= error_count <= request_count:
+        return None, "error_count must be between 0 and request_count"
+
+    # Optional {"2xx": n, "3xx": n, "4xx": n}; 5xx is error_count
+    status_counts = None
+    if item.get("status_counts") is not None:
+        try:
+            status_counts = {
+                field: int(item["status_counts"].get(field[len("status_"):-len("_count")], 0))
+                for field in STATUS_CLASS_FIELDS
+            }
+        except (AttributeError, TypeError, ValueError):
+            return None, "status_counts must map 2xx, 3xx and 4xx to integers"
+        if min(status_counts.values()) < 0 or sum(status_counts.values()) + error_count > request_count:
+            return None, "status_counts and error_count must add up to at most request_count"
+
+    sketch = LatencySketch()
+    try:
+        for upper_bound, count in item.get("latency_histogram", []):
+            sketch.add(float(upper_bound), int(count))
+    except (TypeError, ValueError):
+        return None, "latency_histogram must be a list of [upper_bound_ms, count]"
+
+    return {
+        "endpoint": str(item["endpoint"])[:255],
+        "bucket_start": get_bucket_start(bucket_start, BUCKET_DEFINITIONS["1m"]),
+        "request_count": request_count,
+        "error_count": error_count,
+        "status_counts": status_counts,
+        "sketch": sketch,
+    }, None
+
+
 @permission_classes([AllowAny])
 @api_view(["GET"])
 def list_projects(request):
@@ -149,6 +448,76 @@ def list_raw_metrics(request, project_id):
 
     return Response(data)
 
+def _parse_to_utc(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if not parsed:
+        return "invalid"
+    if timezone.is_naive(parsed):
+        return timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed.astimezone(dt_timezone.utc)
+
+@permission_classes([AllowAny])
+@api_view(["GET"])
+def query_archived_metrics(request, project_id):
+    """
+    Ad-hoc query over the columnar raw-metric archive.
+
+    Query params: from, to (required), endpoint, method, status_min,
+    status_max, min_latency_ms, limit (max 1000 rows, slowest first).
+    """
+    project = get_object_or_404(
+        Project,
+        id=project_id,
+    )
+
+    start_dt = _parse_to_utc(request.GET.get("from"))
+    end_dt = _parse_to_utc(request.GET.get("to"))
+
+    if not start_dt or not end_dt:
+        return Response(
+            {"error": "from and to are required"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if start_dt == "invalid" or end_dt == "invalid":
+        return Response(
+            {"error": "Invalid datetime format"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        int_params = {
+            name: int(request.GET[name])
+            for name in ["status_min", "status_max", "min_latency_ms", "limit"]
+            if name in request.GET
+        }
+    except ValueError:
+        return Response(
+            {"error": "status_min, status_max, min_latency_ms and limit must be integers"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if int_params.get("limit", 0) < 0:
+        return Response(
+            {"error": "limit must not be negative"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    int_params["limit"] = min(int_params.get("limit", 0), 1000)
+
+    result = query_archive(
+        project.id,
+        start_dt,
+        end_dt,
+        endpoint=request.GET.get("endpoint"),
+        method=request.GET.get("method"),
+        **int_params,
+    )
+
+    return Response(result)
+
 @permission_classes([AllowAny])
 @api_view(["GET"])
 def list_aggregated_metrics(request, project_id):
@@ -161,24 +530,14 @@ def list_aggregated_metrics(request, project_id):
     start = request.GET.get("from")
     end = request.GET.get("to")
 
-    if bucket not in {"1m", "5m", "1h"}:
+    if bucket not in {"1m", "5m", "1h", "1d", "1w"}:
         return Response(
             {"error": "Invalid bucket value"},
             status=status.HTTP_400_BAD_REQUEST,
         )
 
-    def parse_to_utc(value):
-        if not value:
-            return None
-        parsed = parse_datetime(value)
-        if not parsed:
-            return "invalid"
-        if timezone.is_naive(parsed):
-            return timezone.make_aware(parsed, dt_timezone.utc)
-        return parsed.astimezone(dt_timezone.utc)
-
-    start_dt = parse_to_utc(start)
-    end_dt = parse_to_utc(end)
+    start_dt = _parse_to_utc(start)
+    end_dt = _parse_to_utc(end)
 
     if start_dt == "invalid" or end_dt == "invalid":
         return Response(
@@ -191,6 +550,14 @@ def list_aggregated_metrics(request, project_id):
         bucket_size=bucket,
     )
 
+    # Every endpoint's series by default; the project rollup only when asked
+    # for with ?endpoint=*, so totals summed by clients don't count it twice
+    endpoint = request.GET.get("endpoint")
+    if endpoint:
+        qs = qs.filter(endpoint=endpoint)
+    else:
+        qs = qs.exclude(endpoint=ROLLUP_ENDPOINT)
+
     if start_dt:
         qs = qs.filter(bucket_start__gte=start_dt)
     if end_dt:
@@ -200,10 +567,16 @@ def list_aggregated_metrics(request, project_id):
 
     return Response([
         {
+            "endpoint": m.endpoint,
             "bucket_start": m.bucket_start,
             "request_count": m.request_count,
             "error_count": m.error_count,
             "p95_latency_ms": m.p95_latency_ms,
+            "status_2xx_count": m.status_2xx_count,
+            "status_3xx_count": m.status_3xx_count,
+            "status_4xx_count": m.status_4xx_count,
+            "method_breakdown": m.method_breakdown,
+            "exemplars": m.exemplars,
         }
         for m in qs
     ])
@@ -215,7 +588,7 @@ def get_policies(request, project_id):
         Project, id=project_id
     )
     if request.method == "GET":
-        policies = AlertPolicy.objects.filter(project=project)
+        policies = AlertPolicy.objects.filter(project=project).prefetch_related("channels")
 
         return Response([
             {
@@ -225,8 +598,19 @@ def get_policies(request, project_id):
                 "comparison": p.comparison,
                 "threshold": p.threshold,
                 "cooldown_minutes": p.cooldown_minutes,
+                "resolve_after_buckets": p.resolve_after_buckets,
+                "condition": p.condition,
+                "window_minutes": p.window_minutes,
+                "for_duration_minutes": p.for_duration_minutes,
+                "short_window_minutes": p.short_window_minutes,
+                "slo_target": p.slo_target,
+                "seasonal": p.seasonal,
+                "endpoint_pattern": p.endpoint_pattern,
+                "endpoint_match": p.endpoint_match,
+                "bucket_size": p.bucket_size,
                 "severity": p.severity,
                 "is_active": p.is_active,
+                "channels": [c.id for c in p.channels.all()],
             }
             for p in policies
         ])
@@ -251,9 +635,9 @@ def get_policies(request, project_id):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if metric not in ["latency_p95", "error_rate", "throughput"]:
+        if metric not in ["latency_p95", "error_rate", "client_error_rate", "success_rate", "throughput"]:
             return Response(
-                {"error": "metric must be one of: latency_p95, error_rate, throughput"},
+                {"error": "metric must be one of: latency_p95, error_rate, client_error_rate, success_rate, throughput"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -263,9 +647,9 @@ def get_policies(request, project_id):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if comparison not in [">", "<"]:
+        if comparison not in [">", "<", "anomaly"]:
             return Response(
-                {"error": "comparison must be > or <"},
+                {"error": "comparison must be >, < or anomaly"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
@@ -290,6 +674,126 @@ def get_policies(request, project_id):
         # Get cooldown_minutes (default to 15)
         cooldown_minutes = request.data.get("cooldown_minutes", 15)
 
+        # Consecutive healthy buckets (of the policy's bucket size) before a firing alert resolves
+        try:
+            resolve_after_buckets = int(request.data.get("resolve_after_buckets", 3))
+        except (TypeError, ValueError):
+            resolve_after_buckets = 0
+        if resolve_after_buckets < 1:
+            return Response(
+                {"error": "resolve_after_buckets must be a positive integer"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Windowed conditions: sustained threshold or SLO burn rate
+        condition = request.data.get("condition", "threshold")
+        if condition not in ["threshold", "burn_rate"]:
+            return Response(
+                {"error": "condition must be one of: threshold, burn_rate"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            window_minutes = int(request.data.get("window_minutes", 60 if condition == "burn_rate" else 1))
+            for_duration_minutes = int(request.data.get("for_duration_minutes", window_minutes))
+            short_window_minutes = request.data.get("short_window_minutes")
+            short_window_minutes = int(short_window_minutes) if short_window_minutes is not None else None
+            slo_target = request.data.get("slo_target")
+            slo_target = float(slo_target) if slo_target is not None else None
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "window_minutes, for_duration_minutes, short_window_minutes and slo_target must be numbers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        max_window = getattr(settings, "ALERT_WINDOW_MAX_MINUTES", 1440)
+        if not 1 <= window_minutes <= max_window:
+            return Response(
+                {"error": f"window_minutes must be between 1 and {max_window}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if not 1 <= for_duration_minutes <= window_minutes:
+            return Response(
+                {"error": "for_duration_minutes must be between 1 and window_minutes"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if condition == "burn_rate":
+            if slo_target is None or not 0 < slo_target < 1:
+                return Response(
+                    {"error": "slo_target is required for burn_rate and must be between 0 and 1"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if short_window_minutes is not None and not 1 <= short_window_minutes <= window_minutes:
+                return Response(
+                    {"error": "short_window_minutes must be between 1 and window_minutes"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        # Anomaly policies: threshold is the number of standard deviations
+        seasonal = str(request.data.get("seasonal", False)).lower() in ("1", "true", "yes")
+        if comparison == "anomaly":
+            if float(threshold) <= 0:
+                return Response(
+                    {"error": "threshold must be a positive number of standard deviations for anomaly policies"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            if condition == "burn_rate":
+                return Response(
+                    {"error": "burn_rate policies can't use the anomaly comparison"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+
+        # Optional scope: which endpoints and bucket size the policy applies to
+        endpoint_pattern = (request.data.get("endpoint_pattern") or "").strip()
+        endpoint_match = request.data.get("endpoint_match", "exact")
+        bucket_size = request.data.get("bucket_size", "1m")
+        if bucket_size is None:
+            bucket_size = ""
+
+        if endpoint_match not in ["exact", "prefix", "glob"]:
+            return Response(
+                {"error": "endpoint_match must be one of: exact, prefix, glob"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if len(endpoint_pattern) > 255:
+            return Response(
+                {"error": "endpoint_pattern must be at most 255 characters"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if endpoint_match == "glob" and endpoint_pattern and not any(c in endpoint_pattern for c in "*?["):
+            return Response(
+                {"error": "glob endpoint_pattern must contain *, ? or [; use exact otherwise"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        if bucket_size not in ["", "1m", "5m", "1h"]:
+            return Response(
+                {"error": "bucket_size must be one of: 1m, 5m, 1h, or empty for any"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Ring buffers and baselines are fed by 1m buckets only
+        if bucket_size in ["5m", "1h"] and (
+            condition == "burn_rate" or window_minutes > 1 or comparison == "anomaly"
+        ):
+            return Response(
+                {"error": "windowed, burn_rate and anomaly policies are evaluated on 1m buckets; use bucket_size 1m or empty"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Optional notification channels (ids of this project's channels)
+        channel_ids = request.data.get("channels") or []
+        channels = list(NotificationChannel.objects.filter(project=project, id__in=channel_ids))
+        if len(channels) != len(set(channel_ids)):
+            return Response(
+                {"error": "channels must be ids of this project's notification channels"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         # Create the alert policy
         policy = AlertPolicy.objects.create(
             project=project,
@@ -299,8 +803,19 @@ def get_policies(request, project_id):
             threshold=float(threshold),
             severity=severity,
             cooldown_minutes=cooldown_minutes,
+            resolve_after_buckets=resolve_after_buckets,
+            condition=condition,
+            window_minutes=window_minutes,
+            for_duration_minutes=for_duration_minutes,
+            short_window_minutes=short_window_minutes,
+            slo_target=slo_target,
+            seasonal=seasonal,
+            endpoint_pattern=endpoint_pattern,
+            endpoint_match=endpoint_match,
+            bucket_size=bucket_size,
             is_active=True,
         )
+        policy.channels.set(channels)
 
         return Response(
             {
@@ -311,11 +826,100 @@ def get_policies(request, project_id):
                 "threshold": policy.threshold,
                 "severity": policy.severity,
                 "cooldown_minutes": policy.cooldown_minutes,
+                "resolve_after_buckets": policy.resolve_after_buckets,
+                "condition": policy.condition,
+                "window_minutes": policy.window_minutes,
+                "for_duration_minutes": policy.for_duration_minutes,
+                "short_window_minutes": policy.short_window_minutes,
+                "slo_target": policy.slo_target,
+                "seasonal": policy.seasonal,
+                "endpoint_pattern": policy.endpoint_pattern,
+                "endpoint_match": policy.endpoint_match,
+                "bucket_size": policy.bucket_size,
                 "is_active": policy.is_active,
+                "channels": [c.id for c in channels],
             },
             status=status.HTTP_201_CREATED,
         )
 
+@permission_classes([AllowAny])
+@api_view(["GET", "POST"])
+def notification_channels(request, project_id):
+    project = get_object_or_404(
+        Project, id=project_id
+    )
+    if request.method == "GET":
+        channels = NotificationChannel.objects.filter(project=project).order_by("id")
+
+        return Response([
+            {
+                "id": c.id,
+                "name": c.name,
+                "kind": c.kind,
+                "target": c.target,
+                "max_concurrency": c.max_concurrency,
+                "is_active": c.is_active,
+            }
+            for c in channels
+        ])
+
+    name = request.data.get("name")
+    kind = request.data.get("kind")
+    target = request.data.get("target")
+
+    if not name:
+        return Response(
+            {"error": "name is required"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    if kind not in ["email", "webhook", "slack"]:
+        return Response(
+            {"error": "kind must be one of: email, webhook, slack"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        if kind == "email":
+            validate_email(target)
+        else:
+            URLValidator(schemes=["http", "https"])(target)
+    except ValidationError:
+        return Response(
+            {"error": "target must be an email address for email channels and a URL otherwise"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    try:
+        max_concurrency = int(request.data.get("max_concurrency", 4))
+    except (TypeError, ValueError):
+        max_concurrency = 0
+    if max_concurrency < 1:
+        return Response(
+            {"error": "max_concurrency must be a positive integer"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    channel = NotificationChannel.objects.create(
+        project=project,
+        name=name,
+        kind=kind,
+        target=target,
+        max_concurrency=max_concurrency,
+    )
+
+    return Response(
+        {
+            "id": channel.id,
+            "name": channel.name,
+            "kind": channel.kind,
+            "target": channel.target,
+            "max_concurrency": channel.max_concurrency,
+            "is_active": channel.is_active,
+        },
+        status=status.HTTP_201_CREATED,
+    )
+
 @permission_classes([AllowAny])
 @api_view(["GET"])
 def get_alerts(request, project_id):
@@ -330,13 +934,41 @@ def get_alerts(request, project_id):
         .order_by("-triggered_at")
     )
 
+    # Firing alerts only; served from the partial index on unresolved alerts
+    if request.query_params.get("active_only", "").lower() in ("1", "true", "yes"):
+        alerts = alerts.filter(resolved=False)
+
     return Response([
         {
+            "id": a.id,
             "metric": a.policy.metric,
             "threshold": a.policy.threshold,
             "value": a.value,
             "severity": a.policy.severity,
             "triggered_at": a.triggered_at,
+            "resolved": a.resolved,
+            "resolved_at": a.resolved_at,
+            "exemplars": a.exemplars,
         }
         for a in alerts
-    ])
\ No newline at end of file
+    ])
+
+def prometheus_metrics(request):
+    """Task instrumentation in the Prometheus text exposition format."""
+    return HttpResponse(
+        render_prometheus(get_task_metrics()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+@permission_classes([AllowAny])
+@api_view(["GET"])
+def system_health(request):
+    """Pipeline self-monitoring: ingest rate, aggregation lag, queues, tasks."""
+    health = collect_pipeline_health()
+    lag = health["aggregation"]["lag_seconds"]
+    health["status"] = (
+        "degraded"
+        if lag is not None and lag > settings.HEALTH_MAX_AGGREGATION_LAG_SECONDS
+        else "ok"
+    )
+    return Response(health)
@@ -0,0 +1,338 @@
+"""
+Ring buffers of recent per-minute values for windowed alert conditions.
+
+A policy like "p95 > 500ms for 5 of the last 10 minutes" or a multi-window
+burn rate needs the last N minutes of a series. Instead of re-querying
+AggregatedMetric on every evaluation, the evaluator records each new 1m
+bucket into a fixed-size ring buffer (slot = minute % size). Next to the
+buffer, running sums of the values are kept per window length, and only
+those sums are read back, in the same round-trip.
+
+Key properties:
+- O(1) updates and reads: one slot is overwritten per bucket and the sums
+  are adjusted by the new value and by the minutes that left each window
+  (a single EVALSHA on Redis); the buffer itself is never read back
+- Idempotent: re-evaluating a bucket replaces its slot's contribution to the
+  sums with the same value
+- Shared when possible: buffers live in Redis hashes (one per series, with a
+  TTL of the window length) so every worker sees the same history; without
+  Redis each worker keeps its own bounded in-memory buffers
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+WINDOW_KEY_PREFIX = "alertwindow:"
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of (minute, values) pairs, one slot per minute modulo
+    size, with running sums of the values over each window length. Windows
+    end at the newest minute recorded.
+
+    Args:
+        size: Number of minutes kept
+        windows: Window lengths in minutes, each at most size
+        width: Number of values per minute
+    """
+
+    def __init__(self, size: int, windows, width: int):
+        self.size = size
+        self.windows = tuple(windows)
+        self.width = width
+        self.newest = None
+        self._slots = [None] * size
+        self._sums = {window: [0] * width for window in self.windows}
+
+    def _add(self, window: int, values, sign: int) -> None:
+        sums = self._sums[window]
+        for i, value in enumerate(values):
+            sums[i] += sign * value
+
+    def put(self, minute: int, values) -> None:
+        slot = minute % self.size
+
+        if self.newest is None or minute > self.newest:
+            for window in self._sums:
+                if self.newest is None or minute - self.newest >= window:
+                    self._sums[window] = [0] * self.width
+                else:
+                    # Minutes (newest - window, minute - window] leave the window
+                    for left in range(self.newest - window + 1, minute - window + 1):
+                        entry = self._slots[left % self.size]
+                        if entry is not None and entry[0] == left:
+                            self._add(window, entry[1], -1)
+                self._add(window, values, 1)
+            self._slots[slot] = (minute, values)
+            self.newest = minute
+            return
+
+        if minute <= self.newest - self.size:
+            return
+
+        # Late or repeated bucket: swap its slot's contribution
+        current = self._slots[slot]
+        # Never let a late, older bucket overwrite a newer one in the same slot
+        if current is not None and current[0] > minute:
+            return
+        for window in self._sums:
+            if current is not None and current[0] > self.newest - window:
+                self._add(window, current[1], -1)
+            if minute > self.newest - window:
+                self._add(window, values, 1)
+        self._slots[slot] = (minute, values)
+
+    def entries(self) -> list:
+        return [entry for entry in self._slots if entry is not None]
+
+    def sums(self) -> dict:
+        return {window: list(sums) for window, sums in self._sums.items()}
+
+
+class LocalWindowStore:
+    """Per-process ring buffers, LRU-bounded by number of series."""
+
+    def __init__(self, max_series: int = 10000):
+        self.max_series = max_series
+        self._lock = threading.Lock()
+        self._buffers = OrderedDict()
+
+    def record(self, key: str, size: int, minute: int, values, windows) -> dict:
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None or (buffer.size, buffer.windows, buffer.width) != (size, tuple(windows), len(values)):
+                # First write, or the policy's windows changed: replay the
+                # entries still inside the new buffer
+                previous = buffer
+                buffer = RingBuffer(size, windows, len(values))
+                if previous is not None and previous.width == len(values):
+                    for entry_minute, entry_values in sorted(previous.entries()):
+                        if entry_minute > previous.newest - size:
+                            buffer.put(entry_minute, entry_values)
+            self._buffers[key] = buffer
+            self._buffers.move_to_end(key)
+            while len(self._buffers) > self.max_series:
+                self._buffers.popitem(last=False)
+
+            buffer.put(minute, values)
+            return buffer.sums()
+
+
+# KEYS[1] = buffer hash
+# ARGV[1] = size, ARGV[2] = minute, ARGV[3] = values "v1|v2|...", ARGV[4] = ttl,
+# ARGV[5..] = window lengths
+# Hash fields: slot -> "minute|v1|v2|...", "newest" -> newest minute,
+# "sum:<window>" -> "s1|s2|...", "cfg" -> layout the sums were built for.
+# Writes the slot (unless it holds a newer minute), adjusts the sums and
+# returns them, one "s1|s2|..." per window
+RING_BUFFER_SCRIPT = """
+local key = KEYS[1]
+local size = tonumber(ARGV[1])
+local minute = tonumber(ARGV[2])
+local ttl = ARGV[4]
+
+local function parse(raw)
+    local values = {}
+    for item in string.gmatch(raw, '[^|]+') do
+        values[#values + 1] = tonumber(item)
+    end
+    return values
+end
+
+local function encode(values)
+    local parts = {}
+    for i, value in ipairs(values) do
+        parts[i] = string.format('%.17g', value)
+    end
+    return table.concat(parts, '|')
+end
+
+local function read_entry(raw)
+    if not raw then
+        return nil, nil
+    end
+    local values = parse(raw)
+    local entry_minute = table.remove(values, 1)
+    return entry_minute, values
+end
+
+local function write_entry(entry_minute, values)
+    redis.call('HSET', key, entry_minute % size, entry_minute .. '|' .. encode(values))
+end
+
+local value = parse(ARGV[3])
+local windows = {}
+for i = 5, #ARGV do
+    windows[#windows + 1] = tonumber(ARGV[i])
+end
+
+local function zeros()
+    local values = {}
+    for i = 1, #value do
+        values[i] = 0
+    end
+    return values
+end
+
+local function add(sums, values, sign)
+    for i = 1, #sums do
+        sums[i] = sums[i] + sign * (values[i] or 0)
+    end
+end
+
+local cfg = size .. ':' .. #value .. ':' .. table.concat(windows, ',')
+local state = redis.call('HMGET', key, 'cfg', 'newest')
+local newest = tonumber(state[2])
+local sums = {}
+
+if state[1] ~= cfg then
+    -- First write, or the policy's windows changed: rebuild from the
+    -- entries still inside the new buffer
+    local entries = {}
+    if newest then
+        local flat = redis.call('HGETALL', key)
+        for i = 1, #flat, 2 do
+            if tonumber(flat[i]) then
+                local entry_minute, values = read_entry(flat[i + 1])
+                if entry_minute > newest - size and #values == #value then
+                    entries[#entries + 1] = {entry_minute, values}
+                end
+            end
+        end
+    end
+    redis.call('DEL', key)
+    for w = 1, #windows do
+        sums[w] = zeros()
+    end
+    for _, entry in ipairs(entries) do
+        write_entry(entry[1], entry[2])
+        for w, window in ipairs(windows) do
+            if entry[1] > newest - window then
+                add(sums[w], entry[2], 1)
+            end
+        end
+    end
+    if newest and #entries > 0 then
+        redis.call('HSET', key, 'newest', newest)
+    else
+        newest = nil
+    end
+    redis.call('HSET', key, 'cfg', cfg)
+else
+    for w, window in ipairs(windows) do
+        sums[w] = parse(redis.call('HGET', key, 'sum:' .. window))
+    end
+end
+
+if newest == nil or minute > newest then
+    for w, window in ipairs(windows) do
+        if newest == nil or minute - newest >= window then
+            sums[w] = zeros()
+        else
+            -- Minutes (newest - window, minute - window] leave the window
+            for left = newest - window + 1, minute - window do
+                local entry_minute, values = read_entry(redis.call('HGET', key, left % size))
+                if entry_minute == left then
+                    add(sums[w], values, -1)
+                end
+            end
+        end
+        add(sums[w], value, 1)
+    end
+    write_entry(minute, value)
+    redis.call('HSET', key, 'newest', minute)
+elseif minute > newest - size then
+    -- Late or repeated bucket: swap its slot's contribution, unless the
+    -- slot holds a newer minute
+    local current_minute, current = read_entry(redis.call('HGET', key, minute % size))
+    if current_minute == nil or current_minute <= minute then
+        for w, window in ipairs(windows) do
+            if current_minute ~= nil and current_minute > newest - window then
+                add(sums[w], current, -1)
+            end
+            if minute > newest - window then
+                add(sums[w], value, 1)
+            end
+        end
+        write_entry(minute, value)
+    end
+end
+
+local result = {}
+for w, window in ipairs(windows) do
+    result[w] = encode(sums[w])
+    redis.call('HSET', key, 'sum:' .. window, result[w])
+end
+redis.call('EXPIRE', key, ttl)
+return result
+"""
+
+_ring_buffer_script = None
+
+
+class RedisWindowStore:
+    """Ring buffers stored as Redis hashes, with their running sums."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def record(self, key: str, size: int, minute: int, values, windows) -> dict:
+        global _ring_buffer_script
+
+        if _ring_buffer_script is None:
+            _ring_buffer_script = self.client.register_script(RING_BUFFER_SCRIPT)
+
+        encoded = _ring_buffer_script(
+            keys=[WINDOW_KEY_PREFIX + key],
+            args=[size, minute, "|".join(repr(float(v)) for v in values), (size + 1) * 60, *windows],
+            client=self.client,
+        )
+        sums = {}
+        for window, raw in zip(windows, encoded):
+            if isinstance(raw, bytes):
+                raw = raw.decode()
+            sums[window] = [float(item) for item in raw.split("|")]
+        return sums
+
+
+_local_store = LocalWindowStore()
+
+
+def record_value(key: str, size: int, minute: int, values, windows=None) -> dict:
+    """
+    Write values for minute into the series' ring buffer and return the sums
+    of each value over the requested windows.
+
+    Windows end at the newest minute recorded, so a late bucket is counted
+    in (and read back from) the current windows.
+
+    Args:
+        key: Series identifier
+        size: Ring buffer size in minutes (the longest window read from it)
+        minute: Bucket start in whole minutes since the epoch
+        values: List of numbers to sum, the same length on every call
+        windows: Window lengths in minutes (default: [size]); capped at size
+
+    Returns:
+        dict[int, list[float]]: window length -> per-value sums
+    """
+    size = max(1, min(size, getattr(settings, "ALERT_WINDOW_MAX_MINUTES", 1440)))
+    windows = sorted({max(1, min(window, size)) for window in (windows or [size])})
+
+    client = get_redis()
+    if client is not None:
+        try:
+            return RedisWindowStore(client).record(key, size, minute, values, windows)
+        except redis.RedisError as e:
+            logger.warning(f"Alert window store falling back to memory: {e}")
+
+    return _local_store.record(key, size, minute, values, windows)
@@ -0,0 +1,16 @@
+"""
+Python client for the API monitoring ingest API.
+
+    from apimon import MetricsClient, MetricsWSGIMiddleware
+
+    client = MetricsClient("<api key>", url="https://monitor.example.com/api/ingest/")
+    app = MetricsWSGIMiddleware(app, client)
+
+See apimon.django for Django and apimon.asgi for ASGI applications.
+"""
+
+from .asgi import MetricsASGIMiddleware
+from .client import MetricsClient
+from .wsgi import MetricsWSGIMiddleware
+
+__all__ = ["MetricsASGIMiddleware", "MetricsClient", "MetricsWSGIMiddleware"]
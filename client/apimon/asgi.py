@@ -0,0 +1,52 @@
+"""
+ASGI middleware recording one metric per HTTP request.
+
+Latency runs until the application returns, i.e. after the last body
+chunk was sent. Non-HTTP scopes (websocket, lifespan) pass through.
+"""
+
+import time
+
+
+def _default_endpoint(scope):
+    return scope.get("path") or "/"
+
+
+class MetricsASGIMiddleware:
+    """
+    Args:
+        app: ASGI application
+        client: MetricsClient
+        endpoint_name: Maps the scope to the recorded endpoint; defaults to
+            the path. Return a route template (e.g. "/orders/{id}") to keep
+            ids out of endpoint names.
+    """
+
+    def __init__(self, app, client, endpoint_name=None):
+        self.app = app
+        self.client = client
+        self.endpoint_name = endpoint_name or _default_endpoint
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        response_status = 500
+
+        async def recording_send(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            self.client.record(
+                self.endpoint_name(scope),
+                scope.get("method", "GET"),
+                response_status,
+                (time.perf_counter() - started) * 1000,
+            )
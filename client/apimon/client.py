@@ -0,0 +1,271 @@
+"""
+Batching metrics client.
+
+record() only appends the event to a bounded in-memory buffer; a daemon
+thread drains it and POSTs gzip-compressed batches to the ingest endpoint
+(/api/ingest/). The request path of the monitored service never waits on the
+network.
+
+Key properties:
+- Non-blocking: record() is a deque append (no lock, no I/O); when the
+  buffer is full the event is dropped and counted
+- Batches by size (batch_size events) and by time (flush_interval seconds)
+- Retries with exponential backoff and jitter, honoring Retry-After on 429
+  and 503; every event carries an event_id, so a retried batch is
+  deduplicated server side
+- Fork-safe: a forked child (gunicorn/uwsgi workers) starts its own sender
+- Standard library only
+"""
+
+import atexit
+import collections
+import gzip
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger("apimon")
+
+DEFAULT_URL = "http://localhost:8000/api/ingest/"
+
+
+class MetricsClient:
+    """
+    Buffers request metrics and ships them in the background.
+
+    Args:
+        api_key: Project API key
+        url: Raw ingest endpoint
+        batch_size: Events per request; at most the project's ingest burst
+            and the server's INGEST_MAX_BATCH_SIZE (a batch answered with
+            413 is split and batch_size lowered)
+        flush_interval: Seconds between flushes of a partial batch
+        max_queue_size: Events buffered before new ones are dropped
+        max_retries: Retries of a failed batch before it is dropped
+        backoff: First retry delay in seconds, doubled per retry
+        max_backoff: Cap on a single retry delay
+        timeout: HTTP timeout in seconds
+        compress: gzip request bodies
+        sample_rate: Fraction of requests recorded; the server weights each
+            stored one by 1 / sample_rate
+    """
+
+    def __init__(
+        self,
+        api_key,
+        url=DEFAULT_URL,
+        batch_size=200,
+        flush_interval=1.0,
+        max_queue_size=10000,
+        max_retries=3,
+        backoff=0.5,
+        max_backoff=30.0,
+        timeout=5.0,
+        compress=True,
+        sample_rate=1.0,
+    ):
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate must be in (0, 1]")
+
+        self.api_key = api_key
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.compress = compress
+        self.sample_rate = sample_rate
+
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.close)
+
+    def _reset(self):
+        """Fresh buffer, counters and (not yet started) sender thread."""
+        self._buffer = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._sending = False
+        self._stats = {"sent": 0, "dropped": 0, "rejected": 0, "failed": 0}
+
+    def record(self, endpoint, method, status_code, latency_ms, timestamp=None):
+        """
+        Queue one request's metric. Never blocks and never raises on
+        overload.
+
+        Args:
+            endpoint: Route or path, e.g. "/api/orders/<id>"
+            method: HTTP method
+            status_code: Response status
+            latency_ms: Request latency in milliseconds
+            timestamp: Unix time of the request; defaults to now
+        """
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+
+        if len(self._buffer) >= self.max_queue_size:
+            self._count("dropped")
+            return
+
+        if self._thread is None:
+            self._start()
+
+        self._buffer.append((
+            endpoint,
+            method,
+            status_code,
+            latency_ms,
+            time.time() if timestamp is None else timestamp,
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def stats(self):
+        """Counters: queued, sent, dropped (buffer full), rejected (4xx), failed."""
+        with self._stats_lock:
+            return {"queued": len(self._buffer), **self._stats}
+
+    def flush(self, timeout=5.0):
+        """Send everything buffered so far. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        self._wakeup.set()
+        while self._buffer or self._sending:
+            if self._thread is None or time.monotonic() >= deadline:
+                return not (self._buffer or self._sending)
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout=5.0):
+        """Flush and stop the sender thread."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        thread.join(timeout)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="apimon-sender", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        while self._buffer:
+            self._sending = True
+            try:
+                batch = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+                self._send(batch)
+            except Exception:
+                # The sender must survive anything a batch can throw
+                logger.exception("apimon: dropping batch after unexpected error")
+                self._count("failed", len(batch))
+            finally:
+                self._sending = False
+
+    def _encode(self, batch):
+        metrics = [
+            {
+                "endpoint": endpoint,
+                "method": method,
+                "status_code": status_code,
+                "latency_ms": int(round(latency_ms)),
+                "timestamp": datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+                "sample_rate": self.sample_rate,
+                # Same id on every retry of this batch
+                "event_id": uuid.uuid4().hex,
+            }
+            for endpoint, method, status_code, latency_ms, timestamp in batch
+        ]
+        body = json.dumps({"metrics": metrics}, separators=(",", ":")).encode()
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        if self.compress:
+            body = gzip.compress(body, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return body, headers
+
+    def _post(self, body, headers):
+        """Returns (status code or None on a network error, Retry-After seconds)."""
+        request = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            return e.code, retry_after
+        except (urllib.error.URLError, OSError) as e:
+            logger.debug(f"apimon: ingest unreachable: {e}")
+            return None, None
+
+    def _send(self, batch):
+        body, headers = self._encode(batch)
+
+        for attempt in range(self.max_retries + 1):
+            status, retry_after = self._post(body, headers)
+
+            if status is not None and status < 300:
+                self._count("sent", len(batch))
+                return
+
+            if status == 413 and len(batch) > 1:
+                # Larger than the project's burst or the server's batch
+                # cap: split, and keep later batches at the smaller size
+                half = len(batch) // 2
+                self.batch_size = min(self.batch_size, half)
+                self._send(batch[:half])
+                self._send(batch[half:])
+                return
+
+            if status is not None and 400 <= status < 500 and status != 429:
+                # Retrying won't help (bad key, invalid payload, ...)
+                logger.warning(f"apimon: ingest rejected {len(batch)} metrics with {status}")
+                self._count("rejected", len(batch))
+                return
+
+            if attempt == self.max_retries:
+                break
+
+            delay = retry_after
+            if delay is None:
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            # Don't hold up shutdown with long sleeps; the remaining retries
+            # then run back to back
+            self._stopping.wait(min(delay, self.max_backoff))
+
+        logger.warning(f"apimon: dropping {len(batch)} metrics after {self.max_retries} retries")
+        self._count("failed", len(batch))
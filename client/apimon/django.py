@@ -0,0 +1,97 @@
+"""
+Django middleware recording one metric per request.
+
+Configure it in the monitored project's settings:
+
+    MIDDLEWARE = ["apimon.django.MetricsMiddleware", ...]
+    APIMON_API_KEY = "..."
+    APIMON_URL = "https://monitor.example.com/api/ingest/"
+    APIMON_OPTIONS = {"sample_rate": 0.5}   # MetricsClient keyword arguments
+
+Put it first so the timing covers the other middleware. Endpoints are the
+matched URL patterns ("/api/orders/<int:pk>/"), never raw paths, so ids
+don't turn into separate series; unmatched requests are "<unmatched>".
+Without APIMON_API_KEY the middleware disables itself.
+"""
+
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .client import DEFAULT_URL, MetricsClient
+
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Process-wide MetricsClient built from settings, or None if unconfigured."""
+    global _client
+
+    api_key = getattr(settings, "APIMON_API_KEY", None)
+    if not api_key:
+        return None
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MetricsClient(
+                    api_key,
+                    url=getattr(settings, "APIMON_URL", DEFAULT_URL),
+                    **getattr(settings, "APIMON_OPTIONS", {}),
+                )
+    return _client
+
+
+def _endpoint(request):
+    match = request.resolver_match
+    if match is None or match.route is None:
+        return UNMATCHED_ENDPOINT
+    return f"/{match.route}"
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.client = get_client()
+        if self.client is None:
+            raise MiddlewareNotUsed("APIMON_API_KEY is not set")
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self._record(request, response, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self._record(request, response, started)
+
+    def _record(self, request, response, started):
+        self.client.record(
+            _endpoint(request),
+            request.method,
+            response.status_code if response is not None else 500,
+            (time.perf_counter() - started) * 1000,
+        )